@@ -0,0 +1,491 @@
+"""
+:platform: Unix, Windows
+:synopsis: This module contains the serial protocols used to get data from the ADC.
+    The original protocol polls the micro-controller for every sample. Newer firmware can instead return
+    several buffered samples per request, or stream samples continuously at a rate the host sets once.
+:moduleauthor: Michael Eller <mbe9a@virginia.edu>
+"""
+
+import time
+import multiprocessing
+from collections import deque
+import numpy as np
+import serial
+from settings_interface import get_acquisition_mode, get_batch_size, get_sample_rate
+from shared_buffer import SharedRingBuffer, default_capacity
+
+#: Writing this byte asks the micro-controller for the latest ADC value (polled protocol).
+#: It replies with a single line containing the value.
+poll_command = b'a'
+
+#: Prefix of the command that sets the rate at which the micro-controller fills its sample buffer.
+#: It is followed by the sample rate in samples / sec and a newline, e.g. b'r10\n'.
+rate_command = b'r'
+
+#: Prefix of the command that requests buffered samples (batched protocol). It is followed by the number of
+#: samples and a newline, e.g. b'b10\n'. The reply is a single line of comma separated values, oldest first.
+batch_command = b'b'
+
+#: Prefix of the command that starts streaming. It is followed by the sample rate in samples / sec
+#: and a newline, e.g. b's10\n'. The micro-controller then sends one line per sample until it is stopped.
+stream_start_command = b's'
+
+#: Writing this byte stops a running stream.
+stream_stop_command = b'x'
+
+
+def parse_counts(buf, sep=' '):
+    """
+    Parse a buffer of ASCII ADC values in one pass. Empty fields (a blank line, a trailing separator) are
+    skipped, and a field that isn't a number (e.g. bytes garbled on the serial link) is dropped instead of
+    raising, so a bad reply never stops the acquisition loop.
+
+    :param buf: bytes received from the serial port. Must only contain complete values.
+    :param sep: separator between values. The default ' ' matches any whitespace, e.g. '\\r\\n'.
+    :return: numpy integer array of ADC counts, may be empty
+    """
+
+    # garbled bytes can't be decoded as ASCII, they end up in a field that is dropped below
+    text = buf.decode('ascii', errors='replace')
+    if sep.isspace():
+        fields = text.split()
+    else:
+        fields = [field.strip() for field in text.split(sep)]
+        fields = [field for field in fields if field]
+
+    try:
+        return np.array(fields, dtype=np.int64)
+    except ValueError:
+        # only a malformed field is lost, parse the fields one by one and keep the ones that are numbers
+        return np.array([int(field) for field in fields if _is_count(field)], dtype=np.int64)
+
+
+def _is_count(field):
+    """
+    :param field: one field of a reply, stripped of whitespace
+    :return: bool indicating whether it is an integer
+    """
+    try:
+        int(field)
+    except ValueError:
+        return False
+    return True
+
+
+class PolledSource(object):
+    """
+    The original protocol. The host writes *poll_command* and blocks until the reply arrives.
+    This works with every firmware version, but every sample costs a full round-trip over the serial link.
+    """
+
+    #: the acquisition loop has to wait one interval between reads
+    paced = True
+    #: number of sample intervals covered by one read
+    samples_per_read = 1
+
+    def __init__(self, port):
+        """
+        :param port: open serial.Serial object connected to the ADC
+        """
+        self.port = port
+
+    def start(self, rate):
+        """
+        Nothing to set up, the micro-controller only answers requests.
+
+        :param rate: sample rate in samples / sec (unused)
+        """
+        pass
+
+    def read(self):
+        """
+        Request a single value from the ADC and wait for the reply.
+
+        :return: numpy integer array containing one ADC count
+        """
+
+        # request a new value from the ADC
+        self.port.write(poll_command)
+        # read from the serial port to get the value
+        return parse_counts(self.port.readline())
+
+    def stop(self):
+        """
+        Nothing to tear down.
+        """
+        pass
+
+
+class BatchedSource(object):
+    """
+    The batched protocol. The micro-controller samples into a buffer at the rate the host sets once,
+    and every request returns *batch_size* of those samples in a single line.
+    This keeps the request / reply structure of the polled protocol but pays the round-trip once per batch.
+    """
+
+    #: the acquisition loop has to wait one batch worth of intervals between reads
+    paced = True
+
+    def __init__(self, port, batch_size):
+        """
+        :param port: open serial.Serial object connected to the ADC
+        :param batch_size: number of samples returned by each request
+        """
+        self.port = port
+        self.samples_per_read = batch_size
+        # the request never changes, build it once
+        self._request = batch_command + str(int(batch_size)).encode('ascii') + b'\n'
+
+    def start(self, rate):
+        """
+        Tell the micro-controller the rate at which to fill its buffer.
+
+        :param rate: sample rate in samples / sec
+        """
+
+        # throw away anything left over from a previous connection
+        self.port.reset_input_buffer()
+        self.port.write(rate_command + str(int(rate)).encode('ascii') + b'\n')
+
+    def read(self):
+        """
+        Request a batch of buffered values and parse the reply in one pass.
+
+        :return: numpy integer array of ADC counts, oldest first
+        """
+        self.port.write(self._request)
+        return parse_counts(self.port.readline(), sep=',')
+
+    def stop(self):
+        """
+        Nothing to tear down, the micro-controller only answers requests.
+        """
+        pass
+
+
+class StreamingSource(object):
+    """
+    The streaming protocol. The host sends the sample rate once and the micro-controller pushes samples
+    continuously. Every read takes whatever has arrived in the input buffer and splits it into samples.
+    """
+
+    #: the micro-controller sets the pace, the acquisition loop must not sleep
+    paced = False
+    #: a read returns whatever has arrived
+    samples_per_read = 1
+
+    def __init__(self, port):
+        """
+        :param port: open serial.Serial object connected to the ADC
+        """
+        self.port = port
+        # incomplete line left over from the previous read
+        self._partial = b''
+
+    def start(self, rate):
+        """
+        Tell the micro-controller its sample rate and start the stream.
+
+        :param rate: sample rate in samples / sec
+        """
+
+        # throw away anything left over from a previous connection
+        self.port.reset_input_buffer()
+        self._partial = b''
+        self.port.write(stream_start_command + str(int(rate)).encode('ascii') + b'\n')
+
+    def read(self):
+        """
+        Read everything that is waiting in the input buffer (at least one byte, or until the port times out)
+        and return the complete samples it contains.
+
+        :return: numpy integer array of ADC counts, may be empty
+        """
+
+        # grab a chunk, this blocks until at least one byte arrives
+        chunk = self._partial + self.port.read(max(1, self.port.in_waiting))
+
+        # keep the trailing incomplete line for the next read
+        end = chunk.rfind(b'\n') + 1
+        self._partial = chunk[end:]
+
+        return parse_counts(chunk[:end])
+
+    def stop(self):
+        """
+        Stop the stream and drop any samples still in flight.
+        """
+        self.port.write(stream_stop_command)
+        self.port.reset_input_buffer()
+        self._partial = b''
+
+
+def make_source(port, mode=None, batch_size=None):
+    """
+    Create the data source for the configured acquisition mode.
+
+    :param port: open serial.Serial object connected to the ADC
+    :param mode: acquisition mode, read from the settings file if not given
+    :param batch_size: samples per request in the batched mode, read from the settings file if not given
+    :return: PolledSource, BatchedSource or StreamingSource
+    """
+    if mode is None:
+        mode = get_acquisition_mode()
+    if mode == "streaming":
+        return StreamingSource(port)
+    if mode == "batched":
+        if batch_size is None:
+            batch_size = get_batch_size()
+        return BatchedSource(port, batch_size)
+    return PolledSource(port)
+
+
+class DeadlineScheduler(object):
+    """
+    Paces the acquisition loop on a fixed grid of deadlines measured with a monotonic clock.
+    Sleeping a fixed interval after every read makes the real period interval + read time, which drifts over
+    a long run. Here every deadline is exactly one period after the previous one, no matter how long the work
+    in between took. The scheduler also keeps timing statistics that can be shown to the user.
+    """
+
+    #: if the loop falls this many periods behind, stop catching up and restart the grid from now
+    max_catch_up = 10
+
+    #: number of recent jitter values kept for the statistics
+    history_size = 1000
+
+    def __init__(self, period):
+        """
+        :param period: time between deadlines in seconds
+        """
+        self.period = period
+        # next deadline in time.monotonic() seconds, set by start()
+        self.deadline = None
+
+        # number of deadlines waited for
+        self.samples = 0
+        # number of deadlines that had already passed by the time the loop got back to wait()
+        self.overruns = 0
+        # the largest jitter seen so far, in seconds
+        self.max_jitter = 0.
+        # recent jitter values (how late the loop woke up after each deadline), in seconds
+        self.jitter = deque(maxlen=self.history_size)
+
+    def start(self):
+        """
+        Start the deadline grid one period from now.
+        """
+        self.deadline = time.monotonic() + self.period
+
+    def wait(self):
+        """
+        Sleep until the next deadline, record how late we woke up and advance the deadline by one period.
+        """
+
+        # start the grid on the first call if the user didn't
+        if self.deadline is None:
+            self.start()
+
+        # sleep whatever is left of this period.
+        # if the work took longer than a period the deadline has already passed, count an overrun.
+        delay = self.deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.overruns += 1
+
+        # record how late we are relative to the deadline
+        jitter = time.monotonic() - self.deadline
+        self.jitter.append(jitter)
+        self.max_jitter = max(self.max_jitter, jitter)
+        self.samples += 1
+
+        # the next deadline is one period after this one, not one period after now.
+        # this is what keeps the loop from drifting.
+        self.deadline += self.period
+
+        # after a long stall (e.g. a serial timeout) don't try to make up all the missed periods
+        if jitter > self.max_catch_up * self.period:
+            self.deadline = time.monotonic() + self.period
+
+    def stats(self):
+        """
+        Summarize the timing of the loop.
+
+        :return: dict with the number of samples, overruns and the mean / max jitter in milliseconds
+        """
+        mean = float(np.mean(self.jitter)) if len(self.jitter) > 0 else 0.
+        return {"samples": self.samples, "overruns": self.overruns,
+                "mean_jitter_ms": mean * 1000., "max_jitter_ms": self.max_jitter * 1000.}
+
+
+def block_times(end, n, interval, after=None):
+    """
+    Timestamp a block of samples that was read at once. The last sample gets *end* and the earlier ones are
+    spaced one sample interval apart before it.
+
+    When the serial link delivers samples in bursts, that spacing can reach back before the previous block.
+    The block is then spread evenly between the previous block's last timestamp and *end* instead, so the
+    timestamps of consecutive blocks always increase.
+
+    :param end: time.monotonic() value taken right after the read
+    :param n: number of samples in the block
+    :param interval: time between samples in seconds
+    :param after: last timestamp of the previous block, None for the first block
+    :return: numpy float64 array of timestamps, oldest first
+    """
+
+    times = end - interval * np.arange(n - 1, -1, -1, dtype=np.float64)
+    if after is None or n == 0 or times[0] > after:
+        return times
+
+    steps = np.arange(1, n + 1, dtype=np.float64)
+    if end > after:
+        return after + (end - after) * steps / n
+    # a coarse clock (e.g. on Windows) can return the same time for two reads, continue at the nominal spacing
+    return after + interval * steps
+
+
+def acquisition_process(port_name, buffer_name, stop_event, mode, rate, batch_size):
+    """
+    Entry point of an acquisition process. Opens the serial port, reads samples with the given protocol and
+    writes the raw ADC counts and their timestamps into the shared ring buffer until *stop_event* is set.
+    Everything it needs is passed in, so it never touches Qt or the settings files.
+    If the port can't be opened or read, the error is published in the buffer (see AcquisitionProcess.error())
+    and the process ends.
+
+    :param port_name: serial port connected to the ADC, e.g. 'COM3'
+    :param buffer_name: name of the SharedRingBuffer created by the GUI process
+    :param stop_event: multiprocessing.Event, set it to stop the process
+    :param mode: acquisition mode, one of settings_interface.acquisition_modes
+    :param rate: sample rate in samples / sec
+    :param batch_size: samples per request in the batched mode
+    """
+
+    ring = SharedRingBuffer(name=buffer_name)
+    try:
+        port = serial.Serial(port=port_name, baudrate=9600, timeout=2)
+    except (serial.SerialException, OSError, ValueError) as e:
+        # nobody sees the output of this process, the dialog reads the error from the buffer
+        ring.publish_error("Could not open %s: %s" % (port_name, e))
+        ring.close()
+        return
+    # wait for the micro-controller to settle
+    time.sleep(2)
+
+    interval = 1. / rate
+    source = make_source(port, mode, batch_size)
+    # timestamp of the last sample written, every block is stamped after it
+    last_time = None
+
+    try:
+        source.start(rate)
+        scheduler = DeadlineScheduler(interval * source.samples_per_read)
+        scheduler.start()
+
+        while not stop_event.is_set():
+            # wait for the next deadline, unless the ADC sets the pace
+            if source.paced:
+                scheduler.wait()
+                ring.publish_stats(scheduler.stats())
+
+            counts = source.read()
+            if counts.size > 0:
+                times = block_times(time.monotonic(), counts.size, interval, last_time)
+                last_time = times[-1]
+                ring.write(counts, times)
+    except (serial.SerialException, OSError) as e:
+        # e.g. the ADC was unplugged
+        ring.publish_error("Reading %s failed: %s" % (port_name, e))
+    finally:
+        try:
+            source.stop()
+        except (serial.SerialException, OSError):
+            pass
+        port.close()
+        ring.close()
+
+
+class AcquisitionProcess(object):
+    """
+    Runs *acquisition_process()* in a separate process so reading the serial port never competes with the
+    plot for the GIL. The GUI reads the samples back from a SharedRingBuffer.
+    Every instance has its own process and buffer, so several ports can be acquired at once.
+    """
+
+    def __init__(self, port_name, mode=None, rate=None, batch_size=None, capacity=default_capacity):
+        """
+        Create the shared buffer and the (not yet started) process.
+        Settings that are not given are read from the settings file.
+
+        :param port_name: serial port connected to the ADC
+        :param mode: acquisition mode
+        :param rate: sample rate in samples / sec
+        :param batch_size: samples per request in the batched mode
+        :param capacity: number of samples the shared buffer holds
+        """
+        if mode is None:
+            mode = get_acquisition_mode()
+        if rate is None:
+            rate = get_sample_rate()
+        if batch_size is None:
+            batch_size = get_batch_size()
+
+        self.buffer = SharedRingBuffer(capacity=capacity)
+        # total number of samples read back from the buffer so far
+        self.position = 0
+        # number of samples overwritten before they could be read
+        self.lost = 0
+
+        self._stop_event = multiprocessing.Event()
+        self._process = multiprocessing.Process(target=acquisition_process,
+                                                args=(port_name, self.buffer.name, self._stop_event,
+                                                      mode, rate, batch_size),
+                                                daemon=True)
+
+    def start(self):
+        """
+        Start the acquisition process.
+        """
+        self._process.start()
+
+    @property
+    def available(self):
+        """
+        Number of samples written since the last call to *read()*.
+        """
+        return self.buffer.total - self.position
+
+    def read(self):
+        """
+        Get every sample written since the last call.
+
+        :return: tuple (counts, times) of numpy arrays
+        """
+        counts, times, self.position, lost = self.buffer.read(self.position)
+        self.lost += lost
+        return counts, times
+
+    def stats(self):
+        """
+        :return: timing statistics of the acquisition loop, see DeadlineScheduler.stats()
+        """
+        return self.buffer.stats()
+
+    def error(self):
+        """
+        :return: the reason the acquisition process stopped reading, None while it is running fine
+        """
+        return self.buffer.error()
+
+    def stop(self, timeout=5):
+        """
+        Ask the process to stop, wait for it and free the shared buffer.
+
+        :param timeout: seconds to wait before the process is killed
+        """
+        self._stop_event.set()
+        self._process.join(timeout)
+        if self._process.is_alive():
+            self._process.terminate()
+        self.buffer.close()
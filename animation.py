@@ -5,20 +5,22 @@
 :moduleauthor: Michael Eller <mbe9a@virginia.edu>
 """
 
-import numpy as np
+import logging
+import time
 from matplotlib.figure import Figure
 from matplotlib.animation import TimedAnimation
 from matplotlib.lines import Line2D
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 import matplotlib.pyplot as plt
-from settings_interface import get_window_samples, get_sample_rate, get_x_axis_size, get_y_axis_max, get_y_axis_min, b1, m1, b2, m2
+from plot_data import PlotData
 
 
-class CustomFigCanvas(FigureCanvas, TimedAnimation):
+class CustomFigCanvas(FigureCanvas, TimedAnimation, PlotData):
     """
     CustomFigCanvas is a class designed to allow integration of a matplotlib animation into a Qt backend.
     The animation will display the recorded voltage from the ADC and its corresponding differential derivative.
     The user can edit the axes limits and change the window filtering dynamically from the main menu.
+    The data itself is handled by plot_data.PlotData.
     """
 
     def __init__(self):
@@ -26,55 +28,8 @@ class CustomFigCanvas(FigureCanvas, TimedAnimation):
         Initializes the object and its parent objects. Creates the figure, axes, and artists to be displayed.
         """
 
-        # buffer for the data send from the thread running plotGUI.dataSendLoop()
-        self.addedData = []
-
-        # get the x axis range from the settings file
-        self.xlim = float(get_x_axis_size())
-        # get the sample rate from the settings file
-        samp_rate = get_sample_rate()
-
-        # n contains the x values of the data points.
-        # the plot is a rolling window so for a given x range, there are always the same
-        # number of points shown on the plot.
-        self.n = np.linspace(0, self.xlim - 1, int(self.xlim*samp_rate))
-
-        # initialize the data (y array) with zeros
-        self.y = (self.n * 0.0)
-        # do the same for the differential derivative
-        self.deriv = (self.n * 0.0)
-
-        # all is used to save all recorded data.
-        # when the window frame shifts and drops the oldest data points,
-        # they are erased from self.y
-        self.all = []
-        # all_deriv is used to save all recorded derivative points
-        self.all_deriv = []
-
-        # get the number of samples to include in the moving average filter from the settings file
-        self.window_samples = int(get_window_samples())
-        # this will contain the moving average with which the filtered data point is calculated
-        self.window = []
-        # the derivative data can also be filtered
-        self.deriv_window = []
-
-        # separate arrays are used for the raw data and the filtered data.
-        # these function like self.y and self.deriv.
-        # Note:
-        #       *   when filtering is active, i.e. windows samples > 1, the plot displays
-        #           these instead.
-        #
-        #       *   if you change the filtering while the animation is running, previous values will not be filtered
-        self.filtered_data = (self.n * 0.0)
-        self.filtered_deriv = (self.n * 0.0)
-
-        # we need these to store all the filtered points even after the plot has dropped them
-        self.all_filtered_data = []
-        self.all_filtered_deriv = []
-
-        # get the y-axis limits from the settings file
-        self.ymin = get_y_axis_min()
-        self.ymax = get_y_axis_max()
+        # create the queue, the history and the rolling windows
+        self.init_data()
 
         # create the figure with two axes that share the x-axis.
         # ax1 displays the received data
@@ -109,6 +64,11 @@ class CustomFigCanvas(FigureCanvas, TimedAnimation):
         self.ax2.add_line(self.line2_tail)
         self.ax2.add_line(self.line2_head)
 
+        # the lines are drawn on top of a cached background on every frame (blitting),
+        # so a full draw of the figure must leave them out
+        for l in [self.line1, self.line1_tail, self.line1_head, self.line2, self.line2_tail, self.line2_head]:
+            l.set_animated(True)
+
         # set axes limits based on the user's settings
         self.ax1.set_xlim(0, self.xlim - 1)
         self.ax1.set_ylim(self.ymin, self.ymax)
@@ -121,26 +81,19 @@ class CustomFigCanvas(FigureCanvas, TimedAnimation):
         # rename the x-axis labels to make the right most point at time 0
         self.generate_xticklabels()
 
+        # set by invalidate_background(), the next frame redraws the whole figure first
+        self.background_stale = False
+
         # initialize the parent matplotlib objects
         FigureCanvas.__init__(self, self.fig)
         # interval is time in ms between plot updates.
-        # blitting is an optimization technique in computer graphics. It's important to disable it here
-        # because we want to be able to update the plot axes dynamically, which is impossible with blitting active.
-        TimedAnimation.__init__(self, self.fig, interval=100, blit=False)
-
-    def get_windowed_value(self, window):
-        """
-        Helper function that simply calculates the average of all the samples in the window.
+        # blitting is an optimization technique in computer graphics. Only the six lines are redrawn every frame,
+        # on top of a cached image of everything else (axes, ticks, legend, title).
+        # Whenever the axes change, the cached image is rebuilt, see invalidate_background().
+        TimedAnimation.__init__(self, self.fig, interval=self.frame_interval, blit=True)
 
-        :param window: the list containing the data to be averaged
-        :return: the average
-        """
-
-        total = 0
-        for num in window:
-            total += num
-        avg = float(total)/float(self.window_samples)
-        return avg
+        # a full draw of the figure leaves out the lines, the next frame has to put them back
+        self.mpl_connect('draw_event', self._on_full_draw)
 
     def new_frame_seq(self):
         """
@@ -158,133 +111,99 @@ class CustomFigCanvas(FigureCanvas, TimedAnimation):
         for l in lines:
             l.set_data([], [])
 
-    def addData(self, value):
+        # the next frame has to draw the lines again
+        self.frame_needed = True
+
+    def _on_full_draw(self, event):
         """
-        This function is called by the signal-slot mechanism within the plotGUI Dialog.
-        It adds a value to the plots received data buffer, *addedData*.
+        Called by matplotlib after the whole figure was drawn, which leaves out the animated lines.
 
-        :param value: received value from the serial connection to the ADC
+        :param event: matplotlib DrawEvent
         """
-        self.addedData.append(value)
+        self.frame_needed = True
+
+    def adapt_interval(self, elapsed):
+        """
+        Extends PlotData.adapt_interval() to apply the new frame interval to the animation's timer.
+
+        :param elapsed: time the last frame took to draw in ms
+        """
+        PlotData.adapt_interval(self, elapsed)
+        # TimedAnimation restores the timer's interval from _interval after every frame
+        self._interval = self.frame_interval
+        self.event_source.interval = self.frame_interval
 
     def close(self):
         """
-        Soft close function. Closes the figure contained in the object.
+        Soft close function. Closes the figure contained in the object and frees the recorded history.
         """
         plt.close(self.fig)
+        self.close_data()
+
+    def save_image(self, fname):
+        """
+        Save the figure as an image file.
+
+        :param fname: file path, the format is taken from its extension
+        """
+        self.fig.savefig(fname)
 
     def _step(self, *args):
         """
         Extends the _step() method for the TimedAnimation class.
+        Frames without new data are skipped entirely, and the time it takes to draw the others sets the
+        interval until the next frame.
         """
+
+        # the axes changed since the last frame, draw everything but the lines again before the frame caches it
+        if self.background_stale:
+            self.background_stale = False
+            self._blit_cache.clear()
+            self.draw()
+            self.frame_needed = True
+
+        # nothing new to show and nothing that needs to be redrawn, don't spend any time on this frame
+        if not self.frame_needed and not self.has_new_data():
+            return True
+        self.frame_needed = False
+
+        start = time.perf_counter()
         try:
             TimedAnimation._step(self, *args)
-        except Exception as e:
-            self.abc += 1
-            print(str(self.abc))
+        except Exception:
+            # an exception escaping the timer's callback would take the whole program down.
+            # report it and stop the animation, the rest of the program keeps running.
+            logging.getLogger(__name__).exception("drawing the plot failed, the animation is stopped")
             TimedAnimation._stop(self)
-            pass
+            return False
+
+        # the event source is gone if the animation stopped
+        if self.event_source is not None:
+            self.adapt_interval(1000. * (time.perf_counter() - start))
+        return True
 
     def update_xlim(self):
         """
-        This function handles updating the x-axis range dynamically.
+        Extends PlotData.update_xlim() to set the x-axis range and labels.
+
+        :return: bool indicating whether or not the range changed
         """
 
-        # save the old setting
-        old_xlim = self.xlim
-        # set the new xlim
-        self.xlim = get_x_axis_size()
         # since all updating functions are called if any of the settings are changed,
         # we can check whether or not this setting actually changed and exit if not.
-        if old_xlim == self.xlim:
-            return
-
-        # get the sample rate from the settings file
-        samp_rate = get_sample_rate()
-
-        # save the old y data
-        y = self.y
-        # save the old filtered data
-        filtered_data = self.filtered_data
-        # save the old derivative data
-        deriv = self.deriv
-        # save the old filtered derivative data
-        filtered_deriv = self.filtered_deriv
-
-        # generate the new list of x values based on the new limits and the sample rate
-        n = np.linspace(0, self.xlim - 1, int(self.xlim*samp_rate))
+        if not PlotData.update_xlim(self):
+            return False
+
         # set the axis limits
         self.ax1.set_xlim(0, self.xlim - 1)
 
-        # add or remove data points from the lines depending on the x-axis range change.
-        # this gets a little complicated.
-        # if the range decreased
-        if old_xlim > self.xlim:
-            # calculate the difference in samples
-            diff = int((old_xlim - self.xlim)*samp_rate)
-
-            # drop oldest values from the data lists.
-            # number of samples dropped = diff.
-            self.y = y[diff:]
-            self.deriv = deriv[diff:]
-            self.filtered_data = filtered_data[diff:]
-            self.filtered_deriv = filtered_deriv[diff:]
-
-        # if the range increased
-        else:
-            # calculate the difference in samples
-            diff = int((self.xlim - old_xlim) * samp_rate)
-
-            # if the plot has been running long enough for self.all to have enough points to cover the new range,
-            # prepend those data points to the data lists
-            if (len(self.all) - len(self.n)) >= diff:
-                # calculate the indices for the data points in self.all that we want to use
-                index_1 = -len(self.n) - diff
-                index_2 = -len(self.n)
-
-                # add the old values to the front of the data lists
-                self.y = np.concatenate((self.all[index_1:index_2], y))
-                self.deriv = np.concatenate((self.all_deriv[index_1:index_2], deriv))
-                self.filtered_data = np.concatenate((self.all_filtered_data[index_1:index_2],
-                                                     filtered_data))
-                self.filtered_deriv = np.concatenate((self.all_filtered_deriv[index_1:index_2],
-                                                     filtered_deriv))
-
-            # if self.all doesn't have enough to cover the whole difference,
-            # but has more than the current shown data points -- prepend all available points in self.all and
-            # then prepend zeros until the arrays have the correct length
-            elif len(self.all) > len(self.n):
-                # diff_diff is the difference between diff and the number of available points in
-                # self.all (that aren't already in self.y etc.)
-                diff_diff = diff - (len(self.all) - len(self.n))
-
-                # diff2 = diff - diff_diff
-                # used to calculate start and stop indices
-                diff2 = len(self.all) - len(self.n)
-                # calculate indices
-                index_1 = -len(self.n) - diff2
-                index_2 = -len(self.n)
-
-                # prepend the data lists with zeros, old values, and original values
-                self.y = np.concatenate(([0] * diff_diff, self.all[index_1:index_2], y))
-                self.deriv = np.concatenate(([0] * diff_diff, self.all_deriv[index_1:index_2], deriv))
-                self.filtered_deriv = np.concatenate(([0] * diff_diff, self.all_filtered_deriv[index_1:index_2],
-                                                     filtered_deriv))
-
-            # if self.all is the same size as self.y, i.e. the window hasn't had to drop any points yet
-            else:
-                # prepend zeros until the lists have the right size
-                self.y = np.concatenate(([0] * diff, y))
-                self.deriv = np.concatenate(([0] * diff, deriv))
-                self.filtered_data = np.concatenate(([0] * diff, filtered_data))
-                self.filtered_deriv = np.concatenate(([0] * diff, filtered_deriv))
-
-        # set the new n list
-        self.n = n
-
         # generate the labels again to ensure that the newest data point is at time=0
         self.generate_xticklabels()
 
+        # the axes look different now, rebuild the cached background
+        self.invalidate_background()
+        return True
+
     def generate_xticklabels(self):
         """
         Since the animation progresses from right to left, the left-most point is actually in the past,
@@ -306,116 +225,57 @@ class CustomFigCanvas(FigureCanvas, TimedAnimation):
 
     def update_ylim(self):
         """
-        Update the data y-axis limits according to the input from the user.
+        Extends PlotData.update_ylim() to set the y-axis limits.
         The derivative limits are hard-coded based on the ymax of the data axis.
+
+        :return: bool indicating whether or not the limits changed
         """
 
-        # get the y-axis minimum from the settings file
-        self.ymin = get_y_axis_min()
-        # get the y-axis maximum from the settings file
-        self.ymax = get_y_axis_max()
+        # since all updating functions are called if any of the settings are changed,
+        # we can check whether or not these settings actually changed and exit if not.
+        if not PlotData.update_ylim(self):
+            return False
 
         # set the axis limits
         self.ax1.set_ylim(self.ymin, self.ymax)
         self.ax2.set_ylim(-self.ymax/2., self.ymax/2.)
 
-    def update_window(self):
+        # the axes look different now, rebuild the cached background
+        self.invalidate_background()
+        return True
+
+    def invalidate_background(self):
         """
-        This function updates the *windows_samples* variable from the settings file.
+        Mark the cached background used for blitting as out of date. The next frame throws it away, redraws the
+        whole figure (without the lines) and caches the new background. This must be called whenever anything
+        but the lines changes. Rendering is left to the frame, so it always happens on the GUI thread and never
+        while a frame is being blitted.
         """
-        self.window_samples = int(get_window_samples())
+        self.background_stale = True
+        self.frame_needed = True
 
     def _draw_frame(self, framedata):
         """
         Overrides the *_draw_frame()* stub in the inherited animation class.
-        This function updates the line data with the newest value from *self.addedData*.
+        This function updates the line data with the newest values from *self.addedData*.
         """
 
-        # margin is a small space between the right side of the plot and the line head
-        margin = 2
-
-        # while a new value from the ADC is available
-        while len(self.addedData) > 0:
-            # get that value
-            val = self.addedData[0]
-
-            # back out the actual voltage using a two-part linear fit
-            if val < 150:
-                val = (val - b1) / m1
-            else:
-                val = (val - b2) / m2
-
-            # calculate the newest derivative value
-            deriv_val = val - self.y[-1]
-
-            # append the values to the lists that save all values
-            self.all.append(val)
-            self.all_deriv.append(deriv_val)
-
-            # if the window doesn't contain the right amount of samples
-            if len(self.window) != self.window_samples:
-                # fill the windows with the most recent value
-                self.window = [val] * self.window_samples
-                self.deriv_window = [deriv_val] * self.window_samples
-
-            # shift the windows 1 to the left, replace last values with new value
-            self.window = np.roll(self.window, -1)
-            self.deriv_window = np.roll(self.deriv_window, -1)
-            self.window[-1] = val
-            self.deriv_window[-1] = deriv_val
-
-            # shift the filtered data 1 to the left
-            self.filtered_data = np.roll(self.filtered_data, -1)
-            # calculate newest filtered value and append it
-            self.filtered_data[-1] = self.get_windowed_value(self.window)
-            # add the new filtered value to the permanent list
-            self.all_filtered_data.append(self.get_windowed_value(self.window))
-
-            # shift the filtered derivative 1 to the left
-            self.filtered_deriv = np.roll(self.filtered_deriv, -1)
-            # calculate new filtered derivative point
-            self.filtered_deriv[-1] = self.get_windowed_value(self.deriv_window)
-            # add the value to the permanent list
-            self.all_filtered_deriv.append(self.get_windowed_value(self.deriv_window))
-
-            # shift the main data list 1 to the left, set the last element to the new value
-            self.y = np.roll(self.y, -1)
-            self.y[-1] = val
-
-            # perform the same operation for the derivative list
-            self.deriv = np.roll(self.deriv, -1)
-            self.deriv[-1] = deriv_val
-
-            # del the value from the buffer
-            del self.addedData[0]
-
-        # if we need to display the filtered lists
-        if self.window_samples > 1:
-            # set the line1 data (voltage)
-            self.line1.set_data(self.n[0: self.n.size - margin], self.filtered_data[0: self.n.size - margin])
-            self.line1_tail.set_data(np.append(self.n[-10:-1 - margin], self.n[-1 - margin]),
-                                     np.append(self.filtered_data[-10:-1 - margin], self.filtered_data[-1 - margin]))
-            self.line1_head.set_data(self.n[-1 - margin], self.filtered_data[-1 - margin])
-
-            # set the line2 data (derivative)
-            self.line2.set_data(self.n[0: self.n.size - margin], self.filtered_deriv[0: self.n.size - margin])
-            self.line2_tail.set_data(np.append(self.n[-10:-1 - margin], self.n[-1 - margin]),
-                                     np.append(self.filtered_deriv[-10:-1 - margin], self.filtered_deriv[-1 - margin]))
-            self.line2_head.set_data(self.n[-1 - margin], self.filtered_deriv[-1 - margin])
-
-        # display y and deriv
-        else:
-            # set the line1 data (voltage)
-            self.line1.set_data(self.n[0: self.n.size - margin], self.y[0: self.n.size - margin])
-            self.line1_tail.set_data(np.append(self.n[-10:-1 - margin], self.n[-1 - margin]),
-                                     np.append(self.y[-10:-1 - margin], self.y[-1 - margin]))
-            self.line1_head.set_data(self.n[-1 - margin], self.y[-1 - margin])
-
-            # set the line2 data (derivative)
-            self.line2.set_data(self.n[0: self.n.size - margin], self.deriv[0: self.n.size - margin])
-            self.line2_tail.set_data(np.append(self.n[-10:-1 - margin], self.n[-1 - margin]),
-                                     np.append(self.deriv[-10:-1 - margin], self.deriv[-1 - margin]))
-            self.line2_head.set_data(self.n[-1 - margin], self.deriv[-1 - margin])
+        # take every new value and add it to the windows
+        self.process_new_data()
+
+        # decimate the main lines down to the width of the plot
+        data_x, data_y, deriv_x, deriv_y = self.decimate(self.ax1.bbox.width)
+        tail_x, tail_data, tail_deriv = self.tails()
+
+        # set the line1 data (voltage)
+        self.line1.set_data(data_x, data_y)
+        self.line1_tail.set_data(tail_x, tail_data)
+        self.line1_head.set_data(tail_x[-1:], tail_data[-1:])
+
+        # set the line2 data (derivative)
+        self.line2.set_data(deriv_x, deriv_y)
+        self.line2_tail.set_data(tail_x, tail_deriv)
+        self.line2_head.set_data(tail_x[-1:], tail_deriv[-1:])
 
         # set the artists that need to be drawn
         self._drawn_artists = [self.line1, self.line1_tail, self.line1_head,
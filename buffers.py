@@ -0,0 +1,268 @@
+"""
+:platform: Unix, Windows
+:synopsis: This module contains the data structures that hold samples on their way from the ADC to the plot.
+:moduleauthor: Michael Eller <mbe9a@virginia.edu>
+"""
+
+import time
+from collections import deque
+import numpy as np
+
+
+class IngestQueue(object):
+    """
+    Bounded queue of sample blocks between one producer (the acquisition) and one consumer (the plot).
+    Every sample travels with the time.monotonic() timestamp of when it was read.
+
+    The blocks live in a collections.deque, whose append and popleft are atomic, and every counter is only
+    ever written by one side: *enqueued* and *dropped* by the producer, *drained* by the consumer.
+    Samples are counted as enqueued before they are appended and as dropped or drained after they are popped,
+    so *pending* may briefly count samples that are already gone, but never goes negative.
+    That makes the queue safe to share between two threads without a lock.
+    """
+
+    #: how long a producer waits for room under the 'block' policy before queueing the block anyway (seconds).
+    #: this keeps the acquisition thread from hanging forever if the plot has stopped.
+    block_timeout = 1.
+
+    def __init__(self, high_water, policy="drop-oldest"):
+        """
+        :param high_water: maximum number of queued samples before the overflow policy applies
+        :param policy: one of settings_interface.queue_policies
+        """
+        self.high_water = int(high_water)
+        self.policy = policy
+
+        # queued (samples, timestamps) pairs of numpy blocks, oldest first
+        self._blocks = deque()
+
+        # samples accepted by put()
+        self.enqueued = 0
+        # samples removed by the overflow policy
+        self.dropped = 0
+        # samples handed to the consumer by drain()
+        self.drained = 0
+
+    @property
+    def pending(self):
+        """
+        Number of samples waiting to be drained.
+        """
+        return self.enqueued - self.dropped - self.drained
+
+    def put(self, block, times=None, timeout=None):
+        """
+        Queue a block of samples, applying the overflow policy if it doesn't fit under the high-water mark.
+        Only the producer may call this.
+
+        :param block: sample value or numpy array of sample values
+        :param times: numpy array of the samples' time.monotonic() timestamps in seconds.
+                If not given, every sample is stamped with the current time.
+        :param timeout: seconds to wait for room under the 'block' policy, *block_timeout* if not given.
+                Pass 0 when calling from the consumer's thread.
+        """
+
+        block = np.atleast_1d(block)
+        if block.size == 0:
+            return
+        if times is None:
+            times = np.full(block.size, time.monotonic())
+        times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+
+        if self.pending + block.size > self.high_water:
+            if self.policy == "block":
+                self._wait_for_room(block.size, self.block_timeout if timeout is None else timeout)
+            elif self.policy == "coalesce":
+                block, times = self._coalesce(block, times)
+            else:
+                block, times = self._drop_oldest(block, times)
+
+        # count the samples before the consumer can see them, so *pending* never goes negative
+        self.enqueued += block.size
+        self._blocks.append((block, times))
+
+    def drain(self):
+        """
+        Take every queued sample. Only the consumer may call this.
+
+        :return: tuple (samples, timestamps) of numpy arrays in order, empty if there are none
+        """
+
+        blocks = []
+        while True:
+            try:
+                blocks.append(self._blocks.popleft())
+            except IndexError:
+                break
+
+        if not blocks:
+            return np.empty(0), np.empty(0)
+
+        data = np.concatenate([b[0] for b in blocks])
+        times = np.concatenate([b[1] for b in blocks])
+        self.drained += data.size
+        return data, times
+
+    def stats(self):
+        """
+        :return: dict with the enqueued, drained, dropped and pending sample counts
+        """
+        return {"enqueued": self.enqueued, "drained": self.drained,
+                "dropped": self.dropped, "pending": self.pending}
+
+    def _wait_for_room(self, n, timeout):
+        """
+        Sleep until the consumer has made room for *n* samples, or *timeout* seconds have passed.
+        """
+        end = time.monotonic() + timeout
+        while self.pending + n > self.high_water and time.monotonic() < end:
+            time.sleep(0.001)
+
+    def _drop_oldest(self, block, times):
+        """
+        Drop whole blocks from the front of the queue until the new block fits.
+        The consumer may take blocks at the same time, whichever side pops a block accounts for it.
+
+        :param block: numpy array of new samples
+        :param times: numpy array of their timestamps
+        :return: tuple (block, times), without the oldest samples if the block is larger than the high-water mark
+                on its own
+        """
+        while self.pending + block.size > self.high_water:
+            try:
+                self.dropped += self._blocks.popleft()[0].size
+            except IndexError:
+                break
+
+        # the queue is empty and the block still doesn't fit, keep its newest samples
+        if block.size > self.high_water:
+            excess = block.size - self.high_water
+            self.enqueued += excess
+            self.dropped += excess
+            block = block[excess:]
+            times = times[excess:]
+        return block, times
+
+    def _coalesce(self, block, times):
+        """
+        Average groups of neighbouring samples so the block fits in the room that is left.
+        Each average is stamped with the mean time of its group.
+
+        :param block: numpy array of samples
+        :param times: numpy array of their timestamps
+        :return: tuple (block, times) of the averages, the block with the same dtype
+        """
+
+        room = max(1, self.high_water - self.pending)
+        factor = -(-block.size // room)
+        starts = np.arange(0, block.size, factor)
+
+        # average every group of *factor* samples, the last group may be shorter
+        sums = np.add.reduceat(block.astype(np.float64), starts)
+        sizes = np.diff(np.append(starts, block.size))
+        averaged = sums / sizes
+        if np.issubdtype(block.dtype, np.integer):
+            averaged = np.rint(averaged)
+
+        # the samples that were averaged away count as enqueued and dropped
+        self.enqueued += block.size - averaged.size
+        self.dropped += block.size - averaged.size
+        return averaged.astype(block.dtype), np.add.reduceat(times, starts) / sizes
+
+
+class RingBuffer(object):
+    """
+    Fixed-size window of the most recent values with O(1) append.
+
+    Every value is stored twice, at its slot and one capacity further, in an array of twice the capacity.
+    The values in order (oldest first) are then always the contiguous slice starting at the oldest slot,
+    so *view()* hands out an ordered numpy view without copying anything.
+    """
+
+    def __init__(self, capacity, fill=0., dtype=np.float64):
+        """
+        :param capacity: number of values in the window
+        :param fill: initial value of every element
+        :param dtype: numpy dtype of the values
+        """
+        self.capacity = int(capacity)
+        self.fill = fill
+        self._data = np.full(2 * self.capacity, fill, dtype=dtype)
+        # slot of the oldest value
+        self._head = 0
+
+    def __len__(self):
+        return self.capacity
+
+    def __getitem__(self, item):
+        return self.view()[item]
+
+    def view(self):
+        """
+        :return: numpy view of the values in order, oldest first. It changes when new values are appended.
+        """
+        return self._data[self._head:self._head + self.capacity]
+
+    def append(self, value):
+        """
+        Add a value, dropping the oldest one.
+
+        :param value: the new value
+        """
+        self._data[self._head] = value
+        self._data[self._head + self.capacity] = value
+        self._head = (self._head + 1) % self.capacity
+
+    def extend(self, values):
+        """
+        Add a block of values in order, dropping as many of the oldest ones.
+
+        :param values: numpy array of new values
+        """
+
+        # only the newest *capacity* values can survive
+        values = np.asarray(values)[-self.capacity:]
+        n = values.size
+        if n == 0:
+            return
+
+        slots = (self._head + np.arange(n)) % self.capacity
+        self._data[slots] = values
+        self._data[slots + self.capacity] = values
+        self._head = (self._head + n) % self.capacity
+
+    def reset(self, values=()):
+        """
+        Replace the whole window. If there are fewer values than the capacity, the front is filled with *fill*.
+
+        :param values: the new values, oldest first
+        """
+        self._data[:] = self.fill
+        self._head = 0
+        self.extend(values)
+
+    def resize(self, capacity, older=()):
+        """
+        Change the number of values in the window, keeping the newest values.
+        When the window grows, the new space at the front is filled with *older* values (if given),
+        and with *fill* beyond those.
+
+        :param capacity: new number of values in the window
+        :param older: values that came before the current window, oldest first
+        """
+
+        capacity = int(capacity)
+        current = self.view()
+
+        if capacity <= self.capacity:
+            values = current[self.capacity - capacity:]
+        else:
+            grow = capacity - self.capacity
+            older = np.asarray(older, dtype=self._data.dtype)
+            older = older[max(0, older.size - grow):]
+            padding = np.full(grow - older.size, self.fill, dtype=self._data.dtype)
+            values = np.concatenate((padding, older, current))
+
+        self.capacity = capacity
+        self._data = np.concatenate((values, values))
+        self._head = 0
@@ -0,0 +1,203 @@
+"""
+:platform: Unix, Windows
+:synopsis: This module turns raw ADC counts into voltages. The calibration curve is compiled once into a
+    lookup table with one entry per ADC count, so a whole block of samples is calibrated with a single indexing
+    operation.
+:moduleauthor: Michael Eller <mbe9a@virginia.edu>
+"""
+
+import csv
+import os
+import numpy as np
+from settings_interface import m1, b1, m2, b2, get_calibration_tool, get_calibration_board
+
+#: the ADC is 10-bit, so there are 1024 possible counts
+adc_counts = 1024
+
+#: file holding the calibration curves of every tool and board.
+#: Each row is one segment of a curve and applies to the counts lower <= count < upper:
+#:
+#:  *   'linear' segments hold a slope and intercept of V_measured vs. V_in (V_in = (count - intercept) / slope)
+#:  *   'polynomial' segments hold coefficients, highest power first (V_in = polyval(coefficients, count))
+#:
+#: coefficients are separated by spaces.
+calibration_file = "resources/calibration.csv"
+
+#: column names of the calibration file
+calibration_fieldnames = ["tool", "board", "kind", "lower", "upper", "coefficients"]
+
+# the last table that was built, its curve and what it was built from, see get_calibration_table()
+_cache = {"key": None, "table": None, "segments": None}
+
+# errors reading the calibration file, e.g. while a spreadsheet program has it locked
+_read_errors = (OSError, csv.Error, UnicodeDecodeError)
+
+
+def get_default_segments():
+    """
+    The two-part linear fit from settings_interface, used when no curve is stored for the tool and board.
+
+    :return: list of (kind, lower, upper, coefficients) tuples
+    """
+    return [("linear", 0, 150, [m1, b1]), ("linear", 150, adc_counts, [m2, b2])]
+
+
+def build_table(segments):
+    """
+    Evaluate a calibration curve at every ADC count.
+
+    :param segments: list of (kind, lower, upper, coefficients) tuples
+    :return: numpy float64 array with the voltage of every ADC count
+    """
+
+    counts = np.arange(adc_counts, dtype=np.float64)
+    # counts not covered by any segment stay at 0 V
+    table = np.zeros(adc_counts)
+
+    for kind, lower, upper, coefficients in segments:
+        lower = max(0, int(lower))
+        upper = min(adc_counts, int(upper))
+        if kind == "polynomial":
+            table[lower:upper] = np.polyval(coefficients, counts[lower:upper])
+        else:
+            slope, intercept = coefficients
+            table[lower:upper] = (counts[lower:upper] - intercept) / slope
+
+    return table
+
+
+def parse_segment(row):
+    """
+    Check one row of the calibration file and turn it into a segment.
+
+    :param row: dict of the row's columns, see *calibration_fieldnames*
+    :return: (kind, lower, upper, coefficients) tuple, None if the row is incomplete or not a valid segment
+    """
+
+    # a row that is cut short has None for its missing columns
+    try:
+        kind = row["kind"].strip()
+        lower = int(row["lower"])
+        upper = int(row["upper"])
+        coefficients = [float(c) for c in row["coefficients"].split()]
+    except (KeyError, AttributeError, TypeError, ValueError):
+        return None
+
+    if lower >= upper or not all(np.isfinite(coefficients)):
+        return None
+    # a linear segment needs a slope it can divide by and an intercept
+    if kind == "linear" and len(coefficients) == 2 and coefficients[0] != 0:
+        return kind, lower, upper, coefficients
+    if kind == "polynomial" and len(coefficients) > 0:
+        return kind, lower, upper, coefficients
+    return None
+
+
+def read_segments(tool, board, path=calibration_file):
+    """
+    Read the calibration curve of one tool and board from the calibration file.
+    Rows that are not a valid segment (see *parse_segment()*), e.g. a row that is still being edited, are skipped.
+
+    :param tool: tool name, the first column of the file
+    :param board: board name, the second column of the file
+    :param path: calibration file
+    :return: list of (kind, lower, upper, coefficients) tuples, empty if the file has no curve for them
+    :raises OSError, csv.Error, UnicodeDecodeError: if the file can't be read
+    """
+
+    # no file, no curves
+    if not os.path.isfile(path):
+        return []
+
+    segments = []
+    with open(path, "r") as csvfile:
+        reader = csv.DictReader(csvfile)
+        for row in reader:
+            if row.get("tool") == tool and row.get("board") == board:
+                segment = parse_segment(row)
+                if segment is not None:
+                    segments.append(segment)
+    return segments
+
+
+def get_calibration_segments():
+    """
+    Get the calibration curve for the tool and board in the settings file.
+
+    :return: list of (kind, lower, upper, coefficients) tuples, the default curve if none is stored for them.
+            If the file can't be read, the curve of the current lookup table.
+    """
+    try:
+        segments = read_segments(get_calibration_tool(), get_calibration_board())
+    except _read_errors:
+        return _cache["segments"] or get_default_segments()
+    if not segments:
+        segments = get_default_segments()
+    return segments
+
+
+def get_calibration_table():
+    """
+    Get the lookup table for the tool and board in the settings file.
+    The table is only rebuilt when the settings or the calibration file change. If the file can't be read,
+    the previous table is kept and the file is read again on the next call.
+
+    :return: numpy float64 array with the voltage of every ADC count
+    """
+
+    tool = get_calibration_tool()
+    board = get_calibration_board()
+    mtime = os.path.getmtime(calibration_file) if os.path.isfile(calibration_file) else None
+
+    # rebuild only if something changed since the last call
+    key = (tool, board, mtime)
+    if _cache["key"] != key:
+        try:
+            segments = read_segments(tool, board) or get_default_segments()
+        except _read_errors:
+            if _cache["table"] is not None:
+                return _cache["table"]
+            segments = get_default_segments()
+        _cache["table"] = build_table(segments)
+        _cache["segments"] = segments
+        _cache["key"] = key
+
+    return _cache["table"]
+
+
+def counts_to_volts(counts, table=None):
+    """
+    Calibrate ADC counts with the lookup table.
+
+    :param counts: ADC count or numpy array of counts
+    :param table: lookup table from *build_table()*, the one for the current settings if not given
+    :return: voltage or numpy array of voltages
+    """
+    if table is None:
+        table = get_calibration_table()
+    index = np.clip(np.rint(counts), 0, adc_counts - 1).astype(np.intp)
+    return table[index]
+
+
+def volts_to_counts(volts, table=None):
+    """
+    Find the ADC count whose calibrated voltage is closest to each voltage, i.e. undo *counts_to_volts()*.
+    Only needed for data that was saved as voltages, e.g. the CSV files of older versions.
+
+    :param volts: numpy array of voltages
+    :param table: lookup table from *build_table()*, the one for the current settings if not given
+    :return: numpy int16 array of ADC counts
+    """
+    if table is None:
+        table = get_calibration_table()
+
+    # the table isn't necessarily monotonic, search it sorted
+    order = np.argsort(table, kind="stable")
+    ordered = table[order]
+    volts = np.asarray(volts, dtype=np.float64)
+
+    # the closest voltage is one of the two neighbours of the insertion point
+    right = np.clip(np.searchsorted(ordered, volts), 1, adc_counts - 1)
+    left = right - 1
+    nearest = np.where(volts - ordered[left] <= ordered[right] - volts, left, right)
+    return order[nearest].astype(np.int16)
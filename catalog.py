@@ -0,0 +1,314 @@
+"""
+:platform: Unix, Windows
+:synopsis: This module keeps a catalog of the recorded runs in an SQLite database: the metadata of every run and a
+    summary of it (duration, signal range, endpoint time and a small thumbnail of the trace) that is calculated
+    once, when the recording is finished. Listing and previewing runs only reads the catalog,
+    never the recordings themselves.
+:moduleauthor: Michael Eller <mbe9a@virginia.edu>
+"""
+
+import os
+import sqlite3
+import threading
+from collections import deque
+import numpy as np
+from filters import make_filter
+from recorder import Recording, recordings_dir, journal_extension
+
+#: the catalog database, next to resources/
+catalog_file = "catalog.db"
+
+#: number of columns of the thumbnail trace, each holds the minimum and maximum of its part of the run
+thumbnail_columns = 200
+
+#: seconds of signal averaged before looking for the endpoint
+endpoint_smoothing = 2.
+
+#: the signal counts as still changing while its average changes from one smoothing window to the next by more than
+#: this fraction of its largest change...
+endpoint_threshold = 0.1
+
+#: ...and by more than this many standard deviations of the noise of that change
+endpoint_noise_factor = 4.
+
+#: if the signal is still changing in this last fraction of the run, the etch hadn't reached its endpoint.
+#: the noise is measured on it.
+endpoint_margin = 0.05
+
+# jobs for the catalog thread, see _submit(). the lock guards both.
+_jobs = deque()
+_jobs_lock = threading.Lock()
+_worker = None
+# set by cancel_sync()
+_cancelled = threading.Event()
+
+# the columns of the runs table, in order
+_columns = ["path", "started", "samples", "duration", "sample_rate", "tool", "board", "port",
+            "v_min", "v_max", "v_mean", "endpoint", "thumbnail"]
+
+
+def connect(path=catalog_file):
+    """
+    Open the catalog, creating it if it doesn't exist yet.
+
+    :param path: catalog database file
+    :return: sqlite3.Connection, rows can be accessed by column name
+    """
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    db.execute("CREATE TABLE IF NOT EXISTS runs (path TEXT PRIMARY KEY, started REAL, samples INTEGER, "
+               "duration REAL, sample_rate REAL, tool TEXT, board TEXT, port TEXT, "
+               "v_min REAL, v_max REAL, v_mean REAL, endpoint REAL, thumbnail BLOB)")
+    # runs are listed newest first
+    db.execute("CREATE INDEX IF NOT EXISTS runs_started ON runs (started)")
+    return db
+
+
+def find_endpoint(elapsed, volts, sample_rate):
+    """
+    Estimate when the etch reached its endpoint. While a layer is etched the reflected signal keeps changing,
+    once it is cleared the signal settles. The endpoint is taken as the last time the moving average of the signal
+    changed from one window to the next by more than both *endpoint_threshold* of its largest change and
+    *endpoint_noise_factor* times the noise of that change. The noise is the scatter of the samples around their
+    average in the last *endpoint_margin* of the run, where the signal has settled if the etch is finished.
+
+    :param elapsed: numpy array of seconds since the first sample
+    :param volts: numpy array of calibrated samples
+    :param sample_rate: nominal sample rate in samples / sec, sets the smoothing window
+    :return: the endpoint in seconds since the first sample, or None if the signal never settled
+    """
+
+    window = max(1, int(endpoint_smoothing * sample_rate))
+    if volts.size <= 2 * window:
+        return None
+
+    # change of the average over two windows that don't overlap, the one at sample j covers samples
+    # j - 2 * window + 1 to j. the samples before are still filling up the moving average.
+    smoothed = make_filter("moving-average", window).update(volts)
+    activity = np.zeros(volts.size)
+    activity[2 * window - 1:] = np.abs(smoothed[2 * window - 1:] - smoothed[window - 1:-window])
+
+    # a sample scatters around the average by the noise, the difference of two averages of *window* samples
+    # by sqrt(2 / window) times that. the quantization of the ADC is part of the noise.
+    tail = slice(int((1. - endpoint_margin) * volts.size), None)
+    noise = np.std(volts[tail] - smoothed[tail]) * np.sqrt(2. / window)
+    # rounding errors of the running average of a constant signal are not a change
+    limit = max(endpoint_threshold * activity.max(), endpoint_noise_factor * noise, 1e-9 * np.abs(volts).max())
+
+    active = np.flatnonzero(activity > limit)
+    if active.size == 0:
+        return None
+    last = active[-1]
+    if last >= (1. - endpoint_margin) * volts.size:
+        return None
+    # the last change is somewhere in the two windows, take the middle
+    return float(elapsed[last - window])
+
+
+def make_thumbnail(elapsed, volts, columns=thumbnail_columns):
+    """
+    Reduce a trace to the minimum and maximum of each of *columns* equal stretches of time.
+    Stretches without samples (e.g. a stall of the serial link) are NaN.
+
+    :param elapsed: numpy array of seconds since the first sample, increasing
+    :param volts: numpy array of calibrated samples
+    :param columns: number of columns
+    :return: numpy float32 array of shape (2, columns): the minimums, then the maximums
+    """
+
+    thumbnail = np.full((2, columns), np.nan, dtype=np.float32)
+    if volts.size == 0:
+        return thumbnail
+
+    # the column each sample falls into, in increasing order
+    duration = max(float(elapsed[-1]), 1e-9)
+    column = np.minimum((elapsed / duration * columns).astype(np.intp), columns - 1)
+    starts = np.searchsorted(column, np.arange(columns), side="left")
+    ends = np.searchsorted(column, np.arange(columns), side="right")
+    filled = ends > starts
+
+    # each segment of reduceat runs up to the next filled column's start, i.e. exactly over its own samples
+    thumbnail[0, filled] = np.minimum.reduceat(volts, starts[filled])
+    thumbnail[1, filled] = np.maximum.reduceat(volts, starts[filled])
+    return thumbnail
+
+
+def summarize(recording):
+    """
+    Calculate the catalog entry of a recording.
+
+    :param recording: recorder.Recording
+    :return: dict with a value for every column of the runs table
+    """
+
+    volts = recording.volts()
+    elapsed = recording.elapsed
+    header = recording.header
+    empty = volts.size == 0
+    return {"path": os.path.abspath(recording.path), "started": recording.started, "samples": int(volts.size),
+            "duration": 0. if empty else float(elapsed[-1]), "sample_rate": recording.sample_rate,
+            "tool": header.get("tool"), "board": header.get("board"), "port": header.get("port"),
+            "v_min": None if empty else float(volts.min()), "v_max": None if empty else float(volts.max()),
+            "v_mean": None if empty else float(volts.mean()),
+            "endpoint": None if empty else find_endpoint(elapsed, volts, recording.sample_rate),
+            "thumbnail": make_thumbnail(elapsed, volts).astype("<f4").tobytes()}
+
+
+def add_run(path, db=catalog_file):
+    """
+    Summarize a finished recording and store it in the catalog, replacing an older entry of the same file.
+
+    :param path: recording file
+    :param db: catalog database file
+    :return: the dict stored, see *summarize()*
+    """
+    entry = summarize(Recording(path))
+    with connect(db) as connection:
+        connection.execute("INSERT OR REPLACE INTO runs (%s) VALUES (%s)" %
+                           (", ".join(_columns), ", ".join("?" * len(_columns))),
+                           [entry[c] for c in _columns])
+    connection.close()
+    return entry
+
+
+def _submit(job):
+    """
+    Run a job on the catalog thread. The jobs run one after the other, so they never summarize the same recording
+    twice or write the database at the same time. The thread ends when it runs out of jobs and is started again
+    by the next one. It is not a daemon, the program waits for it before it exits.
+
+    :param job: function without arguments
+    :return: the catalog thread, a threading.Thread
+    """
+    global _worker
+    with _jobs_lock:
+        _jobs.append(job)
+        if _worker is None:
+            _worker = threading.Thread(target=_work, name="Catalog")
+            _worker.start()
+        return _worker
+
+
+def _work():
+    """
+    Body of the catalog thread.
+    """
+    global _worker
+    try:
+        while True:
+            with _jobs_lock:
+                if not _jobs:
+                    _worker = None
+                    return
+                job = _jobs.popleft()
+            try:
+                job()
+            except Exception:
+                # whatever went wrong with one recording (an unreadable file, an odd header, no memory),
+                # the next job still runs. the recording is still there, sync_catalog() tries again next launch.
+                pass
+    finally:
+        # a thread that ended any other way must not be taken for a running one, the next job starts a new thread
+        with _jobs_lock:
+            if _worker is threading.current_thread():
+                _worker = None
+
+
+def add_run_later(path, db=catalog_file):
+    """
+    Catalog a recording on the catalog thread, so closing the plot doesn't wait for it.
+
+    :param path: recording file
+    :param db: catalog database file
+    :return: the catalog thread, a threading.Thread
+    """
+    return _submit(lambda: add_run(path, db))
+
+
+def sync_catalog_later(root=recordings_dir, db=catalog_file):
+    """
+    Run *sync_catalog()* on the catalog thread, so the program starts without waiting for it.
+    *cancel_sync()* stops it after the recording it is summarizing.
+
+    :param root: directory of the recordings
+    :param db: catalog database file
+    :return: the catalog thread, a threading.Thread
+    """
+    _cancelled.clear()
+    return _submit(lambda: sync_catalog(root, db, should_stop=_cancelled.is_set))
+
+
+def cancel_sync():
+    """
+    Stop a *sync_catalog_later()* that is still running, e.g. when the program exits. The recordings it didn't get to
+    are cataloged on the next launch. Runs added by *add_run_later()* are still cataloged.
+    """
+    _cancelled.set()
+
+
+def sync_catalog(root=recordings_dir, db=catalog_file, should_stop=None):
+    """
+    Add every finished recording that isn't in the catalog yet, e.g. one that was recovered after a crash,
+    and remove the entries of recordings that were deleted. Call this once at startup, see *sync_catalog_later()*.
+    Summarizing a recording reads all of it, so this takes a while if many recordings are missing.
+
+    :param root: directory of the recordings
+    :param db: catalog database file
+    :param should_stop: function returning True to stop before the next recording, None to always finish
+    :return: list of the files added
+    """
+
+    on_disk = set()
+    if os.path.isdir(root):
+        on_disk = set(os.path.abspath(os.path.join(root, name)) for name in os.listdir(root)
+                      if name.endswith(journal_extension))
+
+    with connect(db) as connection:
+        known = set(row["path"] for row in connection.execute("SELECT path FROM runs"))
+        gone = [path for path in known if not os.path.exists(path)]
+        connection.executemany("DELETE FROM runs WHERE path = ?", [(path,) for path in gone])
+    connection.close()
+
+    added = []
+    for path in sorted(on_disk - known):
+        if should_stop is not None and should_stop():
+            break
+        try:
+            add_run(path, db)
+            added.append(path)
+        except (OSError, ValueError, sqlite3.Error):
+            pass
+    return added
+
+
+def list_runs(db=catalog_file):
+    """
+    List the runs in the catalog without their thumbnails, newest first.
+
+    :param db: catalog database file
+    :return: list of dicts with every column of the runs table but the thumbnail
+    """
+    connection = connect(db)
+    rows = connection.execute("SELECT %s FROM runs ORDER BY started DESC" % ", ".join(_columns[:-1])).fetchall()
+    connection.close()
+    return [dict(row) for row in rows]
+
+
+def get_thumbnail(path, db=catalog_file):
+    """
+    The thumbnail trace of a run.
+
+    :param path: recording file
+    :param db: catalog database file
+    :return: tuple (x, mins, maxs) of numpy arrays, x in seconds since the start of the run at the start of each
+            column, or None if the run isn't in the catalog
+    """
+    connection = connect(db)
+    row = connection.execute("SELECT duration, thumbnail FROM runs WHERE path = ?",
+                             (os.path.abspath(path),)).fetchone()
+    connection.close()
+    if row is None:
+        return None
+
+    mins, maxs = np.frombuffer(row["thumbnail"], dtype="<f4").reshape(2, -1)
+    return np.arange(mins.size) * (row["duration"] / mins.size), mins, maxs
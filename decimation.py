@@ -0,0 +1,285 @@
+"""
+:platform: Unix, Windows
+:synopsis: This module reduces the rolling windows to a few points per pixel column before they are drawn.
+    For every column the first, last, smallest and largest sample are kept (M4 decimation), so the decimated
+    line covers exactly the same pixels as the full one, while the number of points drawn only depends on the
+    width of the plot.
+:moduleauthor: Michael Eller <mbe9a@virginia.edu>
+"""
+
+import numpy as np
+from history import ChunkedArray, default_chunk_size
+
+
+def m4(values, start=0):
+    """
+    Decimate consecutive buckets of samples, keeping the first, smallest, largest and last sample of each.
+
+    :param values: numpy array of shape (buckets, bucket size)
+    :param start: index of the first sample in *values*
+    :return: tuple (indices, values) of numpy arrays of shape (buckets, 4), in index order within every bucket
+    """
+
+    buckets, size = values.shape
+    rows = np.arange(buckets)
+    # index of the first, smallest, largest and last sample within each bucket
+    positions = np.stack((np.zeros(buckets, dtype=np.intp), np.argmin(values, axis=1),
+                          np.argmax(values, axis=1), np.full(buckets, size - 1, dtype=np.intp)), axis=1)
+    # the line has to visit the four samples in time order
+    positions.sort(axis=1)
+    picked = values[rows[:, np.newaxis], positions]
+    return start + size * rows[:, np.newaxis] + positions, picked
+
+
+class MinMaxDecimator(object):
+    """
+    Incremental M4 decimation of a rolling window.
+
+    The buckets are aligned to the absolute index of the samples (how many samples came before them),
+    not to the window, so a bucket that is complete never changes while it scrolls across the plot.
+    Complete buckets are cached and every frame only has to decimate the samples that arrived since the last one,
+    plus the partial buckets at both edges of the window.
+    """
+
+    def __init__(self, columns):
+        """
+        :param columns: number of pixel columns the window is drawn on
+        """
+        self.columns = max(1, int(columns))
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the cached buckets. This must be called whenever samples already in the window change,
+        e.g. when the history is filtered again.
+        """
+        # samples per bucket the cache was built with
+        self._bucket = None
+        # absolute bucket number of the first cached bucket
+        self._first = 0
+        # cached (indices, values) of complete buckets, absolute sample indices, shape (buckets, 4)
+        self._indices = np.empty((0, 4), dtype=np.intp)
+        self._values = np.empty((0, 4))
+
+    def decimate(self, window, total, columns=None):
+        """
+        Decimate the newest state of a rolling window.
+
+        :param window: numpy array of the samples in the window, oldest first
+        :param total: number of samples that have been appended to the window so far, including the newest one
+        :param columns: number of pixel columns, if it changed since the last call
+        :return: tuple (indices, values). *indices* are positions in *window*, in increasing order.
+        """
+
+        if columns is not None and int(columns) != self.columns:
+            self.columns = max(1, int(columns))
+
+        n = window.size
+        bucket = -(-n // self.columns)
+        # nothing to gain from decimating a window that already fits
+        if bucket <= 2:
+            return np.arange(n), window
+
+        # absolute index of the oldest sample in the window
+        oldest = total - n
+        # the first bucket that lies completely in the window and the first one that isn't complete yet
+        first = -(-oldest // bucket)
+        end = total // bucket
+
+        # the cache is only valid for the same bucket size and a contiguous run of buckets inside the window
+        cached_end = self._first + self._indices.shape[0]
+        if bucket != self._bucket or first < self._first or cached_end > end:
+            self.reset()
+            self._bucket = bucket
+            self._first = first
+            cached_end = first
+
+        # drop the buckets that scrolled out of the window
+        if first > self._first:
+            drop = min(first - self._first, self._indices.shape[0])
+            self._indices = self._indices[drop:]
+            self._values = self._values[drop:]
+            self._first += drop
+            cached_end = self._first + self._indices.shape[0]
+        if cached_end < first:
+            self._first = cached_end = first
+
+        # decimate the buckets completed since the last call
+        if end > cached_end:
+            new = window[cached_end * bucket - oldest:end * bucket - oldest].reshape(-1, bucket)
+            indices, values = m4(new, cached_end * bucket)
+            self._indices = np.concatenate((self._indices, indices))
+            self._values = np.concatenate((self._values, values))
+
+        # the partial buckets at both edges are small, decimate them from scratch
+        head = window[:max(0, first * bucket - oldest)]
+        tail = window[max(0, end * bucket - oldest):]
+        parts = [(head, oldest), (None, None), (tail, max(oldest, end * bucket))]
+
+        all_indices = []
+        all_values = []
+        for part, start in parts:
+            if part is None:
+                all_indices.append(self._indices.ravel())
+                all_values.append(self._values.ravel())
+            elif part.size > 0:
+                indices, values = m4(part[np.newaxis, :], start)
+                all_indices.append(indices.ravel())
+                all_values.append(values.ravel())
+
+        # back to positions in the window
+        return np.concatenate(all_indices) - oldest, np.concatenate(all_values)
+
+
+class MinMaxPyramid(object):
+    """
+    Level-of-detail pyramid of a growing sequence of samples, used to browse the whole run.
+
+    Level 0 is the samples themselves. Every entry of level k holds the minimum and maximum of *factor*
+    entries of level k - 1, i.e. of factor^k samples. The pyramid is extended incrementally with *update()*,
+    which costs O(new samples). A query for n pixel columns reads at most n * factor entries of one level,
+    no matter whether it covers the whole run or a few samples.
+    """
+
+    def __init__(self, samples, factor=4, column=ChunkedArray):
+        """
+        :param samples: the sequence of samples (anything with len() and slicing), the pyramid reads it but
+                never changes it
+        :param factor: number of entries of a level that make up one entry of the next level
+        :param column: function that creates an empty history.ChunkedArray for a level,
+                e.g. history.HistorySession.column to spill the levels of a long run to disk as well
+        """
+        self.samples = samples
+        self.factor = int(factor)
+        self.column = column
+        self._mins = []
+        self._maxs = []
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all levels. The next *update()* rebuilds them from *samples*.
+        """
+        for level in self._mins + self._maxs:
+            level.clear()
+        # minimums and maximums of levels 1, 2, ...
+        self._mins = []
+        self._maxs = []
+
+    @property
+    def levels(self):
+        """
+        Number of levels above level 0 that hold at least one complete entry.
+        """
+        return len(self._mins)
+
+    def update(self):
+        """
+        Add every sample appended to *samples* since the last call to the levels.
+        """
+
+        f = self.factor
+        # complete entries below the current level that aren't summarized by it yet, start with the samples
+        below_size = len(self.samples)
+        level = 0
+        while below_size // f > (len(self._mins[level]) if level < self.levels else 0):
+            if level == self.levels:
+                # a new level on top of the pyramid, its chunks shrink with the level like its entries do
+                chunk_size = max(1024, default_chunk_size // f ** (level + 1))
+                self._mins.append(self.column(np.float64, chunk_size))
+                self._maxs.append(self.column(np.float64, chunk_size))
+
+            size = len(self._mins[level])
+            complete = below_size // f
+            # the entries of the level below that complete new entries of this one
+            if level == 0:
+                lo = hi = np.asarray(self.samples[size * f:complete * f], dtype=np.float64)
+            else:
+                lo = self._mins[level - 1][size * f:complete * f]
+                hi = self._maxs[level - 1][size * f:complete * f]
+            self._mins[level].extend(lo.reshape(-1, f).min(axis=1))
+            self._maxs[level].extend(hi.reshape(-1, f).max(axis=1))
+
+            below_size = complete
+            level += 1
+
+    def _entries(self, level, first, last):
+        """
+        Minimums and maximums of the entries *first* to *last* - 1 of a level.
+        The newest entry may be incomplete, it is summarized from the level below on the fly.
+
+        :param level: level of the pyramid, 0 for the samples
+        :param first: index of the first entry
+        :param last: index after the last entry
+        :return: tuple (mins, maxs) of numpy arrays
+        """
+
+        if level == 0:
+            values = np.asarray(self.samples[first:last], dtype=np.float64)
+            return values, values
+
+        size = len(self._mins[level - 1]) if level <= self.levels else 0
+        mins = self._mins[level - 1][first:min(last, size)] if size > 0 else np.empty(0)
+        maxs = self._maxs[level - 1][first:min(last, size)] if size > 0 else np.empty(0)
+
+        # the incomplete newest entry
+        if last > max(first, size):
+            below_first = max(first, size) * self.factor
+            below_last = min(last * self.factor, self.length(level - 1))
+            lo, hi = self._entries(level - 1, below_first, below_last)
+            if lo.size > 0:
+                mins = np.append(mins, lo.min())
+                maxs = np.append(maxs, hi.max())
+        return mins, maxs
+
+    def length(self, level):
+        """
+        :param level: level of the pyramid, 0 for the samples
+        :return: number of entries of the level, including an incomplete newest one
+        """
+        bucket = self.factor ** level
+        return -(-len(self.samples) // bucket)
+
+    def query(self, start, stop, columns):
+        """
+        Summarize the samples *start* to *stop* - 1 for drawing on *columns* pixel columns.
+        The coarsest level that still has at least one entry per column is used, so the result is at most
+        *columns* minimum / maximum pairs. Zoomed in far enough, the samples themselves are returned.
+
+        :param start: index of the first sample
+        :param stop: index after the last sample
+        :param columns: number of pixel columns
+        :return: tuple (positions, values) of numpy arrays. *positions* are sample indices in increasing order.
+                Each column contributes its minimum and then its maximum at the index of its first sample.
+        """
+
+        start = max(0, int(start))
+        stop = min(len(self.samples), int(stop))
+        columns = max(1, int(columns))
+        if stop <= start:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+
+        # the coarsest level whose entries are no longer than a column
+        span = stop - start
+        level = 0
+        while level < self.levels and self.factor ** (level + 1) * columns <= span:
+            level += 1
+
+        if level == 0:
+            return np.arange(start, stop), np.asarray(self.samples[start:stop], dtype=np.float64)
+
+        # the entries covering the range, rounded out to whole entries
+        bucket = self.factor ** level
+        first = start // bucket
+        mins, maxs = self._entries(level, first, -(-stop // bucket))
+
+        # combine neighbouring entries into columns
+        per_column = -(-mins.size // columns)
+        starts = np.arange(0, mins.size, per_column)
+        mins = np.minimum.reduceat(mins, starts)
+        maxs = np.maximum.reduceat(maxs, starts)
+
+        positions = np.repeat((first + starts) * bucket, 2)
+        positions[0] = max(positions[0], start)
+        positions[1] = positions[0]
+        return positions, np.stack((mins, maxs), axis=1).ravel()
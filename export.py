@@ -0,0 +1,330 @@
+"""
+:platform: Unix, Windows
+:synopsis: This module exports the recorded run of the live plot, as CSV or as binary columns (NPZ, or Arrow IPC
+    if pyarrow is installed) that load without any parsing. The columns are written a whole chunk of rows
+    at a time on a background thread, so even a run of many hours is saved without freezing the plot, and the
+    file is only put in place once it is completely on disk.
+:moduleauthor: Michael Eller <mbe9a@virginia.edu>
+"""
+
+import json
+import os
+import struct
+import zipfile
+import numpy as np
+from PyQt5 import QtCore
+from PyQt5.QtCore import QThread
+from settings_interface import get_sample_rate, get_calibration_tool, get_calibration_board
+from calibration import get_calibration_segments
+
+# Arrow IPC files are optional, they need pyarrow
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+#: whether Arrow IPC files can be written and read
+arrow_supported = pyarrow is not None
+
+#: number of rows formatted and written at once
+export_chunk_rows = 65536
+
+#: name of the member of an NPZ file (without .npy) and of the schema metadata key of an Arrow file
+#: that hold the run's metadata as JSON
+metadata_key = "metadata"
+
+# fixed part of a zip member's local file header, followed by the file name and the extra field
+_zip_local_header = struct.Struct("<4s2B4HL2L2H")
+
+
+class ElapsedTimes(object):
+    """
+    Time column of a run: the recorded timestamps as seconds since the first sample, calculated when it is sliced.
+    """
+
+    #: dtype of the times
+    dtype = np.dtype(np.float64)
+
+    def __init__(self, times, size):
+        """
+        :param times: sliceable column of time.monotonic() timestamps, e.g. plot_data.PlotData.all_times
+        :param size: number of samples
+        """
+        self.times = times
+        self.size = size
+        # the start of the run
+        self.start = float(times[0]) if size > 0 else 0.
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, item):
+        """
+        :param item: slice
+        :return: numpy float64 array of the times in seconds
+        """
+        start, stop, step = item.indices(self.size)
+        return np.asarray(self.times[start:stop:step], dtype=np.float64) - self.start
+
+
+def run_columns(plot):
+    """
+    Every column of the run recorded by the live plot, cut to the samples that are in all of them.
+
+    :param plot: plot_data.PlotData backend of the live plot
+    :return: tuple (columns, size). *columns* is a list of (key, name, format, column) tuples: the key names the
+            column in binary files, the name is the CSV header, the format the CSV format. The columns are
+            sliceable and have a dtype (see history.ChunkedArray). *size* is the number of samples to export.
+    """
+
+    # the plot keeps appending while the export runs, only export what is there now.
+    # the stored values never move, so the columns can be read from another thread.
+    size = min(len(plot.all), len(plot.all_times), len(plot.all_counts), len(plot.all_deriv),
+               len(plot.all_filtered_data), len(plot.all_filtered_deriv))
+    return [("time", "Time (s)", "%.6f", ElapsedTimes(plot.all_times, size)),
+            ("counts", "Counts", "%d", plot.all_counts),
+            ("signal", "Signal (V)", "%.9g", plot.all),
+            ("filtered_signal", "Filtered Signal (V)", "%.9g", plot.all_filtered_data),
+            ("derivative", "Derivative (V)", "%.9g", plot.all_deriv),
+            ("filtered_derivative", "Filtered Derivative (V)", "%.9g", plot.all_filtered_deriv)], size
+
+
+def run_metadata(plot, port):
+    """
+    Everything needed to interpret an exported run later.
+
+    :param plot: plot_data.PlotData backend of the live plot
+    :param port: serial port the run was acquired on
+    :return: dict that can be serialized to JSON
+    """
+    return {"sample_rate": get_sample_rate(), "port": port,
+            "calibration_tool": get_calibration_tool(), "calibration_board": get_calibration_board(),
+            "calibration": [list(segment) for segment in get_calibration_segments()],
+            "filter_type": plot.filter_type, "window_samples": plot.window_samples}
+
+
+def write_atomic(path, write, mode="w"):
+    """
+    Write a file next to *path* and only move it to *path* once it is complete and on disk,
+    so *path* never holds a partial file, not even after a crash.
+
+    :param path: file to write
+    :param write: function that writes the contents to the file object it is given.
+            It returns False to cancel, in which case *path* is left untouched.
+    :param mode: "w" for a text file, "wb" for a binary file
+    :return: bool indicating whether the file was written
+    """
+
+    temp = path + ".tmp"
+    try:
+        with open(temp, mode, newline="" if mode == "w" else None) as f:
+            if write(f) is False:
+                f.close()
+                os.remove(temp)
+                return False
+            # push the file through Python's and the operating system's buffers before it replaces *path*
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        # don't leave the partial file behind
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    return True
+
+
+def write_csv(path, columns, size, chunk_rows=export_chunk_rows, progress=None, should_stop=None):
+    """
+    Write columns to a CSV file. Each chunk of rows is formatted with a single string operation
+    instead of row by row.
+
+    :param path: file to write
+    :param columns: list of (key, name, format, column) tuples, see *run_columns()*
+    :param size: number of rows
+    :param chunk_rows: number of rows formatted at once
+    :param progress: function called with the percentage done after every chunk, None for no reports
+    :param should_stop: function returning True to cancel, None to always finish
+    :return: bool indicating whether the file was written
+    """
+
+    # one format string for a whole chunk of rows
+    line = ",".join(fmt for _, _, fmt, _ in columns) + "\n"
+
+    def write(f):
+        f.write(",".join(name for _, name, _, _ in columns) + "\n")
+        for start in range(0, size, chunk_rows):
+            if should_stop is not None and should_stop():
+                return False
+            stop = min(size, start + chunk_rows)
+            # rows of the chunk, flattened row by row
+            block = np.column_stack([np.asarray(column[start:stop], dtype=np.float64)
+                                     for _, _, _, column in columns])
+            f.write((line * (stop - start)) % tuple(block.ravel().tolist()))
+            if progress is not None:
+                progress(int(100 * stop / size))
+        return True
+
+    return write_atomic(path, write)
+
+
+def write_npz(path, columns, size, metadata, chunk_rows=export_chunk_rows, progress=None, should_stop=None):
+    """
+    Write columns to an uncompressed NPZ file, one .npy member per column plus the metadata as JSON.
+    np.load() reads it like any NPZ file, *load_export()* memory-maps the columns without reading them.
+    The columns are streamed into the file chunk by chunk, they are never copied into one array.
+
+    :param path: file to write
+    :param columns: list of (key, name, format, column) tuples, see *run_columns()*
+    :param size: number of rows
+    :param metadata: dict of run metadata, see *run_metadata()*
+    :param chunk_rows: number of rows written at once
+    :param progress: function called with the percentage done after every chunk, None for no reports
+    :param should_stop: function returning True to cancel, None to always finish
+    :return: bool indicating whether the file was written
+    """
+
+    def write(f):
+        # stored, not deflated, so every column can be memory-mapped straight out of the file
+        with zipfile.ZipFile(f, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+            with zf.open(metadata_key + ".npy", "w") as member:
+                np.lib.format.write_array(member, np.array(json.dumps(metadata)))
+
+            for i, (key, _, _, column) in enumerate(columns):
+                with zf.open(key + ".npy", "w", force_zip64=True) as member:
+                    dtype = np.dtype(column.dtype).newbyteorder("<")
+                    np.lib.format.write_array_header_1_0(member, {"descr": np.lib.format.dtype_to_descr(dtype),
+                                                                  "fortran_order": False, "shape": (size,)})
+                    for start in range(0, size, chunk_rows):
+                        if should_stop is not None and should_stop():
+                            return False
+                        stop = min(size, start + chunk_rows)
+                        member.write(np.asarray(column[start:stop], dtype=dtype).tobytes())
+                        if progress is not None:
+                            progress(int(100 * (i * size + stop) / (len(columns) * size)))
+        return True
+
+    return write_atomic(path, write, "wb")
+
+
+def write_arrow(path, columns, size, metadata, chunk_rows=export_chunk_rows, progress=None, should_stop=None):
+    """
+    Write columns to an Arrow IPC file, one record batch per chunk of rows, with the metadata as JSON
+    in the schema. This needs pyarrow.
+
+    :param path: file to write
+    :param columns: list of (key, name, format, column) tuples, see *run_columns()*
+    :param size: number of rows
+    :param metadata: dict of run metadata, see *run_metadata()*
+    :param chunk_rows: number of rows written at once
+    :param progress: function called with the percentage done after every chunk, None for no reports
+    :param should_stop: function returning True to cancel, None to always finish
+    :return: bool indicating whether the file was written
+    """
+
+    if pyarrow is None:
+        raise ValueError("Arrow files need pyarrow, which is not installed")
+
+    schema = pyarrow.schema([(key, pyarrow.from_numpy_dtype(column.dtype)) for key, _, _, column in columns],
+                            metadata={metadata_key: json.dumps(metadata)})
+
+    def write(f):
+        with pyarrow.ipc.new_file(f, schema) as writer:
+            for start in range(0, size, chunk_rows):
+                if should_stop is not None and should_stop():
+                    return False
+                stop = min(size, start + chunk_rows)
+                writer.write_batch(pyarrow.record_batch([np.asarray(column[start:stop], dtype=column.dtype)
+                                                         for _, _, _, column in columns], schema=schema))
+                if progress is not None:
+                    progress(int(100 * stop / size))
+        return True
+
+    return write_atomic(path, write, "wb")
+
+
+def load_export(path):
+    """
+    Read a binary export back without parsing it. The columns of an NPZ file are read-only memory maps of the file,
+    so opening a run costs nothing until its values are used. An Arrow file is memory-mapped as well; its record
+    batches are joined into one array per column, which copies them.
+
+    :param path: NPZ or Arrow file written by *write_npz()* or *write_arrow()*
+    :return: tuple (columns, metadata). *columns* is a dict of numpy arrays by key (see *run_columns()*),
+            *metadata* the dict from *run_metadata()*.
+    """
+
+    if not path.lower().endswith(".npz"):
+        if pyarrow is None:
+            raise ValueError("Arrow files need pyarrow, which is not installed")
+        table = pyarrow.ipc.open_file(pyarrow.memory_map(path, "r")).read_all()
+        metadata = json.loads(table.schema.metadata[metadata_key.encode()].decode("utf-8"))
+        return {name: table.column(name).to_numpy() for name in table.column_names}, metadata
+
+    columns = {}
+    metadata = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            key = info.filename[:-len(".npy")]
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError("%s is compressed and can't be memory-mapped" % info.filename)
+
+            # the data starts after the member's local header, whose extra field may differ from the directory's
+            f.seek(info.header_offset)
+            fields = _zip_local_header.unpack(f.read(_zip_local_header.size))
+            f.seek(fields[-2] + fields[-1], os.SEEK_CUR)
+
+            # the .npy header tells the dtype and shape of the data behind it
+            if np.lib.format.read_magic(f) == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if key == metadata_key:
+                metadata = json.loads(str(np.fromfile(f, dtype=dtype, count=1)[0]))
+            elif shape[0] == 0:
+                columns[key] = np.empty(shape, dtype=dtype)
+            else:
+                columns[key] = np.memmap(path, dtype=dtype, mode="r", offset=f.tell(), shape=shape)
+    return columns, metadata
+
+
+class ExportThread(QThread):
+    """
+    Runs an export next to the GUI thread, reports its progress and can be cancelled.
+    """
+
+    #: percentage of the file written
+    progress = QtCore.pyqtSignal(int)
+    #: emitted at the end: whether the file was written and an error message, empty if there was none
+    done = QtCore.pyqtSignal(bool, str)
+
+    def __init__(self, export, *args):
+        """
+        :param export: export function, e.g. *write_csv()*. It must take the keyword arguments *progress* and
+                *should_stop*, and return whether the file was written.
+        :param args: the export function's other arguments
+        """
+        QThread.__init__(self)
+        self.export = export
+        self.args = args
+        # set by cancel()
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Stop the export after the current chunk. The target file is left untouched.
+        """
+        self.cancelled = True
+
+    def run(self):
+        """
+        This overrides the parent *run()* method.
+        """
+        try:
+            written = self.export(*self.args, progress=self.progress.emit, should_stop=lambda: self.cancelled)
+        except Exception as e:
+            # whatever went wrong, the dialog waiting for *done* must hear about it.
+            # some errors (e.g. MemoryError) have no message, their type is the message then.
+            self.done.emit(False, str(e) or type(e).__name__)
+            return
+        self.done.emit(written, "")
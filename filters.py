@@ -0,0 +1,249 @@
+"""
+:platform: Unix, Windows
+:synopsis: This module contains the streaming filters used to smooth the endpoint signal and its derivative.
+    Every filter keeps the state it needs between calls, so a stream can be filtered one block at a time and
+    give exactly the same result as filtering it all at once.
+:moduleauthor: Michael Eller <mbe9a@virginia.edu>
+"""
+
+from bisect import bisect_left, insort
+from collections import deque
+import numpy as np
+
+
+class MovingAverage(object):
+    """
+    Average of the newest sample and the *window* - 1 samples before it.
+    The sum over each window is the difference of two running sums, so the cost doesn't depend on the window.
+    """
+
+    def __init__(self, window):
+        """
+        :param window: number of samples to average
+        """
+        self.window = int(window)
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the stream. The next block starts a new one.
+        """
+        # the last *window* - 1 samples, None until the first block arrives
+        self._history = None
+
+    def update(self, values):
+        """
+        Filter a block of new samples.
+
+        :param values: numpy array of new samples
+        :return: numpy array of filtered values, same length as *values*
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return values
+
+        # a new stream behaves as if the first sample had been there for a whole window
+        if self._history is None:
+            self._history = np.full(self.window - 1, values[0])
+
+        # the samples before the block, followed by the block itself
+        extended = np.concatenate((self._history, values))
+        sums = np.cumsum(np.concatenate(([0.], extended)))
+        filtered = (sums[self.window:] - sums[:-self.window]) / float(self.window)
+
+        self._history = extended[extended.size - (self.window - 1):]
+        return filtered
+
+
+class ExponentialMovingAverage(object):
+    """
+    Exponential moving average with smoothing factor alpha = 2 / (window + 1), i.e. the same center of mass as a
+    moving average over *window* samples.
+
+    y[i] = (1 - alpha) * y[i - 1] + alpha * x[i] is evaluated in closed form for a chunk at a time:
+    y[i] = d^(i+1) * (y[-1] + alpha * sum_k x[k] / d^(k+1)), d = 1 - alpha.
+    The chunks are kept short enough for d^i to stay well away from underflow.
+    """
+
+    def __init__(self, window):
+        """
+        :param window: equivalent moving average window in samples
+        """
+        self.window = int(window)
+        self.alpha = 2. / (self.window + 1.)
+        decay = 1. - self.alpha
+        # longest chunk for which decay^n >= 1e-6
+        self._chunk = int(np.log(1e-6) / np.log(decay)) if 0. < decay < 1. else 1
+        self._chunk = max(1, self._chunk)
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the stream. The next block starts a new one.
+        """
+        # the last output, None until the first block arrives
+        self._last = None
+
+    def update(self, values):
+        """
+        Filter a block of new samples.
+
+        :param values: numpy array of new samples
+        :return: numpy array of filtered values, same length as *values*
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return values
+
+        # a window of one sample doesn't filter anything
+        if self.alpha >= 1.:
+            self._last = values[-1]
+            return values.copy()
+
+        # a new stream starts at its first sample
+        if self._last is None:
+            self._last = values[0]
+
+        decay = 1. - self.alpha
+        filtered = np.empty_like(values)
+        for start in range(0, values.size, self._chunk):
+            chunk = values[start:start + self._chunk]
+            powers = decay ** np.arange(1, chunk.size + 1)
+            out = powers * (self._last + self.alpha * np.cumsum(chunk / powers))
+            filtered[start:start + chunk.size] = out
+            self._last = out[-1]
+
+        return filtered
+
+
+class RollingMedian(object):
+    """
+    Median of the newest sample and the *window* - 1 samples before it.
+    The window is kept sorted, so every new sample costs a binary search plus one insertion and one removal.
+    """
+
+    def __init__(self, window):
+        """
+        :param window: number of samples in the median
+        """
+        self.window = int(window)
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the stream. The next block starts a new one.
+        """
+        # samples in arrival order, to know which one leaves the window next
+        self._arrivals = deque()
+        # the same samples, sorted
+        self._sorted = []
+
+    def update(self, values):
+        """
+        Filter a block of new samples.
+
+        :param values: numpy array of new samples
+        :return: numpy array of filtered values, same length as *values*
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return values
+
+        # a new stream behaves as if the first sample had been there for a whole window
+        if not self._arrivals:
+            self._arrivals.extend([float(values[0])] * (self.window - 1))
+            self._sorted = list(self._arrivals)
+
+        arrivals = self._arrivals
+        window = self._sorted
+        middle = self.window // 2
+        even = self.window % 2 == 0
+
+        filtered = np.empty_like(values)
+        for i, value in enumerate(values.tolist()):
+            insort(window, value)
+            arrivals.append(value)
+            if len(arrivals) > self.window:
+                del window[bisect_left(window, arrivals.popleft())]
+            if even:
+                filtered[i] = 0.5 * (window[middle - 1] + window[middle])
+            else:
+                filtered[i] = window[middle]
+
+        return filtered
+
+
+class SavitzkyGolay(object):
+    """
+    Savitzky-Golay smoother: a least-squares polynomial is fit to the newest sample and the *window* - 1 samples
+    before it, and evaluated at the newest sample. That fit is a fixed set of weights, so filtering a block is a
+    single convolution. Evaluating at the end of the window (instead of the middle) keeps the filter causal,
+    so the head of the plot doesn't have to wait for future samples.
+    """
+
+    #: default order of the fitted polynomial
+    default_polyorder = 2
+
+    def __init__(self, window, polyorder=default_polyorder):
+        """
+        :param window: number of samples in each fit
+        :param polyorder: order of the fitted polynomial, lowered to window - 1 for small windows
+        """
+        self.window = int(window)
+        self.polyorder = min(int(polyorder), self.window - 1)
+
+        # least-squares fit of the window, positions relative to the newest sample.
+        # the value of the fit at position 0 is the first fitted coefficient, i.e. the first row of the pseudo-inverse
+        positions = np.arange(-(self.window - 1), 1, dtype=np.float64)
+        design = np.vander(positions, self.polyorder + 1, increasing=True)
+        self.weights = np.linalg.pinv(design)[0]
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the stream. The next block starts a new one.
+        """
+        # the last *window* - 1 samples, None until the first block arrives
+        self._history = None
+
+    def update(self, values):
+        """
+        Filter a block of new samples.
+
+        :param values: numpy array of new samples
+        :return: numpy array of filtered values, same length as *values*
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return values
+
+        # a new stream behaves as if the first sample had been there for a whole window
+        if self._history is None:
+            self._history = np.full(self.window - 1, values[0])
+
+        extended = np.concatenate((self._history, values))
+        # np.convolve flips its second argument, flip the weights back so they line up with the window
+        filtered = np.convolve(extended, self.weights[::-1], mode='valid')
+
+        self._history = extended[extended.size - (self.window - 1):]
+        return filtered
+
+
+#: filter classes by the names used in the settings file (settings_interface.filter_types)
+filter_classes = {"moving-average": MovingAverage, "ema": ExponentialMovingAverage,
+                  "median": RollingMedian, "savitzky-golay": SavitzkyGolay}
+
+
+def make_filter(kind, window):
+    """
+    Create a streaming filter.
+
+    :param kind: one of settings_interface.filter_types, unknown kinds get a moving average
+    :param window: window size in samples
+    :return: a new filter with an empty state
+    """
+    return filter_classes.get(kind, MovingAverage)(window)
@@ -0,0 +1,341 @@
+"""
+:platform: Unix, Windows
+:synopsis: This module contains the store for the whole recorded history of a run. Every column (raw data,
+    derivative, filtered data, ...) is a ChunkedArray: a list of preallocated NumPy chunks that only ever grows
+    at the end, so appending never copies what is already stored. Only the newest chunks stay in memory,
+    older ones are moved to memory-mapped files in a session directory.
+:moduleauthor: Michael Eller <mbe9a@virginia.edu>
+"""
+
+import operator
+import os
+import shutil
+import sys
+import time
+import numpy as np
+
+#: default number of values per chunk, 512 KiB of float64
+default_chunk_size = 65536
+
+#: directory that holds one directory per plot session, next to resources/
+sessions_dir = "sessions"
+
+
+class HistorySession(object):
+    """
+    Session directory that the columns of one run spill their old chunks to.
+
+    Every column appends its spilled chunks to its own file and reads them back through one read-only
+    numpy.memmap of that file, so the operating system pages them in when they are looked at and can drop them
+    again under memory pressure. The directory is created with the first spilled chunk and removed by *close()*.
+    It is named after the start time and the process id, so *remove_stale_sessions()* can tell the directories of
+    a crashed run from those of a running one. If the directory can't be written, the chunks simply stay in memory.
+    """
+
+    def __init__(self, hot_chunks=8, root=sessions_dir):
+        """
+        :param hot_chunks: number of full chunks every column keeps in memory
+        :param root: directory the session directory is created in
+        """
+        self.hot_chunks = int(hot_chunks)
+        self.root = root
+        # session directory, None until the first chunk is spilled
+        self.path = None
+        # number of column files created, used to name them
+        self._files = 0
+        # set when spilling failed, from then on everything stays in memory
+        self.failed = False
+
+    def column(self, dtype=np.float64, chunk_size=default_chunk_size):
+        """
+        Create a column of this session.
+
+        :param dtype: numpy dtype of the values
+        :param chunk_size: number of values per chunk
+        :return: an empty ChunkedArray that spills to this session
+        """
+        return ChunkedArray(dtype, chunk_size, session=self)
+
+    def spill(self, column, chunks):
+        """
+        Append full chunks of a column to its file.
+
+        :param column: the ChunkedArray the chunks belong to
+        :param chunks: list of numpy arrays, oldest first
+        :return: read-only numpy.memmap of everything the column has spilled so far,
+                None if the chunks couldn't be written
+        """
+
+        if self.failed:
+            return None
+
+        try:
+            # one directory per session, named after its start time
+            if self.path is None:
+                self.path = os.path.join(self.root, time.strftime("%Y%m%d-%H%M%S") + "-%d" % os.getpid())
+                os.makedirs(self.path)
+
+            # one file per column
+            if column.file is None:
+                column.file = os.path.join(self.path, "column_%04d.bin" % self._files)
+                self._files += 1
+
+            with open(column.file, "ab") as f:
+                for chunk in chunks:
+                    chunk.tofile(f)
+            return np.memmap(column.file, dtype=column.dtype, mode='r')
+        except OSError:
+            self.failed = True
+            return None
+
+    def remove(self, path):
+        """
+        Delete a column file that is no longer needed.
+        A file that is still mapped can't be deleted on Windows, it goes with the session directory.
+
+        :param path: file of the column
+        """
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def close(self):
+        """
+        Delete the session directory and every chunk file in it.
+        """
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+
+
+def process_alive(pid):
+    """
+    :param pid: process id
+    :return: bool indicating whether a process with this id is running
+    """
+
+    if pid == os.getpid():
+        return True
+
+    if sys.platform == "win32":
+        # os.kill() would terminate the process on Windows, ask the kernel for its exit code instead
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            # access denied means the process exists but belongs to someone else
+            return kernel32.GetLastError() == 5  # ERROR_ACCESS_DENIED
+        try:
+            code = ctypes.c_ulong()
+            kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+            return code.value == 259  # STILL_ACTIVE
+        finally:
+            kernel32.CloseHandle(handle)
+
+    try:
+        # signal 0 only checks that the process exists
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def remove_stale_sessions(root=sessions_dir):
+    """
+    Delete the session directories of runs whose program is no longer running, i.e. that ended in a crash
+    before *HistorySession.close()* was called. Call this once at startup.
+
+    :param root: directory of the session directories
+    :return: list of the directories deleted
+    """
+
+    removed = []
+    if not os.path.isdir(root):
+        return removed
+
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        # the name ends with the id of the process that created it, see HistorySession.spill()
+        pid = name.rsplit("-", 1)[-1]
+        if not os.path.isdir(path) or not pid.isdigit() or process_alive(int(pid)):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        if not os.path.exists(path):
+            removed.append(path)
+    return removed
+
+
+class ChunkedArray(object):
+    """
+    Growable one-dimensional array made of fixed-size NumPy chunks.
+
+    Appending fills the newest chunk and allocates a new one when it is full, so it costs O(1) and the
+    stored values never move. A slice within one chunk is a view into it (no copy), a slice across chunks
+    copies only the chunks it touches. Indexing and slicing follow the rules for Python lists.
+
+    With a HistorySession, only the newest *hot_chunks* full chunks stay in memory. The older ones are
+    replaced by memory maps of their spilled files, which index and slice exactly the same way.
+    """
+
+    def __init__(self, dtype=np.float64, chunk_size=default_chunk_size, session=None):
+        """
+        :param dtype: numpy dtype of the values, e.g. np.float32 to halve the memory of a long run
+        :param chunk_size: number of values per chunk
+        :param session: HistorySession to spill old chunks to, None to keep everything in memory
+        """
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = int(chunk_size)
+        self.session = session
+        # file the session spills the oldest chunks to, None until the first one is spilled
+        self.file = None
+        self.clear()
+
+    def clear(self):
+        """
+        Remove every value.
+        """
+        # full chunks followed by the one being filled, the oldest ones may be views of a memory map
+        self._chunks = []
+        self._size = 0
+        # number of chunks at the front that were moved to disk
+        self._spilled = 0
+
+        # the spilled chunks aren't needed anymore
+        if self.file is not None:
+            self.session.remove(self.file)
+            self.file = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        """
+        Memory held by the chunks that weren't moved to disk, in bytes.
+        """
+        return (len(self._chunks) - self._spilled) * self.chunk_size * self.dtype.itemsize
+
+    @property
+    def disk_bytes(self):
+        """
+        Size of the chunks that were moved to disk, in bytes.
+        """
+        return self._spilled * self.chunk_size * self.dtype.itemsize
+
+    def append(self, value):
+        """
+        Add one value at the end.
+
+        :param value: the new value
+        """
+        self.extend((value,))
+
+    def extend(self, values):
+        """
+        Add a block of values at the end.
+
+        :param values: numpy array (or sequence) of new values
+        """
+
+        values = np.asarray(values, dtype=self.dtype).ravel()
+        done = 0
+        while done < values.size:
+            # start a new chunk when the newest one is full
+            offset = self._size % self.chunk_size
+            if offset == 0 and self._size // self.chunk_size == len(self._chunks):
+                self._spill()
+                self._chunks.append(np.empty(self.chunk_size, dtype=self.dtype))
+
+            # fill as much of the newest chunk as possible
+            n = min(self.chunk_size - offset, values.size - done)
+            self._chunks[-1][offset:offset + n] = values[done:done + n]
+            self._size += n
+            done += n
+
+    def _spill(self):
+        """
+        Move the oldest full chunks in memory to disk, until only *hot_chunks* are left.
+        """
+
+        if self.session is None:
+            return
+
+        spill = len(self._chunks) - self._spilled - self.session.hot_chunks
+        if spill <= 0:
+            return
+
+        mapped = self.session.spill(self, self._chunks[self._spilled:self._spilled + spill])
+        if mapped is None:
+            return
+
+        # every spilled chunk becomes a view of the new memory map, the old map is released with the old views
+        self._spilled += spill
+        for i in range(self._spilled):
+            self._chunks[i] = mapped[i * self.chunk_size:(i + 1) * self.chunk_size]
+
+    def __getitem__(self, item):
+        """
+        :param item: index or slice
+        :return: a single value, or a numpy array of values.
+                Do not write to the array, it may be a view into the store.
+        """
+
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self._size)
+            if step != 1:
+                return self[start:stop][::step] if stop > start else np.empty(0, dtype=self.dtype)
+            return self._range(start, stop)
+
+        index = operator.index(item)
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("index out of range")
+        return self._chunks[index // self.chunk_size][index % self.chunk_size]
+
+    def take(self, indices):
+        """
+        Gather the values at many indices at once.
+
+        :param indices: numpy array of indices, 0 <= index < len(self)
+        :return: numpy array of the values
+        """
+
+        indices = np.asarray(indices, dtype=np.intp)
+        values = np.empty(indices.size, dtype=self.dtype)
+        chunks = indices // self.chunk_size
+        offsets = indices % self.chunk_size
+        # one fancy index per chunk that is touched
+        for chunk in np.unique(chunks):
+            mask = chunks == chunk
+            values[mask] = self._chunks[chunk][offsets[mask]]
+        return values
+
+    def __array__(self, dtype=None, copy=None):
+        """
+        Support for np.asarray(), copies every value into one array.
+        """
+        values = self._range(0, self._size)
+        return values if dtype is None else values.astype(dtype)
+
+    def _range(self, start, stop):
+        """
+        The values *start* to *stop* - 1, a view if they all lie in one chunk.
+        """
+
+        if stop <= start:
+            return np.empty(0, dtype=self.dtype)
+
+        first = start // self.chunk_size
+        last = (stop - 1) // self.chunk_size
+        offset = first * self.chunk_size
+        # within one chunk, no copy needed
+        if first == last:
+            return self._chunks[first][start - offset:stop - offset]
+
+        # gather the touched chunks and cut the ends
+        values = np.concatenate(self._chunks[first:last + 1])
+        return values[start - offset:stop - offset]
@@ -0,0 +1,289 @@
+"""
+:platform: Unix, Windows
+:synopsis: This module describes the history window, which shows the whole run recorded by the live plot.
+    The user zooms with the mouse wheel and pans by dragging. The lines come from the min / max pyramids
+    of the plot (see decimation.MinMaxPyramid), so every view costs the same no matter how long the run is.
+:moduleauthor: Michael Eller <mbe9a@virginia.edu>
+"""
+
+import numpy as np
+from PyQt5 import QtCore, QtGui, QtWidgets
+from painter_canvas import nice_ticks, polygon
+
+
+class HistoryView(QtWidgets.QWidget):
+    """
+    HistoryView paints a range of the run's signal and derivative with QPainter.
+    Without a zoom it follows the whole run as it grows.
+    """
+
+    #: space between the widget's border and the plot area in pixels (left, top, right, bottom)
+    plot_margins = (70, 20, 70, 45)
+
+    #: how much one step of the mouse wheel zooms in or out
+    zoom_step = 1.25
+
+    #: the narrowest view in samples
+    min_span = 10
+
+    def __init__(self, plot, parent=None):
+        """
+        :param plot: the plot_data.PlotData backend of the live plot
+        :param parent: parent widget
+        """
+
+        QtWidgets.QWidget.__init__(self, parent)
+        self.plot = plot
+        # (start, stop) sample indices of the view, None to show the whole run
+        self.view = None
+        # x position where the mouse was pressed and the view at that moment, while dragging
+        self.drag = None
+
+        self.setMinimumSize(400, 300)
+        self.signal_pen = QtGui.QPen(QtGui.QColor("blue"))
+        self.deriv_pen = QtGui.QPen(QtGui.QColor("purple"))
+        self.axis_pen = QtGui.QPen(QtGui.QColor("black"))
+
+    def visible_range(self):
+        """
+        :return: tuple (start, stop) of the sample indices in view
+        """
+        if self.view is None:
+            return 0, len(self.plot.all)
+        return self.view
+
+    def show_all(self):
+        """
+        Zoom out to the whole run and follow it as it grows.
+        """
+        self.view = None
+        self.update()
+
+    def set_view(self, start, stop):
+        """
+        Change the view, keeping it inside the run. A view of the whole run follows the run as it grows.
+
+        :param start: index of the first sample in view
+        :param stop: index after the last sample in view
+        """
+
+        total = len(self.plot.all)
+        span = max(self.min_span, stop - start)
+        if span >= total:
+            self.show_all()
+            return
+
+        # slide the view back inside the run instead of shrinking it
+        start = int(round(min(max(0, start), total - span)))
+        self.view = (start, start + int(round(span)))
+        self.update()
+
+    def plot_area(self):
+        """
+        :return: QtCore.QRectF of the area inside the axes
+        """
+        left, top, right, bottom = self.plot_margins
+        return QtCore.QRectF(left, top, max(1, self.width() - left - right), max(1, self.height() - top - bottom))
+
+    def wheelEvent(self, event):
+        """
+        Zoom in or out around the mouse pointer.
+
+        :param event: QtGui.QWheelEvent
+        """
+
+        start, stop = self.visible_range()
+        area = self.plot_area()
+        # the sample under the pointer stays where it is
+        fraction = min(1., max(0., (event.pos().x() - area.left()) / area.width()))
+        anchor = start + fraction * (stop - start)
+
+        span = (stop - start) / self.zoom_step ** (event.angleDelta().y() / 120.)
+        self.set_view(anchor - fraction * span, anchor + (1. - fraction) * span)
+
+    def mousePressEvent(self, event):
+        """
+        Start dragging the view.
+
+        :param event: QtGui.QMouseEvent
+        """
+        self.drag = (event.pos().x(), self.visible_range())
+
+    def mouseMoveEvent(self, event):
+        """
+        Pan the view with the mouse.
+
+        :param event: QtGui.QMouseEvent
+        """
+
+        if self.drag is None:
+            return
+        x, (start, stop) = self.drag
+        shift = (x - event.pos().x()) * (stop - start) / self.plot_area().width()
+        self.set_view(start + shift, stop + shift)
+
+    def mouseReleaseEvent(self, event):
+        """
+        Stop dragging the view.
+
+        :param event: QtGui.QMouseEvent
+        """
+        self.drag = None
+
+    def mouseDoubleClickEvent(self, event):
+        """
+        Zoom out to the whole run.
+
+        :param event: QtGui.QMouseEvent
+        """
+        self.show_all()
+
+    def paintEvent(self, event):
+        """
+        Paints the axes and the signal and derivative in view.
+
+        :param event: QtGui.QPaintEvent
+        """
+
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), QtGui.QColor("white"))
+        metrics = painter.fontMetrics()
+        area = self.plot_area()
+        start, stop = self.visible_range()
+
+        # at most two points per pixel column, whatever the zoom
+        positions, values = self.plot.history.query(start, stop, area.width())
+        deriv_positions, deriv_values = self.plot.deriv_history.query(start, stop, area.width())
+
+        # scale the signal to the values in view, and the derivative symmetrically around 0
+        if values.size > 0:
+            lower, upper = values.min(), values.max()
+            pad = max(0.05 * (upper - lower), 0.01)
+            signal_limits = (lower - pad, upper + pad)
+            deriv_max = 1.05 * max(np.abs(deriv_values).max(), 0.01)
+        else:
+            signal_limits = (self.plot.ymin, self.plot.ymax)
+            deriv_max = self.plot.ymax / 2.
+        deriv_limits = (-deriv_max, deriv_max)
+
+        # the x-axis is the time the samples were read, in seconds since the start of the run.
+        # zooming and panning work on sample indices, the view spans the times of its first and last sample.
+        times = self.plot.all_times
+        if stop > start:
+            origin = times[0]
+            first, last = times[start] - origin, times[stop - 1] - origin
+        else:
+            origin, first, last = 0., 0., 1.
+        span = max(1e-9, last - first)
+
+        painter.setPen(self.axis_pen)
+        # x-axis in seconds since the start of the run
+        for seconds in nice_ticks(first, last):
+            x = area.left() + (seconds - first) * area.width() / span
+            painter.drawLine(QtCore.QPointF(x, area.bottom()), QtCore.QPointF(x, area.bottom() + 4))
+            label = "%g" % seconds
+            painter.drawText(QtCore.QPointF(x - metrics.width(label) / 2., area.bottom() + 6 + metrics.ascent()),
+                             label)
+        painter.drawText(QtCore.QRectF(area.left(), self.height() - metrics.height() - 2, area.width(),
+                                       metrics.height()), QtCore.Qt.AlignCenter, "Time since start (s)")
+
+        # signal axis on the left, derivative axis on the right
+        for limits, right in ((signal_limits, False), (deriv_limits, True)):
+            for value in nice_ticks(limits[0], limits[1]):
+                y = area.bottom() - (value - limits[0]) * area.height() / (limits[1] - limits[0])
+                # adding 0 turns -0.0 into 0.0
+                label = "%g" % (value + 0.)
+                if right:
+                    painter.drawLine(QtCore.QPointF(area.right(), y), QtCore.QPointF(area.right() + 4, y))
+                    painter.drawText(QtCore.QPointF(area.right() + 6, y + metrics.ascent() / 2.), label)
+                else:
+                    painter.drawLine(QtCore.QPointF(area.left() - 4, y), QtCore.QPointF(area.left(), y))
+                    painter.drawText(QtCore.QPointF(area.left() - 6 - metrics.width(label),
+                                                    y + metrics.ascent() / 2.), label)
+        painter.drawRect(area)
+
+        # the lines, clipped to the plot area
+        painter.setClipRect(area)
+        for pen, x, y, limits in ((self.deriv_pen, deriv_positions, deriv_values, deriv_limits),
+                                  (self.signal_pen, positions, values, signal_limits)):
+            if x.size == 0:
+                continue
+            px = area.left() + (times.take(x) - origin - first) * area.width() / span
+            py = area.bottom() - (y - limits[0]) * area.height() / (limits[1] - limits[0])
+            painter.setPen(pen)
+            painter.drawPolyline(polygon(px, py))
+            # zoomed in to single samples, mark each one
+            if x.size < area.width() / 8.:
+                for point_x, point_y in zip(px, py):
+                    painter.drawEllipse(QtCore.QPointF(point_x, point_y), 2, 2)
+
+        painter.end()
+
+
+class Ui_Dialog(object):
+    """
+    The graphical structure of this *Ui_Dialog* follows the QtDesigner dialogs of this program.
+    The window shows the whole run of a live plot.
+    """
+
+    def setupUi(self, Dialog, plot):
+        """
+        This function initializes the window by altering the *Dialog* object passed (by reference) to it.
+
+        :param Dialog: This must be of type PyQt5.QtWidgets.QDialog.
+        :param plot: the plot_data.PlotData backend of the live plot whose run is shown
+        """
+
+        # set window name, size, icon
+        Dialog.setObjectName("History")
+        Dialog.resize(1000, 500)
+        Dialog.setWindowIcon(QtGui.QIcon('resources/laser.ico'))
+
+        # make a grid layout
+        # grid layouts allow the window to be resized easily
+        self.gridLayout = QtWidgets.QGridLayout(Dialog)
+        self.gridLayout.setObjectName("gridLayout")
+
+        # create a label that explains the mouse controls
+        self.label = QtWidgets.QLabel(Dialog)
+        self.label.setObjectName("label")
+        self.gridLayout.addWidget(self.label, 0, 0, 1, 1)
+
+        # create a button that zooms out to the whole run
+        self.pushButton_all = QtWidgets.QPushButton(Dialog)
+        self.pushButton_all.setObjectName("pushButton_all")
+        self.gridLayout.addWidget(self.pushButton_all, 0, 1, 1, 1)
+
+        # create the view of the run
+        self.view = HistoryView(plot, Dialog)
+        self.view.setObjectName("view")
+        self.gridLayout.addWidget(self.view, 1, 0, 1, 2)
+        self.pushButton_all.clicked.connect(self.view.show_all)
+
+        # repaint every 1s so new data shows up
+        self.timer = QtCore.QTimer(Dialog)
+        self.timer.timeout.connect(self.view.update)
+        self.timer.start(1000)
+        Dialog.finished.connect(self.timer.stop)
+
+        # move the objects over to Dialog and set the text
+        self.retranslateUi(Dialog)
+
+        # connect the signals and slots by name
+        QtCore.QMetaObject.connectSlotsByName(Dialog)
+
+    def retranslateUi(self, Dialog):
+        """
+        This function translates the GUI objects of this class to the passed *Dialog* objcect,
+        then sets the text of the various objects in the window.
+
+        :param Dialog: This must be of type PyQt5.QtWidgets.QDialog.
+        """
+
+        # rename the function for readability
+        _translate = QtCore.QCoreApplication.translate
+
+        # set the window title, label and button text
+        Dialog.setWindowTitle(_translate("Dialog", "History"))
+        self.label.setText(_translate("Dialog", "Scroll to zoom, drag to pan, double-click to show the whole run."))
+        self.pushButton_all.setText(_translate("Dialog", "Whole Run"))
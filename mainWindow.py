@@ -10,7 +10,12 @@ from portsGUI import Ui_Dialog as portsWindow
 from plotGUI import Ui_Dialog as plotWindow
 from windowFilterGUI import Ui_Dialog as windowfilterWindow
 from PyQt5 import QtCore, QtGui, QtWidgets
-from settings_interface import restore_defaults, read_port_configuration, b1, m1, b2, m2
+from settings_interface import restore_defaults, read_port_configuration
+from calibration import counts_to_volts
+from acquisition import PolledSource
+from recorder import recover_recordings
+from history import remove_stale_sessions
+from catalog import sync_catalog_later, cancel_sync
 import serial
 import time
 import gc
@@ -138,7 +143,7 @@ class Ui_MainWindow(object):
         # create the Window Filter submenu settings item
         self.actionWindow_Filter = QtWidgets.QAction(MainWindow)
         self.actionWindow_Filter.setObjectName("actionWindow_Filter")
-        self.actionWindow_Filter.setStatusTip('Set the number of samples to use in a moving average')
+        self.actionWindow_Filter.setStatusTip('Set the filter and the number of samples it uses')
         # connect the action to the function open_settings_filter()
         self.actionWindow_Filter.triggered.connect(self.open_settings_filter)
 
@@ -179,6 +184,16 @@ class Ui_MainWindow(object):
         # connect the timer trigger to the function update_display()
         self.timer.timeout.connect(self.update_display)
 
+        # recordings of a run that ended in a crash are cut back to their last complete record,
+        # so they can be read like any other
+        recover_recordings()
+        # the history files of a run that ended in a crash are never needed again, they can take gigabytes
+        remove_stale_sessions()
+        # catalog the recovered runs and anything else that is missing from the catalog.
+        # this reads every missing recording, so it runs in the background and stops when the program exits.
+        sync_catalog_later()
+        QtWidgets.QApplication.instance().aboutToQuit.connect(cancel_sync)
+
         # this attribute describes whether or not the port has ben set
         self.port_set = False
         # check to see if the user has set a port
@@ -394,8 +409,8 @@ class Ui_MainWindow(object):
         self.actionRestore_Defaults.setEnabled(True)
 
         # free up some memory - this is critical.
-        # if this is not done and blitting is disabled (it is disabled by default),
-        # you will notice a dramatic degradation in performance with successive calls to this function ->
+        # if this is not done, you will notice a dramatic degradation in performance with successive calls to
+        # this function ->
         # i.e. successive creations of plotGUI.Ui_Dialog.
         del ui, Dialog
         gc.collect()
@@ -447,28 +462,24 @@ class Ui_MainWindow(object):
         # get _serial_port from the global context
         global _serial_port
 
-        # write 'a' to the serial port.
+        # write 'a' to the serial port and read the reply.
         # the embedded micro-controller is listening for an 'a' over the serial connection.
         # Once it receives an 'a', it will send the latest ADC value in response.
-        # This was done to eliminate the need for a buffer.
-        _serial_port.write(b'a')
-
-        # read the value from the serial connection
-        val = int(_serial_port.readline().decode('ascii').strip())
+        # The LCD only updates once a second, so it always uses the polled protocol
+        # (it works with every firmware version).
+        counts = PolledSource(_serial_port).read()
+        # a timed out or garbled reply has no value, keep showing the last one
+        if counts.size == 0:
+            return
+        val = int(counts[0])
 
-        # m1, b1, m2, b2 are the slopes and y-intercepts of a calibration curve split into two segments.
-        # the calibration curve is more accurate if a slope is calculated at small values
-        # separately from the large values.
-        # These numbers correct for two things:
+        # the calibration curve corrects for two things:
         #                   * the resistor ratio in the custom PCB
         #                   * turning the ADC value (0-1024) into an actual voltage
-        # These values can be found in settings_interface module and are extracted from direct measurements.
-
-        # if the value from the ADC is less than 150 (on a scale of 0-1024 that's equivalent to about 10V).
-        if val < 150:
-            val = (val - b1) / m1
-        else:
-            val = (val - b2) / m2
+        # By default it is the two-segment fit (m1, b1, m2, b2) in the settings_interface module,
+        # extracted from direct measurements. Other curves can be stored per tool and board, see the calibration
+        # module. The curve is compiled into a lookup table once, so this is just an index.
+        val = float(counts_to_volts(val))
 
         # display the received and corrected value
         self.lcdNumber.display(val)
@@ -0,0 +1,330 @@
+"""
+:platform: Unix, Windows
+:synopsis: This module contains a lightweight plotting backend for the live plot. It draws the signal and its
+    derivative straight from the NumPy windows with QPainter, without loading matplotlib.
+    Matplotlib is only imported when the plot is saved as an image.
+:moduleauthor: Michael Eller <mbe9a@virginia.edu>
+"""
+
+import time
+import numpy as np
+from PyQt5 import QtCore, QtGui, QtWidgets
+from plot_data import PlotData
+
+
+def nice_ticks(lower, upper, count=6):
+    """
+    Pick round tick positions (1, 2 or 5 times a power of ten apart) for an axis.
+
+    :param lower: lower axis limit
+    :param upper: upper axis limit
+    :param count: approximate number of ticks wanted
+    :return: numpy array of tick positions within the limits
+    """
+
+    span = float(upper - lower)
+    if span <= 0:
+        return np.array([lower])
+
+    # the smallest round step that gives at most *count* ticks
+    magnitude = 10 ** np.floor(np.log10(span / count))
+    for factor in (1, 2, 5, 10):
+        step = factor * magnitude
+        if span / step <= count:
+            break
+
+    first = np.ceil(lower / step) * step
+    return np.arange(first, upper + step / 1e6, step)
+
+
+def polygon(x, y):
+    """
+    Build a QPolygonF from two arrays of pixel coordinates by writing straight into its memory.
+
+    :param x: numpy array of x coordinates
+    :param y: numpy array of y coordinates, same length as *x*
+    :return: QtGui.QPolygonF
+    """
+
+    points = QtGui.QPolygonF(x.size)
+    # a QPolygonF is a contiguous array of (x, y) doubles
+    buffer = points.data()
+    buffer.setsize(16 * x.size)
+    memory = np.frombuffer(buffer, dtype=np.float64)
+    memory[0::2] = x
+    memory[1::2] = y
+    return points
+
+
+class PainterCanvas(QtWidgets.QWidget, PlotData):
+    """
+    PainterCanvas shows the same plot as animation.CustomFigCanvas and has the same interface for plotGUI,
+    but paints it with QPainter. There are no artists or cached images: every frame paints the axes and the
+    decimated lines from scratch, which takes a few milliseconds even on slow PCs.
+    """
+
+    #: space between the widget's border and the plot area in pixels (left, top, right, bottom)
+    plot_margins = (70, 40, 70, 50)
+
+    #: colors of the signal line, its tail, the derivative line and its tail (matching CustomFigCanvas)
+    line_colors = ("blue", "red", "purple", "green")
+
+    def __init__(self):
+        """
+        Initializes the widget, the data and the frame timer.
+        """
+
+        QtWidgets.QWidget.__init__(self)
+
+        # create the queue, the history and the rolling windows
+        self.init_data()
+
+        # the plot needs some room, like the 10 x 7 inch matplotlib figure
+        self.setMinimumSize(400, 300)
+        self.setAutoFillBackground(False)
+
+        # the pens and brushes are created once, not on every frame
+        self.pens = [QtGui.QPen(QtGui.QColor(color)) for color in self.line_colors]
+        self.pens[1].setWidth(2)
+        self.pens[3].setWidth(2)
+        self.axis_pen = QtGui.QPen(QtGui.QColor("black"))
+        self.grid_pen = QtGui.QPen(QtGui.QColor(220, 220, 220))
+
+        # the timer that drives the frames, see frame()
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.frame)
+        self.timer.start(self.frame_interval)
+
+    def close(self):
+        """
+        Soft close function. Stops the frames, closes the widget and frees the recorded history.
+        """
+        self.timer.stop()
+        QtWidgets.QWidget.close(self)
+        self.close_data()
+
+    def adapt_interval(self, elapsed):
+        """
+        Extends PlotData.adapt_interval() to apply the new frame interval to the timer.
+
+        :param elapsed: time the last frame took to draw in ms
+        """
+        PlotData.adapt_interval(self, elapsed)
+        self.timer.setInterval(self.frame_interval)
+
+    def update_xlim(self):
+        """
+        Extends PlotData.update_xlim() to repaint the axes.
+
+        :return: bool indicating whether or not the range changed
+        """
+        if not PlotData.update_xlim(self):
+            return False
+        self.frame_needed = True
+        return True
+
+    def update_ylim(self):
+        """
+        Extends PlotData.update_ylim() to repaint the axes.
+
+        :return: bool indicating whether or not the limits changed
+        """
+        if not PlotData.update_ylim(self):
+            return False
+        self.frame_needed = True
+        return True
+
+    def resizeEvent(self, event):
+        """
+        The decimation depends on the width of the plot, repaint after a resize.
+
+        :param event: QtGui.QResizeEvent
+        """
+        self.frame_needed = True
+        QtWidgets.QWidget.resizeEvent(self, event)
+
+    def frame(self):
+        """
+        Called by the timer. Takes the new data and repaints the plot, unless there is nothing new to show.
+        """
+
+        # nothing new to show and nothing that needs to be redrawn, don't spend any time on this frame
+        if not self.frame_needed and not self.has_new_data():
+            return
+        self.frame_needed = False
+
+        start = time.perf_counter()
+        self.process_new_data()
+        # paint right away, so the time it takes is known
+        self.repaint()
+        self.adapt_interval(1000. * (time.perf_counter() - start))
+
+    def plot_area(self):
+        """
+        :return: QtCore.QRectF of the area inside the axes
+        """
+        left, top, right, bottom = self.plot_margins
+        return QtCore.QRectF(left, top, max(1, self.width() - left - right), max(1, self.height() - top - bottom))
+
+    def to_pixels(self, area, x, y, lower, upper):
+        """
+        Map data coordinates to pixel coordinates in the plot area.
+
+        :param area: QtCore.QRectF returned by *plot_area()*
+        :param x: numpy array of x values in seconds, 0 to xlim - 1
+        :param y: numpy array of y values
+        :param lower: y value at the bottom of the plot area
+        :param upper: y value at the top of the plot area
+        :return: tuple (x, y) of numpy arrays of pixel coordinates
+        """
+        px = area.left() + np.asarray(x) * (area.width() / max(1e-9, self.xlim - 1))
+        py = area.bottom() - (np.asarray(y) - lower) * (area.height() / max(1e-9, upper - lower))
+        return px, py
+
+    def paintEvent(self, event):
+        """
+        Paints the whole plot: background, axes, labels, legend and the four lines.
+
+        :param event: QtGui.QPaintEvent
+        """
+
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), QtGui.QColor("white"))
+        area = self.plot_area()
+
+        # derivative axis limits are hard-coded based on the ymax of the data axis, like in CustomFigCanvas
+        deriv_limits = (-self.ymax / 2., self.ymax / 2.)
+
+        self.paint_axes(painter, area, deriv_limits)
+
+        # clip the lines to the plot area, values outside the y limits must not run over the labels
+        painter.save()
+        painter.setClipRect(area)
+        data_x, data_y, deriv_x, deriv_y = self.decimate(area.width())
+        tail_x, tail_data, tail_deriv = self.tails()
+        lines = [(data_x, data_y, (self.ymin, self.ymax), 0), (tail_x, tail_data, (self.ymin, self.ymax), 1),
+                 (deriv_x, deriv_y, deriv_limits, 2), (tail_x, tail_deriv, deriv_limits, 3)]
+        for x, y, limits, color in lines:
+            if x.size == 0:
+                continue
+            px, py = self.to_pixels(area, x, y, limits[0], limits[1])
+            painter.setPen(self.pens[color])
+            painter.drawPolyline(polygon(px, py))
+
+            # the last point of each tail is the line head
+            if color in (1, 3):
+                painter.setBrush(QtGui.QBrush(self.pens[color].color()))
+                painter.drawEllipse(QtCore.QPointF(px[-1], py[-1]), 4, 4)
+                painter.setBrush(QtCore.Qt.NoBrush)
+        painter.restore()
+
+        painter.end()
+
+    def paint_axes(self, painter, area, deriv_limits):
+        """
+        Paint the frame, ticks, tick labels, axis labels, title and legend.
+
+        :param painter: active QtGui.QPainter
+        :param area: QtCore.QRectF returned by *plot_area()*
+        :param deriv_limits: tuple (lower, upper) of the derivative axis
+        """
+
+        metrics = painter.fontMetrics()
+        painter.setPen(self.axis_pen)
+
+        # x-axis: the right-most point is time 0, the left-most is -(xlim - 1) seconds
+        for ago in nice_ticks(0, self.xlim - 1):
+            x = area.right() - ago * area.width() / max(1e-9, self.xlim - 1)
+            painter.setPen(self.grid_pen)
+            painter.drawLine(QtCore.QPointF(x, area.top()), QtCore.QPointF(x, area.bottom()))
+            painter.setPen(self.axis_pen)
+            painter.drawLine(QtCore.QPointF(x, area.bottom()), QtCore.QPointF(x, area.bottom() + 4))
+            label = "%g" % -ago if ago else "0"
+            painter.drawText(QtCore.QPointF(x - metrics.width(label) / 2., area.bottom() + 6 + metrics.ascent()),
+                             label)
+
+        # left y-axis (signal) and right y-axis (derivative)
+        for limits, right in (((self.ymin, self.ymax), False), (deriv_limits, True)):
+            for value in nice_ticks(limits[0], limits[1]):
+                _, y = self.to_pixels(area, 0., value, limits[0], limits[1])
+                # adding 0 turns -0.0 into 0.0
+                label = "%g" % (value + 0.)
+                if right:
+                    painter.drawLine(QtCore.QPointF(area.right(), y), QtCore.QPointF(area.right() + 4, y))
+                    painter.drawText(QtCore.QPointF(area.right() + 6, y + metrics.ascent() / 2.), label)
+                else:
+                    painter.drawLine(QtCore.QPointF(area.left() - 4, y), QtCore.QPointF(area.left(), y))
+                    painter.drawText(QtCore.QPointF(area.left() - 6 - metrics.width(label),
+                                                    y + metrics.ascent() / 2.), label)
+
+        # the frame around the plot area
+        painter.drawRect(area)
+
+        # axis labels and title
+        painter.drawText(QtCore.QRectF(area.left(), self.height() - metrics.height() - 4, area.width(),
+                                       metrics.height()), QtCore.Qt.AlignCenter, "Time (s)")
+        painter.drawText(QtCore.QRectF(area.left(), 4, area.width(), metrics.height() + 8),
+                         QtCore.Qt.AlignCenter, "Endpoint Signal vs. Time")
+        for text, x, angle in (("Signal (V)", 4 + metrics.height(), -90), ("Derivative (V)",
+                                                                         self.width() - 4 - metrics.height(), 90)):
+            painter.save()
+            painter.translate(x, area.center().y())
+            painter.rotate(angle)
+            painter.drawText(QtCore.QRectF(-area.height() / 2., -metrics.height(), area.height(), metrics.height()),
+                             QtCore.Qt.AlignCenter, text)
+            painter.restore()
+
+        # legend in the top right corner, above the plot area
+        for row, (text, color) in enumerate((("Data", 0), ("Deriv.", 2))):
+            y = 4 + metrics.height() / 2. + row * metrics.height()
+            x = self.width() - 30 - metrics.width("Deriv.")
+            painter.setPen(self.pens[color])
+            painter.drawLine(QtCore.QPointF(x, y), QtCore.QPointF(x + 20, y))
+            painter.setPen(self.axis_pen)
+            painter.drawText(QtCore.QPointF(x + 26, y + metrics.ascent() / 2.), text)
+
+    def save_image(self, fname):
+        """
+        Save the plot as an image file. The image is made with matplotlib, so it looks like the ones saved
+        from CustomFigCanvas and shows every sample of the window instead of the decimated lines.
+
+        :param fname: file path, the format is taken from its extension
+        """
+
+        # matplotlib is only needed here, don't pay for importing it while the plot runs
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        fig = Figure(figsize=(10, 7), dpi=100)
+        FigureCanvasAgg(fig)
+        ax1 = fig.add_subplot(111)
+        ax2 = ax1.twinx()
+
+        # set labels and text
+        ax1.set_xlabel('Time (s)')
+        ax1.set_ylabel('Signal (V)')
+        ax2.set_ylabel('Derivative (V)')
+        ax1.set_title('Endpoint Signal vs. Time')
+
+        # the same lines as on screen, without the margin at the right
+        data, deriv = self.windows()
+        x = self.window_x()
+        size = self.n.size - self.margin
+        tail_x, tail_data, tail_deriv = self.tails()
+        ax1.plot(x[:size], data[:size], color='blue', label='Data')
+        ax1.plot(tail_x, tail_data, color='red', linewidth=2)
+        ax1.plot(tail_x[-1:], tail_data[-1:], color='red', marker='o', markeredgecolor='r')
+        ax2.plot(x[:size], deriv[:size], color='purple', label='Deriv.')
+        ax2.plot(tail_x, tail_deriv, color='green', linewidth=2)
+        ax2.plot(tail_x[-1:], tail_deriv[-1:], color='green', marker='o', markeredgecolor='g')
+
+        # set axes limits and labels, the right most point is time 0
+        ax1.set_xlim(0, self.xlim - 1)
+        ax1.set_ylim(self.ymin, self.ymax)
+        ax2.set_ylim(-self.ymax / 2., self.ymax / 2.)
+        ticks = nice_ticks(0, self.xlim - 1)
+        ax1.set_xticks(self.xlim - 1 - ticks)
+        ax1.set_xticklabels(["%g" % -t if t else "0" for t in ticks])
+        fig.legend()
+
+        fig.savefig(fname)
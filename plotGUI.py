@@ -7,14 +7,21 @@
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtCore import QThread
 from PyQt5.QtWidgets import QDialog
-from animation import CustomFigCanvas
+from plot_data import frame_interval
+from historyGUI import Ui_Dialog as historyWindow
 from PyQt5.QtWidgets import QFileDialog
 import time
-from settings_interface import read_port_configuration, get_sample_rate
+from settings_interface import read_port_configuration, get_sample_rate, get_acquisition_backend, get_plot_backend, \
+    get_calibration_tool, get_calibration_board
+from calibration import get_calibration_segments, calibration_file
+from acquisition import make_source, DeadlineScheduler, AcquisitionProcess, block_times
+from recorder import JournalRecorder
+from catalog import add_run_later
+from export import run_columns, run_metadata, write_csv, write_npz, write_arrow, arrow_supported, ExportThread
 import serial
 import os
-import csv
 import hashlib
+import numpy as np
 
 #: Member *_serial_port* is a global variable representing the serial connection to the ADC.
 #: It will be opened when plotGUI.Ui_Dialog is initialized.
@@ -35,18 +42,18 @@ class MyThread(QThread):
     This is a simple class to implement a QThread object and specify its *run()* method.
     """
 
-    def __init__(self, callback1, callback2):
+    def __init__(self, queue, recorder=None):
         """
-        Initialize the QThread and set the callback stubs.
+        Initialize the QThread.
 
-        :param callback1: Callback function for the thread to execute within *dataSendLoop()*. T
-                his callback must send a new data point to the plot.
-        :param callback2: Callback function triggered in *dataSendLoop()*
-                and is responsible for triggering *update_plot()*.
+        :param queue: buffers.IngestQueue of the plot, new data is put into it directly
+        :param recorder: recorder.JournalRecorder that every block read from the ADC is passed to
         """
         QThread.__init__(self)
-        self.callback1 = callback1
-        self.callback2 = callback2
+        self.queue = queue
+        self.recorder = recorder
+        # paces the acquisition loop, the dialog reads its timing statistics
+        self.scheduler = DeadlineScheduler(get_interval())
 
     def __del__(self):
         """
@@ -58,7 +65,7 @@ class MyThread(QThread):
         """
         This overrides the parent *run()* method. Thread will run the infinite loop in *dataSendLoop()*.
         """
-        dataSendLoop(self.callback1, self.callback2)
+        dataSendLoop(self.queue, self.scheduler, self.recorder)
 
 
 class Ui_Dialog(object):
@@ -78,10 +85,17 @@ class Ui_Dialog(object):
         global _serial_port
         # get the current serial port setting (string)
         port = read_port_configuration()
-        # set the port and open it, wait 2s for the microcontroller to settle
-        _serial_port.setPort(port)
-        _serial_port.open()
-        time.sleep(2)
+        # exports record which port the run came from
+        self.port = port
+
+        # the acquisition loop either runs in a thread of this process or in a separate process.
+        # in the second case the other process owns the serial port.
+        self.backend = get_acquisition_backend()
+        if self.backend == "thread":
+            # set the port and open it, wait 2s for the microcontroller to settle
+            _serial_port.setPort(port)
+            _serial_port.open()
+            time.sleep(2)
 
         # get the initial hash value from global context
         global initial_hash
@@ -112,14 +126,28 @@ class Ui_Dialog(object):
         # connect the button click to the save_csv() function
         self.pushButton_save_csv.clicked.connect(lambda: self.save_csv(Dialog))
 
+        # create a button to allow the user to save the data as binary columns
+        self.pushButton_save_binary = QtWidgets.QPushButton(Dialog)
+        self.pushButton_save_binary.setObjectName("pushButton_save_binary")
+        self.gridLayout.addWidget(self.pushButton_save_binary, 0, 2, 1, 1)
+        # connect the button click to the save_binary() function
+        self.pushButton_save_binary.clicked.connect(lambda: self.save_binary(Dialog))
+
         # create a close button
         # This window needs a controlled or 'soft' close
         self.pushButton = QtWidgets.QPushButton(Dialog)
         self.pushButton.setObjectName("pushButton")
-        self.gridLayout.addWidget(self.pushButton, 0, 2, 1, 1)
+        self.gridLayout.addWidget(self.pushButton, 0, 3, 1, 1)
         # xonnect the button click to the *close()* function
         self.pushButton.clicked.connect(self.close)
 
+        # create a button that opens the history window with the whole run
+        self.pushButton_history = QtWidgets.QPushButton(Dialog)
+        self.pushButton_history.setObjectName("pushButton_history")
+        self.gridLayout.addWidget(self.pushButton_history, 0, 4, 1, 1)
+        # connect the button click to the show_history() function
+        self.pushButton_history.clicked.connect(lambda: self.show_history(Dialog))
+
         # This is a hidden button that will actually close the window.
         # This is automatically 'clicked' after *close()* is finished.
         self.pushButtonHIDDEN = QtWidgets.QPushButton(Dialog)
@@ -127,14 +155,57 @@ class Ui_Dialog(object):
         self.pushButtonHIDDEN.clicked.connect(Dialog.reject)
         self.pushButtonHIDDEN.setVisible(False)
 
-        # create the animation object
-        self.myFig = CustomFigCanvas()
-        self.gridLayout.addWidget(self.myFig, 1, 0, 1, 3)
-
-        # Create the thread and start it.
-        # The thread will execute the infinite loop in dataSendLoop()
-        self.thread = MyThread(self.addData_callbackFunc, self.update_plot)
-        self.thread.start()
+        # create the animation object with the plotting backend from the settings file.
+        # the backends are only imported when they are used, matplotlib takes a while to load.
+        if get_plot_backend() == "qpainter":
+            from painter_canvas import PainterCanvas
+            self.myFig = PainterCanvas()
+        else:
+            from animation import CustomFigCanvas
+            self.myFig = CustomFigCanvas()
+        self.gridLayout.addWidget(self.myFig, 1, 0, 1, 5)
+
+        # create a label that shows the timing statistics of the acquisition loop
+        self.label_timing = QtWidgets.QLabel(Dialog)
+        self.label_timing.setObjectName("label_timing")
+        self.gridLayout.addWidget(self.label_timing, 2, 0, 1, 5)
+
+        # the thread running the current export, see start_export()
+        self.export_thread = None
+
+        # refresh the timing statistics every 1s
+        self.timing_timer = QtCore.QTimer(Dialog)
+        self.timing_timer.setSingleShot(False)
+        self.timing_timer.timeout.connect(self.update_timing)
+
+        # every raw sample is recorded to disk as it arrives, so the run survives a crash.
+        # the recorder writes on its own thread, the acquisition never waits for the disk.
+        # the counts are recorded raw, with the active calibration curve to turn them into volts later.
+        self.recorder = JournalRecorder(get_sample_rate(), get_calibration_segments(),
+                                        {"tool": get_calibration_tool(), "board": get_calibration_board(),
+                                         "port": port})
+
+        if self.backend == "process":
+            # Create the acquisition process and start it.
+            # The canvas reads the samples straight out of the shared ring buffer on every frame,
+            # so no signal is needed for the data.
+            self.thread = None
+            self.acquisition = AcquisitionProcess(port)
+            self.acquisition.start()
+            # an error of the process is reported once, by update_timing()
+            self.acquisition_error_shown = False
+            self.myFig.attach_acquisition(self.acquisition, self.recorder)
+        else:
+            # Create the thread and start it.
+            # The thread will execute the infinite loop in dataSendLoop()
+            self.acquisition = None
+            self.thread = MyThread(self.myFig.addedData, self.recorder)
+            self.thread.start()
+
+        # the settings files are checked for changes on the timer, i.e. on the GUI thread.
+        # update_plot() changes the plot's data, only the GUI thread that draws it may do that.
+        self.timing_timer.timeout.connect(self.check_settings)
+        self.timing_timer.start(1000)
 
         # the regular close button will make the program crash for unknown reasons, disable it
         Dialog.setWindowFlag(QtCore.Qt.WindowCloseButtonHint, False)
@@ -159,16 +230,53 @@ class Ui_Dialog(object):
         # set the window title and button text
         Dialog.setWindowTitle(_translate("Dialog", " "))
         self.pushButton_save_csv.setText(_translate("Dialog", "Save CSV"))
+        self.pushButton_save_binary.setText(_translate("Dialog", "Save Binary"))
         self.pushButton_save_image.setText(_translate("Dialog", "Save Image"))
         self.pushButton.setText(_translate("Dialog", "Close"))
+        self.pushButton_history.setText(_translate("Dialog", "History"))
 
-    def addData_callbackFunc(self, value):
+    def update_timing(self):
+        """
+        This function shows the jitter and overrun counts of the acquisition loop's scheduler,
+        the sample counts of the plot's ingest queue and the plot's frame interval.
         """
-        This function adds the most recent ADC value to the buffer in the animation object.
 
-        :param value: number from the serial port. This is 'emitted' from *mySrc* in *dataSendLoot()*.
+        # get the statistics from the acquisition loop's scheduler
+        if self.acquisition is not None:
+            # the acquisition process can't show errors itself, e.g. if the port couldn't be opened
+            error = self.acquisition.error()
+            if error is not None and not self.acquisition_error_shown:
+                self.acquisition_error_shown = True
+                QtWidgets.QMessageBox.warning(self.label_timing.window(), "Acquisition Failed",
+                                              "No data can be read from the ADC:\n" + error)
+            stats = self.acquisition.stats()
+        else:
+            stats = self.thread.scheduler.stats()
+
+        # get the sample counts of the plot's ingest queue
+        queue = self.myFig.addedData.stats()
+        queue_text = "Queued: %d | Dropped: %d / %d" % (queue["pending"], queue["dropped"], queue["enqueued"])
+
+        # add the frame interval the plot settled on and the draw time it is based on
+        if self.myFig.draw_time is not None:
+            queue_text += " | Frame: %d ms (draw %.0f ms)" % (self.myFig.frame_interval, self.myFig.draw_time)
+
+        # streaming sources are paced by the ADC, the scheduler is never used
+        if stats["samples"] == 0:
+            self.label_timing.setText("Jitter: - | " + queue_text)
+            return
+
+        self.label_timing.setText("Jitter: mean %.1f ms, max %.1f ms | Overruns: %d / %d | %s"
+                                  % (stats["mean_jitter_ms"], stats["max_jitter_ms"],
+                                     stats["overruns"], stats["samples"], queue_text))
+
+    def check_settings(self):
+        """
+        This function triggers *update_plot()* if the settings files changed.
+        It runs on the GUI thread every second, for both acquisition backends.
         """
-        self.myFig.addData(value)
+        if check_for_change():
+            self.update_plot(0)
 
     def update_plot(self, value):
         """
@@ -177,12 +285,19 @@ class Ui_Dialog(object):
         :param value: the format of this function requires *value* to be present. It is unused in this function.
         """
 
-        # update the number of samples to keep in the moving average filter and update the lines accordingly
+        # update the calibration in case the tool, the board or the curve changed
+        if self.myFig.update_calibration():
+            # the recording keeps the new curve, for the samples after the last one the plot has calibrated
+            times = self.myFig.all_times
+            self.recorder.set_calibration(get_calibration_segments(), times[-1] if len(times) > 0 else -np.inf)
+        # update the filter and the number of samples it uses and update the lines accordingly
         self.myFig.update_window()
         # update the range of the x-axis, add zeros if necessary
         self.myFig.update_xlim()
         # update the range of the y-axis
         self.myFig.update_ylim()
+        # update the bounds of the frame interval
+        self.myFig.update_frame_interval()
 
     def close(self):
         """
@@ -190,6 +305,14 @@ class Ui_Dialog(object):
         The figure and serial must be closed before the window is allowed to close.
         """
 
+        # stop refreshing the timing statistics
+        self.timing_timer.stop()
+
+        # an export still reads the history, stop it before the history is freed
+        if self.export_thread is not None:
+            self.export_thread.cancel()
+            self.export_thread.wait()
+
         # the following line is essential in order to have the main window
         # stay alive after closing this dialog. Without removing the canvas
         # widget, the entire program crashes.
@@ -201,17 +324,40 @@ class Ui_Dialog(object):
         # get the stop variable from global context
         global stop
 
-        # set the stop variable so the program knows it needs to close
-        # this will allow the thread to exit the infinite loop in dataSendLoop()
-        stop = 1
-        time.sleep(1)
+        if self.acquisition is not None:
+            # stop the acquisition process, it closes the serial port itself
+            self.acquisition.stop()
+        else:
+            # set the stop variable so the program knows it needs to close
+            # this will allow the thread to exit the infinite loop in dataSendLoop()
+            stop = 1
+            time.sleep(1)
+
+            # close the _serial_port
+            _serial_port.close()
 
-        # close the _serial_port
-        _serial_port.close()
+        # write the rest of the recording and finish its file
+        self.recorder.close()
+        # summarize the run for the catalog, in the background
+        if self.recorder.written > 0:
+            add_run_later(self.recorder.path)
 
         # click the hidden close button that actually closes the window
         self.pushButtonHIDDEN.click()
 
+    def show_history(self, Dialog):
+        """
+        Opens the history window, which shows the whole run so far. The plot keeps running while it is open.
+
+        :param Dialog: The same PyQt5.QtWidgets.QDialog object passed to the PlotGUI.Ui_Dialog.
+        """
+
+        # the history window belongs to the plot window and is closed with it
+        self.history_dialog = QtWidgets.QDialog(Dialog)
+        self.history_ui = historyWindow()
+        self.history_ui.setupUi(self.history_dialog, self.myFig)
+        self.history_dialog.show()
+
     def save_image(self, Dialog):
         """
         Saves the current plot canvas as an image file.
@@ -231,7 +377,7 @@ class Ui_Dialog(object):
             return
 
         # else, save the figure at the specified file path
-        self.myFig.fig.savefig(fname[0])
+        self.myFig.save_image(fname[0])
 
     def save_csv(self, Dialog):
         """
@@ -251,54 +397,117 @@ class Ui_Dialog(object):
         if fname[0] == '':
             return
 
-        # else, save the data at the specified file path
-        with open(fname[0], "w") as csvfile:
-            fieldnames = ['Time (s)', 'Signal (V)']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames,
-                                    delimiter=',', lineterminator='\n')
-            writer.writeheader()
-            # get time scaling factor based on the sample rate
-            interval = float(get_interval())
-            for x in range(0, len(self.myFig.all)):
-                writer.writerow({'Time (s)': round(float(x) * interval, 2), 'Signal (V)': self.myFig.all[x]})
-
-
-# You need to setup a signal slot mechanism, to
-# send data to your GUI in a thread-safe way.
-# Believe me, if you don't do this right, things
-# go very very wrong.
-class Communicate(QtCore.QObject):
-    """
-    In order to cleanly send data throughout the different processes within the GUI,
-    a thread-safe mechanism must be used. This is an extension of a built-in pyqt signal.
-    It can be connected to a slot (function) that will trigger when the signal emits a value.
-    """
-    data_signal = QtCore.pyqtSignal(float)
+        # else, save the data at the specified file path.
+        # the file is written on a separate thread so the plot keeps running.
+        columns, size = run_columns(self.myFig)
+        self.start_export(Dialog, "Saving data...", write_csv, fname[0], columns, size)
 
+    def save_binary(self, Dialog):
+        """
+        This function saves all recorded data as binary columns with the run's metadata, which load much faster
+        than a CSV file (see export.load_export()). NPZ files need nothing but NumPy, Arrow files need pyarrow,
+        so they are only offered if it is installed.
+        Opens a save file dialog to get the desired file path and format from the user.
 
-def dataSendLoop(addData_callbackFunc, update_plot):
-    """
-    This is the infinite loop executed by a separate thread. Based on the sample rate set by the user,
-    it will periodically poll a new value over the serial port and send it to the animation through a
-    signal-slot mechanism. This function is also responsible for re-hashing the settings files and
-    checking for necessary updates to the plot axes and filtering. If a change is detected, it will
-    trigger the *update_plot()* function.
-
-    :param addData_callbackFunc: slot function for adding data to the plot.
-    :param update_plot: slot function for updating the plot filtering and axes.
-    """
+        :param Dialog: The same PyQt5.QtWidgets.QDialog object passed to the PlotGUI.Ui_Dialog.
+        """
 
-    # Setup the signal-slot mechanism.
-    # This signal is responsible for adding new data to the animation
-    mySrc = Communicate()
-    mySrc.data_signal.connect(addData_callbackFunc)
+        # easy way to open a save file dialog
+        # returns the file path and the chosen format as strings
+        formats = 'NumPy Files (*.npz)'
+        if arrow_supported:
+            formats += ';;Arrow Files (*.arrow)'
+        fname = QFileDialog.getSaveFileName(Dialog, 'Save Data',
+                                            os.sep.join((os.path.expanduser('~'), 'Documents')), formats)
 
-    # This signal is responsible for updating the plot window if a change has been detected
-    mySrc2 = Communicate()
-    mySrc2.data_signal.connect(update_plot)
+        # if the user canceled, exit
+        if fname[0] == '':
+            return
+
+        # else, save the data at the specified file path in the chosen format
+        columns, size = run_columns(self.myFig)
+        metadata = run_metadata(self.myFig, self.port)
+        if fname[1].startswith('Arrow'):
+            self.start_export(Dialog, "Saving data...", write_arrow, fname[0], columns, size, metadata)
+        else:
+            self.start_export(Dialog, "Saving data...", write_npz, fname[0], columns, size, metadata)
+
+    def start_export(self, Dialog, text, export, *args):
+        """
+        Runs an export on an export.ExportThread and shows its progress in a dialog that can cancel it.
+
+        :param Dialog: The same PyQt5.QtWidgets.QDialog object passed to the PlotGUI.Ui_Dialog.
+        :param text: text shown in the progress dialog
+        :param export: export function, see export.ExportThread
+        :param args: the export function's arguments
+        """
+
+        # one export at a time
+        if self.export_thread is not None and self.export_thread.isRunning():
+            return
+
+        # the progress dialog belongs to the plot window
+        self.export_progress = QtWidgets.QProgressDialog(text, "Cancel", 0, 100, Dialog)
+        self.export_progress.setWindowTitle("Export")
+        self.export_progress.setAutoClose(False)
+        self.export_progress.setAutoReset(False)
+        self.export_progress.setMinimumDuration(500)
+
+        self.export_thread = ExportThread(export, *args)
+        self.export_thread.progress.connect(self.export_progress.setValue)
+        self.export_progress.canceled.connect(self.export_thread.cancel)
+        self.export_thread.done.connect(lambda written, error: self.export_done(Dialog, written, error))
+        self.export_thread.start()
+
+    def export_done(self, Dialog, written, error):
+        """
+        Called when the export thread is done. Closes the progress dialog and reports an error, if there was one.
+
+        :param Dialog: The same PyQt5.QtWidgets.QDialog object passed to the PlotGUI.Ui_Dialog.
+        :param written: bool indicating whether the file was written
+        :param error: error message, empty if there was none
+        """
+        self.export_progress.close()
+        if error:
+            QtWidgets.QMessageBox.warning(Dialog, "Export Failed", "The file could not be saved:\n" + error)
 
-    # this gets the sample rate from the settings file and calculates the delay for the data collection loop
-    interval = get_interval()
+
+def dataSendLoop(queue, scheduler=None, recorder=None):
+    """
+    This is the infinite loop executed by a separate thread. Based on the acquisition mode set by the user,
+    it will either periodically poll a new value over the serial port or read the samples streamed by the ADC,
+    and put them into the plot's ingest queue about once per frame. It never touches the plot itself,
+    changes of the settings files are picked up on the GUI thread, see Ui_Dialog.check_settings().
+
+    :param queue: buffers.IngestQueue of the plot. Blocks are put into it directly from this thread
+            (and may wait for room, depending on its policy), the queue is safe to share between threads.
+    :param scheduler: acquisition.DeadlineScheduler used to pace polled reads. One is created if not given.
+    :param recorder: recorder.JournalRecorder that every block read from the ADC is passed to, with its timestamps.
+            It records the samples before the plot's queue gets a chance to drop any.
+    """
+
+    # get _serial_port from global context
+    global _serial_port
+
+    # create the data source for the acquisition mode in the settings file and start it.
+    # streaming sources push samples at the sample rate on their own.
+    source = make_source(_serial_port)
+    source.start(get_sample_rate())
+
+    # this gets the sample rate from the settings file and calculates the period of the data collection loop.
+    # the scheduler keeps reads on a fixed grid, so the time spent reading doesn't add up to drift.
+    if scheduler is None:
+        scheduler = DeadlineScheduler(get_interval())
+    scheduler.period = get_interval() * source.samples_per_read
+    scheduler.start()
+
+    # samples read since the last emit with their timestamps, and when that emit happened
+    pending = []
+    pending_times = []
+    last_emit = time.monotonic()
+    # timestamp of the last sample read, every block is stamped after it
+    last_time = None
+    emit_interval = frame_interval / 1000.
 
     # enter infinite loop
     while True:
@@ -310,26 +519,33 @@ def dataSendLoop(addData_callbackFunc, update_plot):
         # if so, exit the while loop so this thread can stop and we can do garbage collection later
         if stop:
             stop = 0
+            source.stop()
             break
 
-        # check if the user has changed any of the settings
-        # if so, trigger signal-slot mechanism in mySrc2 and update_plot()
-        if check_for_change():
-            mySrc2.data_signal.emit(0)
-
-        # wait the specified interval
-        time.sleep(interval)
-
-        # get _serial_port from global context
-        global _serial_port
-
-        # request a new value from the ADC
-        _serial_port.write(b'a')
-        # read from the serial port to get the value
-        val = int(_serial_port.readline().decode('ascii').strip())
-
-        # emit a signal from mySrc, which will execute addData_callbackFunc(val)
-        mySrc.data_signal.emit(val)
+        # wait for the next deadline, unless the ADC sets the pace
+        if source.paced:
+            scheduler.wait()
+
+        # get the new values from the ADC
+        counts = source.read()
+        if counts.size > 0:
+            # stamp them right after the read. a block that was read at once gets the nominal spacing before that,
+            # so a stall of the serial link shows up as a gap instead of stretching the time axis.
+            times = block_times(time.monotonic(), counts.size, scheduler.period / source.samples_per_read, last_time)
+            last_time = times[-1]
+            pending.append(counts)
+            pending_times.append(times)
+            # queue them for the recording, this never waits for the disk
+            if recorder is not None:
+                recorder.record(counts, times)
+
+        # once per frame, hand the collected samples to the plot.
+        # the queue is safe to share between threads, no signal needed.
+        if pending and time.monotonic() - last_emit >= emit_interval:
+            queue.put(np.concatenate(pending), np.concatenate(pending_times))
+            pending = []
+            pending_times = []
+            last_emit = time.monotonic()
 
 
 def get_interval():
@@ -367,9 +583,10 @@ def check_for_change():
 
 def get_hash():
     """
-    This function uses *hashlib* to generate an md5 hash of the settings file.
+    This function uses *hashlib* to generate an md5 hash of the settings file and the calibration file,
+    so editing either one during a run is picked up.
 
-    :return: the hash of the settings file
+    :return: the hash of the settings files
     """
 
     # create hash object
@@ -380,6 +597,11 @@ def get_hash():
         buf = myfile.read().encode('utf-8')
         hasher.update(buf)
 
+    # the calibration file is optional, without it the built-in curve is used
+    if os.path.isfile(calibration_file):
+        with open(calibration_file, 'r') as myfile:
+            hasher.update(myfile.read().encode('utf-8'))
+
     # generate the hashcode and return it
     return hasher.hexdigest()
 
@@ -0,0 +1,488 @@
+"""
+:platform: Unix, Windows
+:synopsis: This module contains the data side of the live plot, shared by every plotting backend:
+    new samples are calibrated, filtered, stored and decimated here, the backends only draw the result.
+:moduleauthor: Michael Eller <mbe9a@virginia.edu>
+"""
+
+from collections import OrderedDict
+import numpy as np
+from settings_interface import get_window_samples, get_sample_rate, get_x_axis_size, get_y_axis_max, get_y_axis_min, \
+    get_queue_high_water, get_queue_policy, get_filter_type, get_min_frame_interval, get_max_frame_interval, \
+    get_history_dtype, get_history_hot_chunks
+from filters import make_filter
+from calibration import get_calibration_table, counts_to_volts
+from buffers import IngestQueue, RingBuffer
+from decimation import MinMaxDecimator, MinMaxPyramid
+from history import HistorySession
+
+#: time between plot updates in ms when the plot starts.
+#: the plot then adapts it to how long a frame takes to draw, see PlotData.adapt_interval()
+frame_interval = 100
+
+
+class PlotData(object):
+    """
+    PlotData holds everything the live plot shows: the queue of new ADC values, the whole recorded history,
+    the filtered history and the rolling windows that are on screen.
+
+    A plotting backend (animation.CustomFigCanvas or painter_canvas.PainterCanvas) inherits from this class,
+    calls *init_data()* in its constructor, calls *process_new_data()* on every frame and draws the lines
+    returned by *decimate()*. The backend extends *update_xlim()* and *update_ylim()* to change its axes.
+    """
+
+    #: number of previous filter settings whose filtered history is kept in *filter_cache*
+    filter_cache_size = 4
+
+    #: fraction of the GUI thread's time the plot may spend drawing, the frame interval is adapted to keep it there
+    draw_load = 0.25
+
+    #: weight of the newest draw time in the smoothed draw time
+    draw_time_smoothing = 0.2
+
+    #: margin is a small space (in samples) between the right side of the plot and the line head
+    margin = 2
+
+    #: number of samples drawn as the highlighted tail of each line
+    tail_length = 10
+
+    def init_data(self):
+        """
+        Initializes the data of the plot from the settings file. This must be called by the backend's constructor.
+        """
+
+        # bounded queue for the data sent from the thread running plotGUI.dataSendLoop().
+        # the thread puts blocks into it directly, every frame drains it.
+        self.addedData = IngestQueue(get_queue_high_water(), get_queue_policy())
+        # acquisition.AcquisitionProcess to read new data from, if the acquisition runs in a separate process
+        self.acquisition = None
+        # recorder.JournalRecorder that gets the raw samples read from the acquisition process
+        self.recorder = None
+
+        # lookup table that turns ADC counts into voltages, see the calibration module
+        self.calibration_table = get_calibration_table()
+
+        # get the x axis range from the settings file
+        self.xlim = float(get_x_axis_size())
+        # get the sample rate from the settings file
+        samp_rate = get_sample_rate()
+
+        # n contains the x values of the data points, as if they came in exactly at the sample rate.
+        # the plot is a rolling window so for a given x range, there are always the same
+        # number of points shown on the plot. The points are drawn at the times they were actually read,
+        # see window_x(), n only places the head of the line and the samples before the first one.
+        self.n = np.linspace(0, self.xlim - 1, int(self.xlim*samp_rate))
+
+        # initialize the data (y array) with zeros.
+        # the rolling windows are ring buffers, so adding a sample doesn't shift the whole array.
+        self.y = RingBuffer(self.n.size)
+        # do the same for the differential derivative
+        self.deriv = RingBuffer(self.n.size)
+
+        # precision of the recorded history from the settings file
+        self.history_dtype = get_history_dtype()
+        # the history only keeps its newest chunks in memory, older ones go to files in a session directory.
+        # this keeps the memory use flat however long the run is.
+        self.session = HistorySession(get_history_hot_chunks())
+
+        # all is used to save all recorded data.
+        # when the window frame shifts and drops the oldest data points,
+        # they are erased from self.y
+        self.all = self.session.column(self.history_dtype)
+        # all_deriv is used to save all recorded derivative points
+        self.all_deriv = self.session.column(self.history_dtype)
+        # the time.monotonic() timestamp of every recorded point.
+        # always double precision, single precision can't resolve milliseconds after a few hours of uptime.
+        self.all_times = self.session.column(np.float64)
+        # the timestamps of the points in the rolling windows
+        self.t = RingBuffer(self.n.size)
+        # the raw ADC counts of every recorded point, for the exports
+        self.all_counts = self.session.column(np.int16)
+
+        # min / max pyramids of the whole run, so the history view can zoom from the full run to single samples
+        self.history = MinMaxPyramid(self.all, column=self.session.column)
+        self.deriv_history = MinMaxPyramid(self.all_deriv, column=self.session.column)
+
+        # get the kind of filter and the number of samples it uses from the settings file
+        self.filter_type = get_filter_type()
+        self.window_samples = int(get_window_samples())
+        # this streaming filter calculates the filtered data points, it keeps its own state between frames
+        self.filter = make_filter(self.filter_type, self.window_samples)
+        # the derivative data can also be filtered
+        self.deriv_filter = make_filter(self.filter_type, self.window_samples)
+
+        # separate arrays are used for the raw data and the filtered data.
+        # these function like self.y and self.deriv.
+        # Note:
+        #       *   when filtering is active, i.e. windows samples > 1, the plot displays
+        #           these instead.
+        #
+        #       *   if you change the filtering while the animation is running, all previous values are filtered
+        #           again with the new settings, see update_window()
+        self.filtered_data = RingBuffer(self.n.size)
+        self.filtered_deriv = RingBuffer(self.n.size)
+
+        # we need these to store all the filtered points even after the plot has dropped them
+        self.all_filtered_data = self.session.column(self.history_dtype)
+        self.all_filtered_deriv = self.session.column(self.history_dtype)
+
+        # filtered histories (and the filters that made them) of the filter settings used before.
+        # switching back to one of them only has to filter the samples that arrived since.
+        self.filter_cache = OrderedDict()
+
+        # get the y-axis limits from the settings file
+        self.ymin = get_y_axis_min()
+        self.ymax = get_y_axis_max()
+
+        # the long lines are reduced to a few points per pixel column before they are drawn,
+        # so a frame costs the same no matter how many samples the x-axis spans
+        self.data_decimator = MinMaxDecimator(1000)
+        self.deriv_decimator = MinMaxDecimator(1000)
+
+        # bounds of the frame interval in ms from the settings file
+        self.min_interval = get_min_frame_interval()
+        self.max_interval = get_max_frame_interval()
+        # current time between frames in ms
+        self.frame_interval = int(np.clip(frame_interval, self.min_interval, self.max_interval))
+        # smoothed time it takes to draw a frame in ms, None until the first frame was drawn
+        self.draw_time = None
+        # number of frames drawn and the total time they took in ms, for throughput reports
+        self.frames = 0
+        self.draw_total = 0.
+        # a frame is only drawn if new data arrived or this is set, e.g. because the whole figure was redrawn
+        self.frame_needed = True
+
+    def close_data(self):
+        """
+        Free the history and delete its session directory. The backend calls this when it is closed.
+        """
+
+        # drop every view of the spilled files first, Windows can't delete files that are still mapped
+        for column in [self.all, self.all_deriv, self.all_times, self.all_counts, self.all_filtered_data,
+                       self.all_filtered_deriv]:
+            column.clear()
+        for filtered_data, filtered_deriv, _, _ in self.filter_cache.values():
+            filtered_data.clear()
+            filtered_deriv.clear()
+        self.filter_cache.clear()
+        self.history.reset()
+        self.deriv_history.reset()
+
+        self.session.close()
+
+    def addData(self, value, times=None):
+        """
+        This function is called by the signal-slot mechanism within the plotGUI Dialog.
+        It adds a block of values to the plots received data queue, *addedData*, in one call.
+
+        :param value: received value, or numpy array of values, from the serial connection to the ADC
+        :param times: numpy array of the time.monotonic() timestamps of the values, now if not given
+        """
+        # this runs in the GUI thread, which also drains the queue, so it must never wait for room
+        self.addedData.put(value, times, timeout=0)
+
+    def attach_acquisition(self, acquisition, recorder=None):
+        """
+        Read new data directly from an acquisition process's shared ring buffer on every frame,
+        instead of receiving it sample by sample through *addData()*.
+
+        :param acquisition: a started acquisition.AcquisitionProcess
+        :param recorder: recorder.JournalRecorder to pass the raw samples to, None to not record them
+        """
+        self.acquisition = acquisition
+        self.recorder = recorder
+
+    def has_new_data(self):
+        """
+        Check whether there is anything to draw without taking it out of the queue.
+
+        :return: bool indicating whether new data is waiting in *addedData* or the acquisition process's buffer
+        """
+        if self.addedData.pending > 0:
+            return True
+        return self.acquisition is not None and self.acquisition.available > 0
+
+    def adapt_interval(self, elapsed):
+        """
+        Adjust the time between frames to the time it takes to draw one, so the plot never uses more than
+        *draw_load* of the GUI thread. Slow PCs get fewer frames instead of a frozen window.
+        The backend extends this to apply *frame_interval* to its timer.
+
+        :param elapsed: time the last frame took to draw in ms
+        """
+
+        self.frames += 1
+        self.draw_total += elapsed
+
+        # smooth the draw time, a single slow frame (e.g. a garbage collection) shouldn't halve the frame rate
+        if self.draw_time is None:
+            self.draw_time = elapsed
+        else:
+            self.draw_time += self.draw_time_smoothing * (elapsed - self.draw_time)
+
+        # keep the interval within the user's bounds
+        self.frame_interval = int(np.clip(self.draw_time / self.draw_load, self.min_interval, self.max_interval))
+
+    def update_frame_interval(self):
+        """
+        This function gets the bounds of the frame interval from the settings file.
+        The interval is adjusted to the new bounds after the next frame.
+        """
+        self.min_interval = get_min_frame_interval()
+        self.max_interval = get_max_frame_interval()
+
+    def update_calibration(self):
+        """
+        This function gets the calibration lookup table for the tool and board in the settings file.
+        The table is cached, so this is cheap unless the calibration actually changed.
+        Every value processed from now on is calibrated with the new table.
+
+        :return: bool indicating whether the table changed
+        """
+        table = get_calibration_table()
+        changed = table is not self.calibration_table
+        self.calibration_table = table
+        return changed
+
+    def update_xlim(self):
+        """
+        This function handles updating the x-axis range dynamically.
+        The backend extends this to change its x-axis.
+
+        :return: bool indicating whether or not the range changed
+        """
+
+        # save the old setting
+        old_xlim = self.xlim
+        # set the new xlim
+        self.xlim = get_x_axis_size()
+        # since all updating functions are called if any of the settings are changed,
+        # we can check whether or not this setting actually changed and exit if not.
+        if old_xlim == self.xlim:
+            return False
+
+        # get the sample rate from the settings file
+        samp_rate = get_sample_rate()
+
+        # generate the new list of x values based on the new limits and the sample rate
+        n = np.linspace(0, self.xlim - 1, int(self.xlim*samp_rate))
+
+        # resize the rolling windows. if the range decreased, the oldest values are dropped.
+        # if the range increased, the windows are extended to the left with the values in self.all that
+        # have already scrolled out of the plot. if there aren't enough of those yet, the rest is zeros.
+        # number of recorded values that are older than the current window
+        older = max(0, len(self.all) - len(self.n))
+        # number of those that fit in the new space
+        diff = min(older, max(0, n.size - len(self.n)))
+        # calculate the indices for the data points in self.all that we want to use
+        index_1 = older - diff
+        index_2 = older
+
+        # add or remove data points from the rolling windows
+        self.y.resize(n.size, self.all[index_1:index_2])
+        self.deriv.resize(n.size, self.all_deriv[index_1:index_2])
+        self.filtered_data.resize(n.size, self.all_filtered_data[index_1:index_2])
+        self.filtered_deriv.resize(n.size, self.all_filtered_deriv[index_1:index_2])
+        self.t.resize(n.size, self.all_times[index_1:index_2])
+
+        # set the new n list
+        self.n = n
+
+        # the windows were rebuilt, decimate them from scratch
+        self.data_decimator.reset()
+        self.deriv_decimator.reset()
+        return True
+
+    def update_ylim(self):
+        """
+        Update the data y-axis limits according to the input from the user.
+        The derivative limits are hard-coded based on the ymax of the data axis.
+        The backend extends this to change its y-axes.
+
+        :return: bool indicating whether or not the limits changed
+        """
+
+        # save the old settings
+        old_ylim = (self.ymin, self.ymax)
+        # get the y-axis minimum from the settings file
+        self.ymin = get_y_axis_min()
+        # get the y-axis maximum from the settings file
+        self.ymax = get_y_axis_max()
+        # since all updating functions are called if any of the settings are changed,
+        # we can check whether or not these settings actually changed and exit if not.
+        return old_ylim != (self.ymin, self.ymax)
+
+    def update_window(self):
+        """
+        This function updates the filter type and *windows_samples* variable from the settings file.
+        If either changed, the whole history and the visible window are filtered again with the new settings,
+        so the plot never mixes several filters. Filtered histories are cached per filter setting,
+        so switching back and forth only costs the samples that arrived in between.
+        """
+
+        # save the old settings
+        old_key = (self.filter_type, self.window_samples)
+        # get the new settings
+        self.filter_type = get_filter_type()
+        self.window_samples = int(get_window_samples())
+        new_key = (self.filter_type, self.window_samples)
+        # since all updating functions are called if any of the settings are changed,
+        # we can check whether or not these settings actually changed and exit if not.
+        if old_key == new_key:
+            return
+
+        # keep the current filtered history and the filters' states for later
+        self.filter_cache[old_key] = (self.all_filtered_data, self.all_filtered_deriv,
+                                      self.filter, self.deriv_filter)
+
+        # pick up where these settings were left off, or start over
+        cached = self.filter_cache.pop(new_key, None)
+        if cached is not None:
+            self.all_filtered_data, self.all_filtered_deriv, self.filter, self.deriv_filter = cached
+        else:
+            self.all_filtered_data = self.session.column(self.history_dtype)
+            self.all_filtered_deriv = self.session.column(self.history_dtype)
+            self.filter = make_filter(self.filter_type, self.window_samples)
+            self.deriv_filter = make_filter(self.filter_type, self.window_samples)
+
+        # only keep the most recently used settings, and free the disk space of the others
+        while len(self.filter_cache) > self.filter_cache_size:
+            dropped = self.filter_cache.popitem(last=False)[1]
+            dropped[0].clear()
+            dropped[1].clear()
+
+        # filter every recorded sample these filters haven't seen yet, in one pass
+        done = len(self.all_filtered_data)
+        if done < len(self.all):
+            self.all_filtered_data.extend(self.filter.update(self.all[done:]))
+            self.all_filtered_deriv.extend(self.deriv_filter.update(self.all_deriv[done:]))
+
+        # the visible window shows the newest part of the filtered history
+        self.filtered_data.reset(self.all_filtered_data[-len(self.n):])
+        self.filtered_deriv.reset(self.all_filtered_deriv[-len(self.n):])
+
+        # the windows were rebuilt, decimate them from scratch
+        self.data_decimator.reset()
+        self.deriv_decimator.reset()
+
+        # the lines have to be redrawn with the new filter even if no new data arrives
+        self.frame_needed = True
+
+    def process_new_data(self):
+        """
+        Take every new value from the acquisition, calibrate and filter it and add it to the history and
+        the rolling windows. The backend calls this once per frame.
+
+        :return: number of new values
+        """
+
+        # pull everything the acquisition process wrote since the last frame
+        if self.acquisition is not None:
+            counts, times = self.acquisition.read()
+            self.addedData.put(counts, times, timeout=0)
+            # the recorder only queues them, its thread does the writing
+            if self.recorder is not None:
+                self.recorder.record(counts, times)
+
+        # take every new value from the ADC and process them as one block
+        vals, times = self.addedData.drain()
+        if vals.size == 0:
+            return 0
+        self.all_times.extend(times)
+        self.t.extend(times)
+
+        # keep the raw counts, then back out the actual voltage using the calibration lookup table
+        self.all_counts.extend(vals)
+        vals = counts_to_volts(vals, self.calibration_table)
+
+        # calculate the derivative values, the first one relative to the last value shown
+        deriv_vals = np.diff(vals, prepend=self.y[-1])
+
+        # append the values to the lists that save all values
+        self.all.extend(vals)
+        self.all_deriv.extend(deriv_vals)
+        # summarize the new values in the history pyramids
+        self.history.update()
+        self.deriv_history.update()
+
+        # calculate the filtered values, the filters carry their windows over from the last block
+        filtered_vals = self.filter.update(vals)
+        filtered_deriv_vals = self.deriv_filter.update(deriv_vals)
+
+        # append the filtered values to the rolling windows and the permanent lists
+        self.filtered_data.extend(filtered_vals)
+        self.all_filtered_data.extend(filtered_vals)
+        self.filtered_deriv.extend(filtered_deriv_vals)
+        self.all_filtered_deriv.extend(filtered_deriv_vals)
+
+        # append the new values to the main data and derivative windows, dropping the oldest
+        self.y.extend(vals)
+        self.deriv.extend(deriv_vals)
+        return vals.size
+
+    def windows(self):
+        """
+        The rolling windows that are on screen.
+
+        :return: tuple (data, deriv) of numpy views, filtered if filtering is active
+        """
+
+        # if we need to display the filtered lists
+        if self.window_samples > 1:
+            return self.filtered_data.view(), self.filtered_deriv.view()
+        # display y and deriv
+        return self.y.view(), self.deriv.view()
+
+    def decimate(self, columns):
+        """
+        Reduce the lines to what can be seen on *columns* pixel columns. The newest *margin* samples are left out.
+
+        :param columns: width of the plot area in pixels
+        :return: tuple (data x, data y, derivative x, derivative y) of numpy arrays, x in seconds as in *n*
+        """
+
+        data, deriv = self.windows()
+        x = self.window_x()
+        size = self.n.size - self.margin
+        # the decimators need to know how many samples came before the window to reuse their cached columns
+        total = len(self.all) - self.margin
+        data_index, data_points = self.data_decimator.decimate(data[0: size], total, columns)
+        deriv_index, deriv_points = self.deriv_decimator.decimate(deriv[0: size], total, columns)
+        return x[data_index], data_points, x[deriv_index], deriv_points
+
+    def tails(self):
+        """
+        The highlighted ends of the lines, the last point of each is the line head.
+
+        :return: tuple (x, data y, derivative y) of numpy arrays
+        """
+
+        data, deriv = self.windows()
+        end = self.n.size - self.margin
+        start = max(0, self.n.size - self.tail_length)
+        return self.window_x()[start:end], data[start:end], deriv[start:end]
+
+    def window_x(self):
+        """
+        The x values of the rolling windows from the times the samples were read, so a stall of the serial link
+        or a change of the sample rate shows up as what it was. The head of the line stays where *n* puts it,
+        every other point sits as far to its left as it is older. The part of the window from before the first
+        sample is spaced like *n*.
+
+        :return: numpy array of x values in seconds, like *n*
+        """
+
+        times = self.t.view()
+        real = min(len(self.all), times.size)
+        if real == 0:
+            return self.n
+
+        # place the samples from before the first one at the nominal spacing
+        pad = times.size - real
+        if pad > 0:
+            times = times.copy()
+            step = self.n[1] - self.n[0] if self.n.size > 1 else 0.
+            times[:pad] = times[pad] - step * np.arange(pad, 0, -1)
+
+        head = self.n.size - self.margin - 1
+        return self.n[head] - (times[head] - times)
@@ -0,0 +1,585 @@
+"""
+:platform: Unix, Windows
+:synopsis: This module records every raw ADC count and its timestamp to disk while the plot is running,
+    so a run survives a crash of the program or a closed dialog. The journal is append-only and every record
+    carries a checksum, so a file cut short by a crash is recovered up to its last complete record.
+    The counts are stored raw, together with the calibration curve that was active and every change of it during
+    the run, so a recorded run can be calibrated again later, e.g. after the board was measured again.
+    See *Recording* for reading a run back.
+:moduleauthor: Michael Eller <mbe9a@virginia.edu>
+"""
+
+import glob
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+import numpy as np
+from calibration import build_table, counts_to_volts, get_default_segments
+from filters import make_filter
+from history import process_alive
+
+#: directory that holds the recorded runs, next to resources/
+recordings_dir = "recordings"
+
+#: extension of a finished recording
+journal_extension = ".epj"
+
+#: extension of a recording that is still being written. It follows the id of the process writing it,
+#: e.g. 20240101-120000.epj.1234.part. A file left with it after a crash is recovered by *recover_recordings()*
+#: on the next launch, once that process is gone.
+partial_extension = ".part"
+
+#: identifies a journal file and its version.
+#: version 1 stored plain int16 counts and float64 timestamps, version 2 stores them delta-encoded and compressed.
+#: version 3 adds calibration records, written when the calibration curve changes during the run.
+journal_magic = b"EPJOURNL"
+journal_version = 3
+
+#: zlib compression level of the records, higher levels gain little on these deltas
+compression_level = 6
+
+# the part of the file header every version shares: magic, version
+_file_magic = struct.Struct("<8sH")
+# rest of the file header of version 1: sample rate in samples / sec, wall clock time the run started (time.time())
+_file_header_v1 = struct.Struct("<dd")
+# rest of the file header of version 2: as version 1, followed by the length of the JSON metadata after it
+_file_header_v2 = struct.Struct("<ddI")
+# record header of version 1: number of samples, crc32 of the payload
+_record_header_v1 = struct.Struct("<II")
+# record header of version 2: number of samples, crc32 of the payload, compressed size of the counts and
+# of the timestamps. The payload is the first timestamp (float64) followed by both compressed blocks.
+# A calibration record (version 3) has 0 samples, the size of its JSON curve and 0. Its payload is the timestamp
+# of the last sample calibrated with the previous curve (float64) followed by the JSON of the new curve.
+_record_header_v2 = struct.Struct("<IIII")
+_first_time = struct.Struct("<d")
+
+#: a record claiming more samples than this is garbage from a torn write
+max_record_samples = 1 << 24
+
+
+def encode_block(counts, times):
+    """
+    Pack a block of samples into the payload of a version 2 record.
+
+    The counts are stored as int16 differences to the previous count, which are mostly tiny for a slowly
+    changing signal and compress well. The timestamps are stored as whole microseconds since the first one,
+    again as differences, which are nearly constant at a fixed sample rate.
+
+    :param counts: numpy array of raw ADC counts
+    :param times: numpy array of their time.monotonic() timestamps
+    :return: tuple (payload, compressed size of the counts, compressed size of the timestamps)
+    """
+
+    counts = np.asarray(counts).astype(np.int16)
+    times = np.asarray(times, dtype=np.float64)
+
+    # differences wrap around in int16, the cumulative sum on reading wraps back exactly
+    count_deltas = np.diff(counts, prepend=np.int16(0)).astype("<i2")
+    # rounding the offsets (not the differences) keeps the rounding error from adding up along the block
+    offsets = np.rint((times - times[0]) * 1e6).astype(np.int64)
+    time_deltas = np.diff(offsets, prepend=np.int64(0)).astype("<i8")
+
+    packed_counts = zlib.compress(count_deltas.tobytes(), compression_level)
+    packed_times = zlib.compress(time_deltas.tobytes(), compression_level)
+    return _first_time.pack(times[0]) + packed_counts + packed_times, len(packed_counts), len(packed_times)
+
+
+def decode_block(payload, n, counts_size, times_size):
+    """
+    Unpack the payload of a version 2 record, see *encode_block()*.
+
+    :param payload: the payload bytes
+    :param n: number of samples in the record
+    :param counts_size: compressed size of the counts
+    :param times_size: compressed size of the timestamps
+    :return: tuple (counts, times) of numpy arrays, or None if the payload doesn't hold *n* samples
+    """
+
+    t0, = _first_time.unpack_from(payload)
+    start = _first_time.size
+    try:
+        count_deltas = np.frombuffer(zlib.decompress(payload[start:start + counts_size]), dtype="<i2")
+        time_deltas = np.frombuffer(zlib.decompress(payload[start + counts_size:start + counts_size + times_size]),
+                                    dtype="<i8")
+    except zlib.error:
+        return None
+    if count_deltas.size != n or time_deltas.size != n:
+        return None
+    return np.cumsum(count_deltas, dtype=np.int16), t0 + np.cumsum(time_deltas) / 1e6
+
+
+class JournalRecorder(object):
+    """
+    Appends raw ADC counts and their time.monotonic() timestamps to a journal file on a background thread.
+
+    *record()* only queues the block, so the acquisition loop never waits for the disk.
+    The thread writes everything queued as one record every *flush_interval* seconds and fsyncs it,
+    which bounds what a crash (or a power cut) can lose to the last interval.
+    A record is a header (sample count, crc32 of the payload, sizes) followed by the compressed counts and
+    timestamps, see *encode_block()*. That is about a quarter of the size of the calibrated float64 values.
+    A change of the calibration curve during the run is written as a record of its own, see *set_calibration()*.
+    """
+
+    #: seconds between writes, at most this much of the run is lost in a crash
+    flush_interval = 1.
+
+    def __init__(self, sample_rate, calibration=None, metadata=None, root=recordings_dir):
+        """
+        Create the journal file and start the writer thread.
+
+        :param sample_rate: sample rate in samples / sec, stored in the file header
+        :param calibration: the active calibration curve as a list of (kind, lower, upper, coefficients) tuples,
+                see calibration.get_calibration_segments(). Stored in the file header.
+        :param metadata: dict of anything else worth keeping with the run (tool, board, port, ...),
+                it must be serializable to JSON
+        :param root: directory the recording is created in
+        """
+
+        # the header metadata, the calibration is kept so the counts can be turned into volts later
+        header = dict(metadata or {})
+        header["calibration"] = [list(segment) for segment in (calibration or get_default_segments())]
+        header = json.dumps(header).encode("utf-8")
+
+        # blocks of (counts, times) and calibration records waiting for the writer thread.
+        # deque append and popleft are atomic, so no lock is needed.
+        self._blocks = deque()
+        self._calibrations = deque()
+        # number of samples written and fsynced so far
+        self.written = 0
+        # set if the file couldn't be written, from then on nothing is recorded
+        self.failed = False
+
+        # the file keeps the partial extension until the recording is closed cleanly.
+        # two runs started within the same second get a number after the time.
+        name = time.strftime("%Y%m%d-%H%M%S")
+        self.path = os.path.join(root, name + journal_extension)
+        number = 1
+        while os.path.exists(self.path) or glob.glob(glob.escape(self.path) + ".*" + partial_extension):
+            self.path = os.path.join(root, "%s-%d%s" % (name, number, journal_extension))
+            number += 1
+        # the file being written, the process id keeps another instance from recovering it while it is written
+        self.partial_path = "%s.%d%s" % (self.path, os.getpid(), partial_extension)
+        try:
+            os.makedirs(root, exist_ok=True)
+            self._file = open(self.partial_path, "wb")
+            self._file.write(_file_magic.pack(journal_magic, journal_version) +
+                             _file_header_v2.pack(float(sample_rate), time.time(), len(header)) + header)
+            self._sync()
+        except OSError:
+            self._file = None
+            self.failed = True
+
+        # the writer thread runs until close() is called
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="JournalRecorder", daemon=True)
+        self._thread.start()
+
+    def record(self, counts, times):
+        """
+        Queue a block of samples for the journal. This never blocks, it is safe to call from the acquisition loop.
+
+        :param counts: numpy array of raw ADC counts
+        :param times: numpy array of their time.monotonic() timestamps
+        """
+        if len(counts) > 0 and not self.failed:
+            self._blocks.append((np.asarray(counts), np.asarray(times)))
+
+    def set_calibration(self, calibration, after):
+        """
+        Record a change of the calibration curve during the run. This never blocks.
+
+        :param calibration: the new curve as a list of (kind, lower, upper, coefficients) tuples,
+                see calibration.get_calibration_segments()
+        :param after: time.monotonic() timestamp of the last sample calibrated with the previous curve,
+                every later sample is calibrated with the new one
+        """
+        if not self.failed:
+            curve = json.dumps([list(segment) for segment in calibration]).encode("utf-8")
+            self._calibrations.append(_first_time.pack(after) + curve)
+
+    def close(self):
+        """
+        Write what is still queued, stop the writer thread and mark the recording as finished.
+        A recording without any samples is deleted.
+        """
+
+        self._stop.set()
+        self._thread.join()
+        if self._file is None:
+            return
+
+        self._file.close()
+        # only a recording that was closed cleanly loses the partial extension
+        try:
+            if self.written == 0:
+                os.remove(self.partial_path)
+            else:
+                os.replace(self.partial_path, self.path)
+        except OSError:
+            pass
+
+    def _run(self):
+        """
+        Body of the writer thread.
+        """
+        while not self._stop.wait(self.flush_interval):
+            self._write()
+        # write everything queued before close() was called
+        self._write()
+
+    def _write(self):
+        """
+        Write every queued block as one record and make sure it reached the disk.
+        """
+
+        blocks = []
+        while True:
+            try:
+                blocks.append(self._blocks.popleft())
+            except IndexError:
+                break
+        calibrations = []
+        while True:
+            try:
+                calibrations.append(self._calibrations.popleft())
+            except IndexError:
+                break
+        if not (blocks or calibrations) or self._file is None:
+            return
+
+        counts = np.concatenate([b[0] for b in blocks]) if blocks else np.empty(0, dtype=np.int16)
+        times = np.concatenate([b[1] for b in blocks]) if blocks else np.empty(0)
+        try:
+            # the records tell by their timestamps which samples each curve applies to, so their order doesn't matter
+            for payload in calibrations:
+                self._file.write(_record_header_v2.pack(0, zlib.crc32(payload), len(payload) - _first_time.size, 0) +
+                                 payload)
+            # a long backlog is split so no record exceeds the size recovery accepts
+            for start in range(0, counts.size, max_record_samples):
+                stop = start + max_record_samples
+                payload, counts_size, times_size = encode_block(counts[start:stop], times[start:stop])
+                self._file.write(_record_header_v2.pack(counts[start:stop].size, zlib.crc32(payload),
+                                                        counts_size, times_size) + payload)
+            self._sync()
+        except OSError:
+            # a full or missing disk must not take the acquisition down with it
+            self.failed = True
+            self._blocks.clear()
+            self._calibrations.clear()
+            return
+        self.written += counts.size
+
+    def _sync(self):
+        """
+        Push the written bytes through Python's and the operating system's buffers to the disk.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+def read_header(f):
+    """
+    Read the file header of a journal.
+
+    :param f: journal file opened in binary mode, positioned at its start
+    :return: dict with the version, sample_rate, started (time.time() at the start of the run), calibration
+            (list of (kind, lower, upper, coefficients) tuples) and the rest of the metadata,
+            or None if the file is not a journal. The file is left positioned at the first record.
+            The calibration_changes are left empty, *scan_journal()* fills them in.
+    """
+
+    data = f.read(_file_magic.size)
+    if len(data) < _file_magic.size:
+        return None
+    magic, version = _file_magic.unpack(data)
+    if magic != journal_magic or version not in (1, 2, 3):
+        return None
+
+    # version 1 had no metadata, its runs were calibrated with the default curve
+    metadata = {}
+    if version == 1:
+        data = f.read(_file_header_v1.size)
+        if len(data) < _file_header_v1.size:
+            return None
+        sample_rate, started = _file_header_v1.unpack(data)
+    else:
+        data = f.read(_file_header_v2.size)
+        if len(data) < _file_header_v2.size:
+            return None
+        sample_rate, started, size = _file_header_v2.unpack(data)
+        try:
+            metadata = json.loads(f.read(size).decode("utf-8"))
+        except ValueError:
+            return None
+
+    header = dict(metadata)
+    header.update({"version": version, "sample_rate": sample_rate, "started": started})
+    header["calibration"] = [tuple(segment) for segment in metadata.get("calibration", get_default_segments())]
+    header["calibration_changes"] = []
+    return header
+
+
+def scan_journal(f):
+    """
+    Read a journal up to its last complete record.
+
+    :param f: journal file opened in binary mode, positioned at its start
+    :return: tuple (header, records, end). *header* is the dict from *read_header()*, or None if the file is
+            not a journal. Its calibration_changes are the (after, calibration) tuples of the calibration records,
+            see *JournalRecorder.set_calibration()*. *records* is a list of (counts, times) numpy arrays,
+            *end* is the offset after the last complete record.
+    """
+
+    header = read_header(f)
+    if header is None:
+        return None, [], 0
+
+    v1 = header["version"] == 1
+    # only version 3 has records without samples
+    calibrations = header["version"] >= 3
+    record_header = _record_header_v1 if v1 else _record_header_v2
+    records = []
+    end = f.tell()
+    while True:
+        data = f.read(record_header.size)
+        if len(data) < record_header.size:
+            break
+        if v1:
+            n, crc = record_header.unpack(data)
+            size = n * (2 + 8)
+        else:
+            n, crc, counts_size, times_size = record_header.unpack(data)
+            size = _first_time.size + counts_size + times_size
+        # a record without samples must be a calibration record, it is never larger than a full sample record
+        if (n == 0 and not calibrations) or n > max_record_samples or size > max_record_samples * 16:
+            break
+        payload = f.read(size)
+        # a record cut short or garbled by a crash ends the journal
+        if len(payload) < size or zlib.crc32(payload) != crc:
+            break
+        if n == 0:
+            after, = _first_time.unpack_from(payload)
+            try:
+                curve = json.loads(payload[_first_time.size:].decode("utf-8"))
+            except ValueError:
+                break
+            header["calibration_changes"].append((after, [tuple(segment) for segment in curve]))
+            end += record_header.size + size
+            continue
+        if v1:
+            block = (np.frombuffer(payload, dtype="<i2", count=n),
+                     np.frombuffer(payload, dtype="<f8", count=n, offset=2 * n))
+        else:
+            block = decode_block(payload, n, counts_size, times_size)
+            if block is None:
+                break
+        records.append(block)
+        end += record_header.size + size
+    return header, records, end
+
+
+def read_journal(path):
+    """
+    Read a recording. A torn tail is ignored, the file is not changed.
+
+    :param path: journal file
+    :return: tuple (header, counts, times), see *scan_journal()*
+    """
+    with open(path, "rb") as f:
+        header, records, _ = scan_journal(f)
+    if not records:
+        return header, np.empty(0, dtype=np.int16), np.empty(0)
+    return header, np.concatenate([r[0] for r in records]), np.concatenate([r[1] for r in records])
+
+
+def recover_journal(path):
+    """
+    Cut a journal back to its last complete record, e.g. after the program crashed while writing it.
+
+    :param path: journal file
+    :return: number of samples in the recovered journal, or -1 if the file isn't a journal
+    """
+    with open(path, "r+b") as f:
+        header, records, end = scan_journal(f)
+        if header is None:
+            return -1
+        f.truncate(end)
+        f.flush()
+        os.fsync(f.fileno())
+    return sum(r[0].size for r in records)
+
+
+def recover_recordings(root=recordings_dir):
+    """
+    Recover every recording that wasn't closed cleanly, i.e. still has the partial extension and the process
+    that wrote it is no longer running. Recordings that another running instance of the program is writing
+    are left alone. Call this once at startup, before a new recording is started.
+
+    :param root: directory of the recordings
+    :return: list of the recovered journal files
+    """
+
+    recovered = []
+    if not os.path.isdir(root):
+        return recovered
+
+    for name in sorted(os.listdir(root)):
+        if not name.endswith(partial_extension):
+            continue
+        # the name of the finished recording, and the id of the process writing it.
+        # older versions didn't put the id in the name.
+        finished = name[:-len(partial_extension)]
+        if not finished.endswith(journal_extension):
+            finished, _, pid = finished.rpartition(".")
+            if not finished.endswith(journal_extension) or not pid.isdigit() or process_alive(int(pid)):
+                continue
+
+        path = os.path.join(root, name)
+        try:
+            samples = recover_journal(path)
+            # a file that isn't a journal or holds no samples has nothing worth keeping
+            if samples <= 0:
+                os.remove(path)
+                continue
+            os.replace(path, os.path.join(root, finished))
+            recovered.append(os.path.join(root, finished))
+        except OSError:
+            # leave the file for the next launch
+            pass
+    return recovered
+
+
+class Recording(object):
+    """
+    A recorded run, read back on demand.
+
+    Opening a recording only reads its header. The samples are read the first time they are needed, and every
+    derived column is calculated from the raw counts in one vectorized pass when it is asked for, so a run
+    can be calibrated again with a newer curve or filtered with other settings than it was plotted with.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: journal file, finished (.epj) or not (.epj.<process id>.part)
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self.header = read_header(f)
+        if self.header is None:
+            raise ValueError("not a recording: %s" % path)
+
+        self.sample_rate = self.header["sample_rate"]
+        # wall clock time the run started, in time.time() seconds
+        self.started = self.header["started"]
+        # the calibration curve that was active when the run was started
+        self.calibration = self.header["calibration"]
+        # changes of the curve during the run, read by _load()
+        self._calibration_changes = None
+
+        # raw columns, read by _load()
+        self._counts = None
+        self._times = None
+        # voltages with the recorded calibration, the most common column
+        self._volts = None
+
+    def _load(self):
+        """
+        Read every complete record of the file.
+        """
+        header, self._counts, self._times = read_journal(self.path)
+        self._calibration_changes = header["calibration_changes"]
+
+    def __len__(self):
+        return self.counts.size
+
+    @property
+    def counts(self):
+        """
+        Raw ADC counts, numpy int16 array.
+        """
+        if self._counts is None:
+            self._load()
+        return self._counts
+
+    @property
+    def times(self):
+        """
+        time.monotonic() timestamps of the samples in seconds, numpy float64 array.
+        They are stored to the microsecond.
+        """
+        if self._times is None:
+            self._load()
+        return self._times
+
+    @property
+    def calibration_changes(self):
+        """
+        Every change of the calibration curve during the run, as a list of (after, calibration) tuples:
+        the samples recorded after the time.monotonic() timestamp *after* were calibrated with *calibration*.
+        """
+        if self._calibration_changes is None:
+            self._load()
+        return self._calibration_changes
+
+    @property
+    def elapsed(self):
+        """
+        Seconds since the first sample of the run, numpy float64 array.
+        """
+        times = self.times
+        return times - times[0] if times.size > 0 else times
+
+    def volts(self, segments=None):
+        """
+        Calibrate the counts.
+
+        :param segments: calibration curve as a list of (kind, lower, upper, coefficients) tuples,
+                e.g. from calibration.read_segments(), applied to the whole run. If not given, every sample is
+                calibrated with the curve that was active when it was recorded, like the live plot did.
+        :return: numpy float64 array of voltages
+        """
+        if segments is not None:
+            return counts_to_volts(self.counts, build_table(segments))
+        if self._volts is None:
+            volts = counts_to_volts(self.counts, build_table(self.calibration))
+            for after, curve in self.calibration_changes:
+                start = int(np.searchsorted(self.times, after, side="right"))
+                volts[start:] = counts_to_volts(self.counts[start:], build_table(curve))
+            self._volts = volts
+        return self._volts
+
+    def derivative(self, segments=None):
+        """
+        Differential derivative of the voltages, calculated like the live plot does:
+        the first sample is relative to the 0 V the plot starts from.
+
+        :param segments: calibration curve, see *volts()*
+        :return: numpy float64 array
+        """
+        return np.diff(self.volts(segments), prepend=0.)
+
+    def filtered(self, filter_type, window_samples, segments=None):
+        """
+        Filter the voltages like the live plot does with the same settings.
+
+        :param filter_type: one of settings_interface.filter_types
+        :param window_samples: number of samples the filter uses
+        :param segments: calibration curve, see *volts()*
+        :return: numpy float64 array
+        """
+        return make_filter(filter_type, int(window_samples)).update(self.volts(segments))
+
+    def filtered_derivative(self, filter_type, window_samples, segments=None):
+        """
+        Filter the derivative like the live plot does with the same settings.
+
+        :param filter_type: one of settings_interface.filter_types
+        :param window_samples: number of samples the filter uses
+        :param segments: calibration curve, see *volts()*
+        :return: numpy float64 array
+        """
+        return make_filter(filter_type, int(window_samples)).update(self.derivative(segments))
@@ -0,0 +1,213 @@
+"""
+:platform: Unix, Windows
+:synopsis: This module replays a recorded run through the live plot, in real time or faster, to look at a past etch
+    again or to benchmark the plot without a tool attached. It takes the place of plotGUI.dataSendLoop():
+    the samples go into the plot's ingest queue exactly like the ones read from the ADC.
+
+    Run it from the command line: python replay.py <recording or csv> [1|10|100|max] [matplotlib|qpainter]
+:moduleauthor: Michael Eller <mbe9a@virginia.edu>
+"""
+
+import sys
+import time
+import numpy as np
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtCore import QThread
+from calibration import volts_to_counts
+from recorder import Recording
+from settings_interface import get_sample_rate, get_plot_backend
+
+#: replay speeds offered, as multiples of real time. None replays as fast as the plot takes the samples.
+replay_speeds = [1, 10, 100, None]
+
+
+def load_run(path):
+    """
+    Read a run to replay.
+
+    :param path: a recording (see the recorder module) or a CSV file saved by plotGUI.Ui_Dialog.save_csv().
+            CSV files of older versions only hold voltages, they are turned back into ADC counts with the
+            current calibration.
+    :return: tuple (counts, times, sample rate). *times* are in seconds, increasing.
+    """
+
+    if path.lower().endswith(".csv"):
+        # the columns are found by their names in the header row
+        with open(path, "r") as f:
+            names = f.readline().strip().split(",")
+        if "Counts" in names:
+            data = np.loadtxt(path, delimiter=",", skiprows=1,
+                              usecols=(names.index("Time (s)"), names.index("Counts")), ndmin=2)
+            counts = data[:, 1].astype(np.int16)
+        else:
+            data = np.loadtxt(path, delimiter=",", skiprows=1,
+                              usecols=(names.index("Time (s)"), names.index("Signal (V)")), ndmin=2)
+            counts = volts_to_counts(data[:, 1])
+        # CSV files don't store the sample rate, use the settings file's
+        return counts, data[:, 0], float(get_sample_rate())
+
+    recording = Recording(path)
+    return recording.counts, recording.times, recording.sample_rate
+
+
+def replay_loop(counts, times, queue, speed=None, block_interval=0.1, should_stop=None):
+    """
+    Put the samples of a run into a plot's ingest queue at *speed* times the pace they were recorded at.
+
+    :param counts: numpy array of ADC counts
+    :param times: numpy array of their timestamps in seconds, increasing
+    :param queue: buffers.IngestQueue of the plot
+    :param speed: multiple of real time, None to go as fast as the plot drains the queue.
+            At full speed the loop waits for room in the queue instead of letting its policy drop samples.
+    :param block_interval: seconds between blocks when the replay is paced
+    :param should_stop: function returning True to abort the replay, None to always finish
+    :return: number of samples put into the queue
+    """
+
+    n = counts.size
+    pos = 0
+
+    if speed is None:
+        # as many samples per block as the queue holds, but never so many that one frame stalls the plot
+        block = max(1, min(queue.high_water // 2, 100000))
+        while pos < n and not (should_stop and should_stop()):
+            if queue.pending + block > queue.high_water:
+                time.sleep(0.001)
+                continue
+            queue.put(counts[pos:pos + block], times[pos:pos + block], timeout=0)
+            pos += block
+        return min(pos, n)
+
+    # sample i is due (times[i] - times[0]) / speed seconds after the start
+    start = time.monotonic()
+    while pos < n and not (should_stop and should_stop()):
+        due = times[0] + (time.monotonic() - start) * speed
+        end = int(np.searchsorted(times, due, side="right"))
+        if end > pos:
+            queue.put(counts[pos:end], times[pos:end])
+            pos = end
+        time.sleep(block_interval)
+    return pos
+
+
+class ReplayThread(QThread):
+    """
+    Runs *replay_loop()* next to the GUI thread, like plotGUI.MyThread runs plotGUI.dataSendLoop().
+    """
+
+    def __init__(self, counts, times, queue, speed=None):
+        """
+        :param counts: numpy array of ADC counts
+        :param times: numpy array of their timestamps in seconds
+        :param queue: buffers.IngestQueue of the plot
+        :param speed: multiple of real time, None for as fast as possible
+        """
+        QThread.__init__(self)
+        self.counts = counts
+        self.times = times
+        self.queue = queue
+        self.speed = speed
+        # set to abort the replay
+        self.stop = False
+        # number of samples put into the queue and the seconds it took, set when the replay is done
+        self.fed = 0
+        self.seconds = 0.
+
+    def run(self):
+        """
+        This overrides the parent *run()* method.
+        """
+        start = time.perf_counter()
+        self.fed = replay_loop(self.counts, self.times, self.queue, self.speed, should_stop=lambda: self.stop)
+        self.seconds = time.perf_counter() - start
+
+
+def throughput(plot, samples, seconds):
+    """
+    Summarize how fast the plot took in and drew a replay.
+
+    :param plot: plot_data.PlotData backend the run was replayed into
+    :param samples: number of samples replayed
+    :param seconds: wall clock time from the start of the replay until the plot had drawn the last sample
+    :return: dict with the samples, seconds, ingest rate (samples / s), frames, frame rate (frames / s),
+            mean draw time (ms) and the samples dropped by the ingest queue
+    """
+    seconds = max(seconds, 1e-9)
+    return {"samples": samples, "seconds": seconds, "ingest_rate": plot.addedData.drained / seconds,
+            "frames": plot.frames, "frame_rate": plot.frames / seconds,
+            "mean_draw_ms": plot.draw_total / plot.frames if plot.frames > 0 else 0.,
+            "dropped": plot.addedData.dropped}
+
+
+def replay(path, speed=None, backend=None):
+    """
+    Open a window with the live plot and replay a run into it. Returns once the plot has drawn the whole run
+    or the window was closed.
+
+    :param path: recording or CSV file, see *load_run()*
+    :param speed: multiple of real time, None for as fast as possible
+    :param backend: one of settings_interface.plot_backends, the one in the settings file if not given
+    :return: dict from *throughput()*
+    """
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+    counts, times, _ = load_run(path)
+
+    # the same backends the plot window uses, imported when used since matplotlib takes a while to load
+    if backend is None:
+        backend = get_plot_backend()
+    if backend == "qpainter":
+        from painter_canvas import PainterCanvas
+        plot = PainterCanvas()
+    else:
+        from animation import CustomFigCanvas
+        plot = CustomFigCanvas()
+
+    Dialog = QtWidgets.QDialog()
+    Dialog.setWindowTitle("Replay")
+    Dialog.resize(1000, 700)
+    Dialog.setWindowIcon(QtGui.QIcon('resources/laser.ico'))
+    layout = QtWidgets.QGridLayout(Dialog)
+    layout.addWidget(plot, 0, 0, 1, 1)
+
+    thread = ReplayThread(counts, times, plot.addedData, speed)
+    start = time.perf_counter()
+    result = {}
+
+    def check_done():
+        # done once every sample was fed and the plot has taken it out of the queue
+        if thread.isFinished() and not plot.has_new_data() and not plot.frame_needed:
+            result.update(throughput(plot, thread.fed, time.perf_counter() - start))
+            Dialog.accept()
+
+    timer = QtCore.QTimer(Dialog)
+    timer.timeout.connect(check_done)
+    timer.start(50)
+
+    thread.start()
+    Dialog.exec_()
+
+    # closing the window early aborts the replay
+    thread.stop = True
+    thread.wait()
+    timer.stop()
+    if not result:
+        result.update(throughput(plot, thread.fed, time.perf_counter() - start))
+    layout.removeWidget(plot)
+    plot.setParent(None)
+    plot.close()
+    return result
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python replay.py <recording or csv> [1|10|100|max] [matplotlib|qpainter]")
+        sys.exit(1)
+    speed = None if len(sys.argv) < 3 or sys.argv[2] == "max" else float(sys.argv[2])
+    backend = sys.argv[3] if len(sys.argv) > 3 else None
+
+    stats = replay(sys.argv[1], speed, backend)
+    print("replayed %d samples in %.2f s" % (stats["samples"], stats["seconds"]))
+    print("ingest: %.0f samples/s, %d dropped" % (stats["ingest_rate"], stats["dropped"]))
+    print("draw: %d frames, %.1f frames/s, %.1f ms per frame" % (stats["frames"], stats["frame_rate"],
+                                                                 stats["mean_draw_ms"]))
@@ -1,12 +1,14 @@
 """
 :platform: Unix, Windows
 :synopsis: This module is mostly generated code from QtDesigner. It describes the format of the settings
-    dialog for editing the sample rate of the serial connection to the ADC.
+    dialog for editing the sample rate and acquisition mode of the serial connection to the ADC.
 :moduleauthor: Michael Eller <mbe9a@virginia.edu>
 """
 
 from PyQt5 import QtCore, QtGui, QtWidgets
-from settings_interface import set_sample_rate, get_sample_rate
+from settings_interface import set_sample_rate, get_sample_rate, set_acquisition_mode, get_acquisition_mode, \
+    acquisition_modes, set_batch_size, get_batch_size, set_acquisition_backend, get_acquisition_backend, \
+    acquisition_backends
 
 
 class Ui_Dialog(object):
@@ -46,6 +48,44 @@ class Ui_Dialog(object):
         self.sample_rate_input.setObjectName("sample_rate_input")
         self.gridLayout.addWidget(self.sample_rate_input, 2, 0, 1, 1)
 
+        # create a label for the acquisition mode selection
+        self.label_mode = QtWidgets.QLabel(Dialog)
+        self.label_mode.setObjectName("label_mode")
+        self.gridLayout.addWidget(self.label_mode, 4, 0, 1, 1)
+
+        # create the drop down for the acquisition mode.
+        # streaming needs newer firmware, polled works with every version.
+        self.acquisition_mode_input = QtWidgets.QComboBox(Dialog)
+        self.acquisition_mode_input.addItems(acquisition_modes)
+        self.acquisition_mode_input.setCurrentText(get_acquisition_mode())
+        self.acquisition_mode_input.setObjectName("acquisition_mode_input")
+        self.gridLayout.addWidget(self.acquisition_mode_input, 5, 0, 1, 1)
+
+        # create a label for the batch size input box
+        self.label_batch = QtWidgets.QLabel(Dialog)
+        self.label_batch.setObjectName("label_batch")
+        self.gridLayout.addWidget(self.label_batch, 4, 1, 1, 1)
+
+        # create the input box for the number of samples per request in the batched mode
+        self.batch_size_input = QtWidgets.QSpinBox(Dialog)
+        self.batch_size_input.setMinimum(1)
+        self.batch_size_input.setMaximum(100)
+        self.batch_size_input.setValue(get_batch_size())
+        self.batch_size_input.setObjectName("batch_size_input")
+        self.gridLayout.addWidget(self.batch_size_input, 5, 1, 1, 1)
+
+        # create a label for the acquisition backend selection
+        self.label_backend = QtWidgets.QLabel(Dialog)
+        self.label_backend.setObjectName("label_backend")
+        self.gridLayout.addWidget(self.label_backend, 4, 2, 1, 1)
+
+        # create the drop down for where the acquisition loop runs
+        self.acquisition_backend_input = QtWidgets.QComboBox(Dialog)
+        self.acquisition_backend_input.addItems(acquisition_backends)
+        self.acquisition_backend_input.setCurrentText(get_acquisition_backend())
+        self.acquisition_backend_input.setObjectName("acquisition_backend_input")
+        self.gridLayout.addWidget(self.acquisition_backend_input, 5, 2, 1, 1)
+
         # create a save and cancel button, these are built in buttons that emit specific signals
         self.settings_sample_rate_box = QtWidgets.QDialogButtonBox(Dialog)
         self.settings_sample_rate_box.setOrientation(QtCore.Qt.Horizontal)
@@ -89,6 +129,9 @@ class Ui_Dialog(object):
         # set the window title and label text
         Dialog.setWindowTitle(_translate("Dialog", "Settings - Sample Rate"))
         self.label.setText(_translate("Dialog", "Sample Rate (samples / second)"))
+        self.label_mode.setText(_translate("Dialog", "Acquisition Mode"))
+        self.label_batch.setText(_translate("Dialog", "Batch Size (samples / request)"))
+        self.label_backend.setText(_translate("Dialog", "Run Acquisition In"))
 
     def save(self, Dialog):
         """
@@ -102,6 +145,15 @@ class Ui_Dialog(object):
         # save it
         set_sample_rate(rate)
 
+        # get the acquisition mode from the drop down and save it
+        set_acquisition_mode(self.acquisition_mode_input.currentText())
+
+        # get the batch size from the input box and save it
+        set_batch_size(self.batch_size_input.value())
+
+        # get the acquisition backend from the drop down and save it
+        set_acquisition_backend(self.acquisition_backend_input.currentText())
+
         # close the window
         Dialog.accept()
 
@@ -6,7 +6,8 @@
 """
 
 from PyQt5 import QtCore, QtGui, QtWidgets
-from settings_interface import set_x_axis_size, get_x_axis_size, set_y_axis_min, get_y_axis_min, set_y_axis_max, get_y_axis_max
+from settings_interface import set_x_axis_size, get_x_axis_size, set_y_axis_min, get_y_axis_min, set_y_axis_max, get_y_axis_max, \
+    set_plot_backend, get_plot_backend, plot_backends
 
 
 class Ui_Dialog(object):
@@ -88,6 +89,18 @@ class Ui_Dialog(object):
         self.xaxis_scale_input.setObjectName("xaxis_scale_input")
         self.gridLayout.addWidget(self.xaxis_scale_input, 3, 0, 1, 1)
 
+        # create a label for the plotting backend selection
+        self.label_backend = QtWidgets.QLabel(Dialog)
+        self.label_backend.setObjectName("label_backend")
+        self.gridLayout.addWidget(self.label_backend, 10, 0, 1, 1)
+
+        # create the drop down for the plotting backend
+        self.plot_backend_input = QtWidgets.QComboBox(Dialog)
+        self.plot_backend_input.addItems(plot_backends)
+        self.plot_backend_input.setCurrentText(get_plot_backend())
+        self.plot_backend_input.setObjectName("plot_backend_input")
+        self.gridLayout.addWidget(self.plot_backend_input, 11, 0, 1, 1)
+
         # create a save and cancel button, these are built in buttons that emit specific signals
         self.settings_axis_scale_buttons = QtWidgets.QDialogButtonBox(Dialog)
         self.settings_axis_scale_buttons.setOrientation(QtCore.Qt.Horizontal)
@@ -123,6 +136,7 @@ class Ui_Dialog(object):
         self.label_2.setText(_translate("Dialog", "Y-Axis, Min."))
         self.label.setText(_translate("Dialog", "X-Axis, total time in seconds that the window will show."))
         self.label_3.setText(_translate("Dialog", "Y-Axis, Max."))
+        self.label_backend.setText(_translate("Dialog", "Draw Plot With (takes effect when the plot opens)"))
 
     def save(self, Dialog):
         """
@@ -141,6 +155,9 @@ class Ui_Dialog(object):
         set_y_axis_min(ymin)
         set_y_axis_max(ymax)
 
+        # get the plotting backend from the drop down and save it
+        set_plot_backend(self.plot_backend_input.currentText())
+
         # close the window
         Dialog.accept()
 
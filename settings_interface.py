@@ -9,11 +9,41 @@ import csv
 import os
 
 #: static fieldnames for the settings dict / csv file
-fieldnames = ["window_samples", "sample_rate", "x_axis_size", "y_axis_min", "y_axis_max"]
+fieldnames = ["window_samples", "sample_rate", "x_axis_size", "y_axis_min", "y_axis_max", "acquisition_mode",
+              "batch_size", "acquisition_backend", "queue_high_water", "queue_policy",
+              "calibration_tool", "calibration_board", "filter_type", "min_frame_interval", "max_frame_interval",
+              "plot_backend", "history_dtype", "history_hot_chunks"]
 
-#: default number of samples to average in a moving average filter
+#: acquisition modes understood by the acquisition module.
+#: 'polled' is the original request / reply protocol and works with every firmware version.
+acquisition_modes = ["polled", "batched", "streaming"]
+
+#: where the acquisition loop runs. 'process' keeps the serial reads out of the GUI process entirely.
+acquisition_backends = ["thread", "process"]
+
+#: streaming filters the plot can apply to the signal and its derivative, see the filters module
+filter_types = ["moving-average", "ema", "median", "savitzky-golay"]
+
+#: what draws the live plot. 'qpainter' is much lighter than matplotlib, images are always saved with matplotlib.
+plot_backends = ["matplotlib", "qpainter"]
+
+#: precision of the recorded history of a run. 'float32' halves the memory of long runs, its 7 significant digits
+#: are still far more than the 10-bit ADC delivers.
+history_dtypes = ["float64", "float32"]
+
+#: what the plot's ingest queue does when a new block would push it over its high-water mark.
+#:
+#:  *   'block': the producer waits for the plot to catch up, nothing is dropped
+#:  *   'drop-oldest': the oldest queued blocks are dropped to make room
+#:  *   'coalesce': the new block is averaged down until it fits, keeping its whole time span at lower resolution
+queue_policies = ["block", "drop-oldest", "coalesce"]
+
+#: default number of samples used by the window filter
 default_window_samples = 1
 
+#: default kind of filter
+default_filter_type = "moving-average"
+
 #: default sample rate in samples / sec
 default_sample_rate = 10
 
@@ -26,6 +56,40 @@ default_y_axis_min = 0
 #: default y-axis maximum in volts
 default_y_axis_max = 60
 
+#: default acquisition mode, polled is the safe choice for old firmware
+default_acquisition_mode = "polled"
+
+#: default number of samples returned by one request in the batched acquisition mode
+default_batch_size = 10
+
+#: default acquisition backend
+default_acquisition_backend = "thread"
+
+#: default number of samples the plot's ingest queue holds before its overflow policy applies
+default_queue_high_water = 10000
+
+#: default overflow policy of the plot's ingest queue
+default_queue_policy = "drop-oldest"
+
+#: default bounds of the plot's frame interval in ms. The plot picks an interval in between depending on
+#: how long it takes to draw a frame.
+default_min_frame_interval = 50
+default_max_frame_interval = 500
+
+#: default plotting backend
+default_plot_backend = "matplotlib"
+
+#: default precision of the recorded history
+default_history_dtype = "float64"
+
+#: default number of chunks (64k values each) of every history column that stay in memory,
+#: older ones are moved to disk
+default_history_hot_chunks = 8
+
+#: default tool and board to look up in the calibration file (see calibration.calibration_file)
+default_calibration_tool = "default"
+default_calibration_board = "default"
+
 #: slope of V_measured vs. V_in for V_in < 10 V
 m1 = 14.3
 
@@ -39,6 +103,23 @@ m2 = 14.976
 b2 = -3.7
 
 
+def get_default_settings():
+    """
+    Build the dict of default settings.
+
+    :return: Dict object containing the default value for every field in *fieldnames*.
+    """
+    return {fieldnames[0]: default_window_samples, fieldnames[1]: default_sample_rate,
+            fieldnames[2]: default_x_axis_size, fieldnames[3]: default_y_axis_min,
+            fieldnames[4]: default_y_axis_max, fieldnames[5]: default_acquisition_mode,
+            fieldnames[6]: default_batch_size, fieldnames[7]: default_acquisition_backend,
+            fieldnames[8]: default_queue_high_water, fieldnames[9]: default_queue_policy,
+            fieldnames[10]: default_calibration_tool, fieldnames[11]: default_calibration_board,
+            fieldnames[12]: default_filter_type, fieldnames[13]: default_min_frame_interval,
+            fieldnames[14]: default_max_frame_interval, fieldnames[15]: default_plot_backend,
+            fieldnames[16]: default_history_dtype, fieldnames[17]: default_history_hot_chunks}
+
+
 def generate_plotting_configuration_file():
     """
     Will write a new plot configuration (settings) file in the appropriate location.
@@ -47,11 +128,7 @@ def generate_plotting_configuration_file():
     """
 
     # open and write a csv file with the default settings
-    with open("resources/plot_configuration.csv", "w") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writerow({fieldnames[0]: default_window_samples, fieldnames[1]: default_sample_rate,
-                         fieldnames[2]: default_x_axis_size, fieldnames[3]: default_y_axis_min,
-                         fieldnames[4]: default_y_axis_max})
+    save_plotting_configuration(get_default_settings())
 
 
 def read_plotting_configuration():
@@ -70,7 +147,14 @@ def read_plotting_configuration():
     with open("resources/plot_configuration.csv", "r") as csvfile:
         reader = csv.DictReader(csvfile, fieldnames=fieldnames)
         settings = next(reader)
-        return settings
+
+    # settings files written by older versions have fewer columns,
+    # fill in the missing settings with their defaults
+    defaults = get_default_settings()
+    for name in fieldnames:
+        if settings[name] is None or settings[name] == "":
+            settings[name] = defaults[name]
+    return settings
 
 
 def save_plotting_configuration(settings):
@@ -83,21 +167,19 @@ def save_plotting_configuration(settings):
     # open the file and overwrite with the settings dict
     with open("resources/plot_configuration.csv", "w") as csvfile:
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writerow({fieldnames[0]: settings[fieldnames[0]], fieldnames[1]: settings[fieldnames[1]],
-                         fieldnames[2]: settings[fieldnames[2]], fieldnames[3]: settings[fieldnames[3]],
-                         fieldnames[4]: settings[fieldnames[4]]})
+        writer.writerow({name: settings[name] for name in fieldnames})
 
 
 def set_window_samples(num):
     """
-    Sets the number of samples to use in the moving average filter.
+    Sets the number of samples to use in the filter.
 
-    :param num: number of samples
+    :param num: number of samples. 1 <= num <= 500.
     :return: bool indicating whether or not the operation was successful
     """
 
     # check if num is within limits
-    if num < 1 or num > 8:
+    if num < 1 or num > 500:
         return False
 
     # get the current settings
@@ -123,6 +205,43 @@ def get_window_samples():
     return int(num)
 
 
+def set_filter_type(kind):
+    """
+    Sets the kind of filter applied to the signal and its derivative.
+
+    :param kind: one of *filter_types*
+    :return: bool indicating whether or not the operation was successful
+    """
+
+    # check if the filter is one we know how to handle
+    if kind not in filter_types:
+        return False
+
+    # get the current settings
+    settings = read_plotting_configuration()
+    # alter the filter type setting
+    settings[fieldnames[12]] = kind
+    # save it
+    save_plotting_configuration(settings)
+    return True
+
+
+def get_filter_type():
+    """
+    Read the saved filter type setting from the file.
+
+    :return: saved filter type (string)
+    """
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # get the filter type, fall back to the default for unknown values
+    kind = settings[fieldnames[12]]
+    if kind not in filter_types:
+        return default_filter_type
+    return kind
+
+
 def set_sample_rate(rate):
     """
     Set the sample rate and save it in the settings file.
@@ -158,6 +277,41 @@ def get_sample_rate():
     return float(rate)
 
 
+def set_batch_size(num):
+    """
+    Set the number of buffered samples the ADC returns per request in the batched acquisition mode.
+
+    :param num: samples per request. 1 <= num <= 100.
+    :return: bool indicating whether or not the operation was successful.
+    """
+
+    # check if the number is in the allowed range
+    if num < 1 or num > 100:
+        return False
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # set the batch size portion
+    settings[fieldnames[6]] = num
+    # rewrite the file with the new settings
+    save_plotting_configuration(settings)
+    return True
+
+
+def get_batch_size():
+    """
+    Get the number of samples the ADC returns per request in the batched acquisition mode.
+
+    :return: batch size (int)
+    """
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # get the batch size and return it
+    num = settings[fieldnames[6]]
+    return int(num)
+
+
 def set_x_axis_size(size):
     """
     Set the total width of the live plot in seconds. The number of samples depends on this and the sample rate.
@@ -263,6 +417,388 @@ def get_y_axis_max():
     return float(maximum)
 
 
+def set_acquisition_mode(mode):
+    """
+    Set the protocol used to acquire data from the ADC.
+
+    :param mode: one of *acquisition_modes*. 'batched' and 'streaming' require firmware that can buffer samples.
+    :return: bool indicating whether or not the operation was successful
+    """
+
+    # check if the mode is one we know how to handle
+    if mode not in acquisition_modes:
+        return False
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # set the acquisition mode in the dict and save it
+    settings[fieldnames[5]] = mode
+    save_plotting_configuration(settings)
+    return True
+
+
+def get_acquisition_mode():
+    """
+    Get the protocol used to acquire data from the ADC.
+
+    :return: acquisition mode (string)
+    """
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # get the acquisition mode, fall back to the default for unknown values
+    mode = settings[fieldnames[5]]
+    if mode not in acquisition_modes:
+        return default_acquisition_mode
+    return mode
+
+
+def set_acquisition_backend(backend):
+    """
+    Set where the acquisition loop runs, in a thread of the GUI process or in a separate process.
+
+    :param backend: one of *acquisition_backends*
+    :return: bool indicating whether or not the operation was successful
+    """
+
+    # check if the backend is one we know how to handle
+    if backend not in acquisition_backends:
+        return False
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # set the acquisition backend in the dict and save it
+    settings[fieldnames[7]] = backend
+    save_plotting_configuration(settings)
+    return True
+
+
+def get_acquisition_backend():
+    """
+    Get where the acquisition loop runs.
+
+    :return: acquisition backend (string)
+    """
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # get the acquisition backend, fall back to the default for unknown values
+    backend = settings[fieldnames[7]]
+    if backend not in acquisition_backends:
+        return default_acquisition_backend
+    return backend
+
+
+def set_queue_high_water(num):
+    """
+    Set the number of samples the plot's ingest queue may hold before its overflow policy applies.
+
+    :param num: high-water mark in samples. 100 <= num <= 1000000.
+    :return: bool indicating whether or not the operation was successful
+    """
+
+    # check if num is within limits
+    if num < 100 or num > 1000000:
+        return False
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # set the high-water mark in the dict and save it
+    settings[fieldnames[8]] = num
+    save_plotting_configuration(settings)
+    return True
+
+
+def get_queue_high_water():
+    """
+    Get the number of samples the plot's ingest queue may hold before its overflow policy applies.
+
+    :return: high-water mark (int)
+    """
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # get the high-water mark
+    num = settings[fieldnames[8]]
+    return int(num)
+
+
+def set_queue_policy(policy):
+    """
+    Set what the plot's ingest queue does when it reaches its high-water mark.
+
+    :param policy: one of *queue_policies*
+    :return: bool indicating whether or not the operation was successful
+    """
+
+    # check if the policy is one we know how to handle
+    if policy not in queue_policies:
+        return False
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # set the policy in the dict and save it
+    settings[fieldnames[9]] = policy
+    save_plotting_configuration(settings)
+    return True
+
+
+def get_queue_policy():
+    """
+    Get what the plot's ingest queue does when it reaches its high-water mark.
+
+    :return: overflow policy (string)
+    """
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # get the policy, fall back to the default for unknown values
+    policy = settings[fieldnames[9]]
+    if policy not in queue_policies:
+        return default_queue_policy
+    return policy
+
+
+def set_min_frame_interval(interval):
+    """
+    Set the shortest time between plot updates.
+
+    :param interval: interval in ms. 10 <= interval <= maximum frame interval.
+    :return: bool indicating whether or not the operation was successful
+    """
+
+    # check if the interval is within limits
+    if interval < 10 or interval > get_max_frame_interval():
+        return False
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # set the interval in the dict and save it
+    settings[fieldnames[13]] = interval
+    save_plotting_configuration(settings)
+    return True
+
+
+def get_min_frame_interval():
+    """
+    Get the shortest time between plot updates.
+
+    :return: interval in ms (int)
+    """
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # get the interval
+    interval = settings[fieldnames[13]]
+    return int(interval)
+
+
+def set_max_frame_interval(interval):
+    """
+    Set the longest time between plot updates.
+
+    :param interval: interval in ms. minimum frame interval <= interval <= 5000.
+    :return: bool indicating whether or not the operation was successful
+    """
+
+    # check if the interval is within limits
+    if interval < get_min_frame_interval() or interval > 5000:
+        return False
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # set the interval in the dict and save it
+    settings[fieldnames[14]] = interval
+    save_plotting_configuration(settings)
+    return True
+
+
+def get_max_frame_interval():
+    """
+    Get the longest time between plot updates.
+
+    :return: interval in ms (int)
+    """
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # get the interval
+    interval = settings[fieldnames[14]]
+    return int(interval)
+
+
+def set_plot_backend(backend):
+    """
+    Set what draws the live plot.
+
+    :param backend: one of *plot_backends*
+    :return: bool indicating whether or not the operation was successful
+    """
+
+    # check if the backend is one we know how to handle
+    if backend not in plot_backends:
+        return False
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # set the backend in the dict and save it
+    settings[fieldnames[15]] = backend
+    save_plotting_configuration(settings)
+    return True
+
+
+def get_plot_backend():
+    """
+    Get what draws the live plot.
+
+    :return: one of *plot_backends*, matplotlib if the setting is invalid
+    """
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # get the backend
+    backend = settings[fieldnames[15]]
+    if backend not in plot_backends:
+        return default_plot_backend
+    return backend
+
+
+def set_history_dtype(dtype):
+    """
+    Set the precision of the recorded history of a run.
+
+    :param dtype: one of *history_dtypes*
+    :return: bool indicating whether or not the operation was successful
+    """
+
+    # check if the precision is one we know how to handle
+    if dtype not in history_dtypes:
+        return False
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # set the precision in the dict and save it
+    settings[fieldnames[16]] = dtype
+    save_plotting_configuration(settings)
+    return True
+
+
+def get_history_dtype():
+    """
+    Get the precision of the recorded history of a run.
+
+    :return: one of *history_dtypes*, float64 if the setting is invalid
+    """
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # get the precision
+    dtype = settings[fieldnames[16]]
+    if dtype not in history_dtypes:
+        return default_history_dtype
+    return dtype
+
+
+def set_history_hot_chunks(num):
+    """
+    Set how many chunks of every history column stay in memory before older ones are moved to disk.
+
+    :param num: number of chunks. 1 <= num <= 1000.
+    :return: bool indicating whether or not the operation was successful
+    """
+
+    # check if num is within limits
+    if num < 1 or num > 1000:
+        return False
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # set the number of chunks in the dict and save it
+    settings[fieldnames[17]] = num
+    save_plotting_configuration(settings)
+    return True
+
+
+def get_history_hot_chunks():
+    """
+    Get how many chunks of every history column stay in memory before older ones are moved to disk.
+
+    :return: number of chunks (int)
+    """
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # get the number of chunks
+    num = settings[fieldnames[17]]
+    return int(num)
+
+
+def set_calibration_tool(tool):
+    """
+    Set the tool whose calibration curve is used to turn ADC counts into voltages.
+
+    :param tool: tool name as it appears in the calibration file
+    :return: bool indicating whether or not the operation was successful
+    """
+
+    # the name can't be empty or contain the csv delimiter
+    if len(tool) == 0 or "," in tool:
+        return False
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # set the tool in the dict and save it
+    settings[fieldnames[10]] = tool
+    save_plotting_configuration(settings)
+    return True
+
+
+def get_calibration_tool():
+    """
+    Get the tool whose calibration curve is used to turn ADC counts into voltages.
+
+    :return: tool name (string)
+    """
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # get the tool name
+    return settings[fieldnames[10]]
+
+
+def set_calibration_board(board):
+    """
+    Set the ADC board whose calibration curve is used to turn ADC counts into voltages.
+
+    :param board: board name as it appears in the calibration file
+    :return: bool indicating whether or not the operation was successful
+    """
+
+    # the name can't be empty or contain the csv delimiter
+    if len(board) == 0 or "," in board:
+        return False
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # set the board in the dict and save it
+    settings[fieldnames[11]] = board
+    save_plotting_configuration(settings)
+    return True
+
+
+def get_calibration_board():
+    """
+    Get the ADC board whose calibration curve is used to turn ADC counts into voltages.
+
+    :return: board name (string)
+    """
+
+    # read in the file
+    settings = read_plotting_configuration()
+    # get the board name
+    return settings[fieldnames[11]]
+
+
 def save_port_configuration(port):
     """
     This function sets the separate file that indicates which serial port to use.
@@ -0,0 +1,193 @@
+"""
+:platform: Unix, Windows
+:synopsis: This module contains a ring buffer in shared memory. An acquisition process writes raw ADC counts
+    and their timestamps into it and the plot reads them back without any Qt signal or pickling in between.
+:moduleauthor: Michael Eller <mbe9a@virginia.edu>
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+
+#: default number of samples the ring buffer can hold before the oldest are overwritten
+default_capacity = 65536
+
+# header layout (int64): total samples written, capacity, scheduler samples, scheduler overruns
+_header_size = 4
+# stats layout (float64): mean jitter in ms, max jitter in ms
+_stats_size = 2
+# bytes of the error message of the writer, UTF-8 padded with zeros
+_error_size = 512
+
+
+class SharedRingBuffer(object):
+    """
+    Single writer / single reader ring buffer of (ADC count, timestamp) pairs in shared memory.
+
+    The writer stores the samples first and only then publishes the new total in the header,
+    so a reader never sees a count for data that hasn't been written yet. Every reader keeps its own position
+    (the total it has read up to), so several buffers can be created for several acquisition processes.
+    """
+
+    def __init__(self, name=None, capacity=default_capacity):
+        """
+        Create a new ring buffer, or attach to an existing one if *name* is given.
+
+        :param name: name of an existing buffer (see *name*), None to create a new one
+        :param capacity: number of samples held by a new buffer, ignored when attaching
+        """
+
+        # the owner is responsible for unlinking the shared memory block
+        self.owner = name is None
+
+        if self.owner:
+            size = 8 * (_header_size + _stats_size) + _error_size + capacity * (2 + 8)
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+
+        # the header holds the write position and the capacity
+        self._header = np.ndarray((_header_size,), dtype=np.int64, buffer=self._shm.buf)
+        if self.owner:
+            self._header[:] = 0
+            self._header[1] = capacity
+        self.capacity = int(self._header[1])
+
+        # the remaining layout depends on the capacity
+        offset = 8 * _header_size
+        self._stats = np.ndarray((_stats_size,), dtype=np.float64, buffer=self._shm.buf, offset=offset)
+        offset += 8 * _stats_size
+        self._error = np.ndarray((_error_size,), dtype=np.uint8, buffer=self._shm.buf, offset=offset)
+        if self.owner:
+            self._error[:] = 0
+        offset += _error_size
+        self._times = np.ndarray((self.capacity,), dtype=np.float64, buffer=self._shm.buf, offset=offset)
+        offset += 8 * self.capacity
+        self._counts = np.ndarray((self.capacity,), dtype=np.int16, buffer=self._shm.buf, offset=offset)
+
+    @property
+    def name(self):
+        """
+        Name of the shared memory block, pass it to another process to attach to this buffer.
+        """
+        return self._shm.name
+
+    @property
+    def total(self):
+        """
+        Total number of samples written since the buffer was created.
+        """
+        return int(self._header[0])
+
+    def write(self, counts, times):
+        """
+        Append samples to the buffer, overwriting the oldest ones if it is full. Only one process may write.
+
+        :param counts: array of raw ADC counts
+        :param times: array of timestamps (time.monotonic() seconds), same length as *counts*
+        """
+
+        counts = np.asarray(counts)
+        times = np.asarray(times)
+        written = counts.size
+        if written == 0:
+            return
+
+        # a block longer than the buffer would overwrite its own start, only its newest samples are kept
+        counts = counts[-self.capacity:]
+        times = times[-self.capacity:]
+        n = counts.size
+
+        # position of the first stored sample, the block may wrap around the end
+        start = (self.total + written - n) % self.capacity
+        first = min(n, self.capacity - start)
+        self._counts[start:start + first] = counts[:first]
+        self._times[start:start + first] = times[:first]
+        self._counts[:n - first] = counts[first:]
+        self._times[:n - first] = times[first:]
+
+        # publish the new samples
+        self._header[0] += written
+
+    def read(self, position):
+        """
+        Copy every sample written after *position*.
+        If the reader fell more than *capacity* samples behind, the overwritten samples are skipped.
+
+        :param position: total number of samples the caller has already read
+        :return: tuple (counts, times, new position, number of samples lost)
+        """
+
+        total = self.total
+        lost = max(0, total - position - self.capacity)
+        position += lost
+        n = total - position
+        if n == 0:
+            return np.empty(0, dtype=np.int16), np.empty(0, dtype=np.float64), position, lost
+
+        # gather the samples in order, the range may wrap around the end
+        index = np.arange(position, total) % self.capacity
+        counts = self._counts[index]
+        times = self._times[index]
+
+        # the writer may have overwritten the oldest samples while we were copying them
+        overwritten = max(0, self.total - position - self.capacity)
+        if overwritten > 0:
+            counts = counts[overwritten:]
+            times = times[overwritten:]
+            lost += overwritten
+
+        return counts, times, total, lost
+
+    def publish_stats(self, stats):
+        """
+        Store the acquisition scheduler's timing statistics so the reader can show them.
+
+        :param stats: dict returned by acquisition.DeadlineScheduler.stats()
+        """
+        self._stats[0] = stats["mean_jitter_ms"]
+        self._stats[1] = stats["max_jitter_ms"]
+        self._header[2] = stats["samples"]
+        self._header[3] = stats["overruns"]
+
+    def stats(self):
+        """
+        Read the timing statistics published by the writer.
+
+        :return: dict in the same format as acquisition.DeadlineScheduler.stats()
+        """
+        return {"samples": int(self._header[2]), "overruns": int(self._header[3]),
+                "mean_jitter_ms": float(self._stats[0]), "max_jitter_ms": float(self._stats[1])}
+
+    def publish_error(self, message):
+        """
+        Store the reason the writer stopped, so the reader can report it. Only the first error is kept.
+
+        :param message: error message
+        """
+        if self._error[0] != 0:
+            return
+        data = message.encode("utf-8", errors="replace")[:_error_size - 1] or b"?"
+        # the first byte goes last, the message only counts as published once it is set
+        self._error[1:len(data)] = np.frombuffer(data[1:], dtype=np.uint8)
+        self._error[0] = data[0]
+
+    def error(self):
+        """
+        Read the error published by the writer.
+
+        :return: the error message, None if there was none
+        """
+        if self._error[0] == 0:
+            return None
+        return self._error.tobytes().split(b"\0", 1)[0].decode("utf-8", errors="replace")
+
+    def close(self):
+        """
+        Detach from the shared memory. The owner also frees it.
+        """
+
+        # the numpy views must go before the memory block can be closed
+        del self._header, self._stats, self._error, self._times, self._counts
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
@@ -1,18 +1,18 @@
 """
 :platform: Unix, Windows
 :synopsis: This module is mostly generated code from QtDesigner. It describes the format of the settings
-    dialog for editing the number of samples used in the window filter.
+    dialog for editing the kind of window filter and the number of samples it uses.
 :moduleauthor: Michael Eller <mbe9a@virginia.edu>
 """
 
 from PyQt5 import QtCore, QtGui, QtWidgets
-from settings_interface import set_window_samples, get_window_samples
+from settings_interface import set_window_samples, get_window_samples, set_filter_type, get_filter_type, filter_types
 
 
 class Ui_Dialog(object):
     """
     The graphical structure of this *Ui_Dialog* was generated by QtDesigner.
-    The window allows the user to set the number of samples used in the moving average filter.
+    The window allows the user to set the kind of filter and the number of samples it uses.
     """
 
     def setupUi(self, Dialog):
@@ -50,7 +50,7 @@ class Ui_Dialog(object):
         # create the input box for the number of samples
         self.spinBox = QtWidgets.QSpinBox(Dialog)
         self.spinBox.setMinimum(1)
-        self.spinBox.setMaximum(8)
+        self.spinBox.setMaximum(500)
         self.spinBox.setObjectName("spinBox")
         num = int(get_window_samples())
         self.spinBox.setValue(num)
@@ -61,6 +61,18 @@ class Ui_Dialog(object):
         self.label.setObjectName("label")
         self.gridLayout.addWidget(self.label, 1, 3, 1, 1)
 
+        # create a label for the filter type
+        self.label_type = QtWidgets.QLabel(Dialog)
+        self.label_type.setObjectName("label_type")
+        self.gridLayout.addWidget(self.label_type, 1, 1, 1, 1)
+
+        # create the drop down for the filter type
+        self.comboBox = QtWidgets.QComboBox(Dialog)
+        self.comboBox.addItems(filter_types)
+        self.comboBox.setCurrentText(get_filter_type())
+        self.comboBox.setObjectName("comboBox")
+        self.gridLayout.addWidget(self.comboBox, 2, 1, 1, 1)
+
         # move the objects over to Dialog and set the text
         self.retranslateUi(Dialog)
 
@@ -87,6 +99,7 @@ class Ui_Dialog(object):
         # set the window title and label text
         Dialog.setWindowTitle(_translate("Dialog", "Settings - Window Filter"))
         self.label.setText(_translate("Dialog", "Number of Samples"))
+        self.label_type.setText(_translate("Dialog", "Filter"))
 
     def save(self, Dialog):
         """
@@ -101,6 +114,9 @@ class Ui_Dialog(object):
         # save it
         set_window_samples(num)
 
+        # get the filter type from the drop down and save it
+        set_filter_type(self.comboBox.currentText())
+
         # close the window
         Dialog.accept()
 